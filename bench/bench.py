@@ -0,0 +1,400 @@
+#!/usr/bin/env python2
+"""
+Benchmarks nflcmd against a synthetic nfldb database.
+
+The database given by `--database` must either be empty, in which case
+it is filled by `fixture.populate` using `--seasons`, `--players` and
+`--plays-per-game`, or it must have been filled by an earlier run (use
+`--rebuild` to start over with new parameters).
+
+Every case is run `--repeat` times in its own process, so that the
+peak memory reported for a case is its own and so that the first
+repetition starts cold (i.e., without any in-process memoization or
+saved name index). The query cache in `nflcmd.cache` is disabled unless
+`--cache` is given. For each case, the wall time of every repetition
+is recorded along with the number of queries issued (as counted by
+`nflcmd.profile`) and the peak resident memory of the process.
+Independent queries are run on `--jobs` connections at once (see
+`nflcmd.executor`).
+
+Results are written as JSON with `--out`. Two result files can be
+compared with `--compare`, which prints the change of each case:
+
+    python2 bench/bench.py --out before.json
+    # ... hack hack hack ...
+    python2 bench/bench.py --out after.json --compare before.json
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import nfldb
+
+import nflcmd
+import nflcmd.cmds.rank
+import nflcmd.cmds.stats
+import nflcmd.executor
+import nflcmd.matrix
+
+import fixture
+
+version = 1
+"""The version of the format of the JSON results."""
+
+limits = [10, 100, 1000]
+"""The `--limit` values that `nflrank` is run with."""
+
+table_rows = [1000, 10000, 100000]
+"""The sizes of the inputs given to `nflcmd.table`."""
+
+positions = ['QB', 'RB', 'WR', 'K']
+"""The positions of the players whose game and season logs are shown."""
+
+
+def eprint(*args, **kwargs):
+    kwargs['file'] = sys.stderr
+    print(*args, **kwargs)
+
+
+def cases():
+    """
+    Returns a list of pairs of case names and functions. Each function
+    takes a database connection and the dictionary returned by
+    `context`, and returns a function with no arguments that runs the
+    case once. Only the latter is timed.
+    """
+    cs = []
+    for pos in positions:
+        cs.append(('game_table/%s' % pos, _game_table(pos)))
+    for pos in positions:
+        cs.append(('season_table/%s' % pos, _season_table(pos)))
+    for n in limits:
+        cs.append(('rank/limit=%d' % n, _rank(n, [])))
+    if nflcmd.matrix.available:
+        for n in limits:
+            cs.append(('rank_matrix/limit=%d' % n, _rank(n, ['--matrix'])))
+    for kind in ('exact', 'fuzzy', 'soundex'):
+        cs.append(('search/%s' % kind, _search(kind)))
+    for n in table_rows:
+        cs.append(('table/rows=%d' % n, _table(n)))
+    return cs
+
+
+def context(db):
+    """
+    Returns the values shared by the cases: the current season, a
+    player for each position in `positions` and a sample of player
+    names to search for.
+    """
+    _, year, _ = nflcmd.current(db)
+    ctx = {'year': year, 'players': {}}
+    with nfldb.Tx(db) as cursor:
+        for pos in positions:
+            cursor.execute('''
+                SELECT player_id FROM player
+                WHERE position = %s ORDER BY player_id LIMIT 1
+            ''', (pos,))
+            row = cursor.fetchone()
+            if row is not None:
+                ctx['players'][pos] = nfldb.Player.from_id(db,
+                                                           row['player_id'])
+        cursor.execute('SELECT full_name FROM player ORDER BY player_id')
+        names = [r['full_name'] for r in cursor.fetchall()]
+    rng = random.Random(0)
+    ctx['names'] = [rng.choice(names) for _ in range(50)]
+    return ctx
+
+
+def _game_table(pos):
+    def prepare(db, ctx):
+        player = ctx['players'][pos]
+        return lambda: nflcmd.cmds.stats.show_game_table(
+            db, player, ctx['year'], 'Regular', pos=player.position)
+    return prepare
+
+
+def _season_table(pos):
+    def prepare(db, ctx):
+        player = ctx['players'][pos]
+        return lambda: nflcmd.cmds.stats.show_season_table(
+            db, player, 'Regular', pos=player.position)
+    return prepare
+
+
+def _rank(limit, flags):
+    def prepare(db, ctx):
+        years = '%d-%d' % (ctx['year'] - 2, ctx['year'])
+        argv = ['passing_yds', 'rushing_yds', '--years', years,
+                '--limit', str(limit)] + flags
+        return lambda: nflcmd.cmds.rank.run(argv, db=db)
+    return prepare
+
+
+def _search(kind):
+    def prepare(db, ctx):
+        names = ctx['names']
+        if kind == 'fuzzy':
+            # Drop a letter from each last name to force fuzzy lookups.
+            names = [name[:-2] + name[-1] for name in names]
+
+        def run():
+            for name in names:
+                nflcmd.search(db, name, None, None, kind == 'soundex')
+        return run
+    return prepare
+
+
+def _table(n):
+    def prepare(db, ctx):
+        cats = nflcmd.columns['season']['passer']
+        rng = random.Random(n)
+        rows = [nflcmd.header_row(['name', 'team'] + cats)]
+        for i in range(n):
+            rows.append(['Player %d' % i, 'NE']
+                        + [rng.randint(0, 5000) for _ in cats])
+        return lambda: nflcmd.table(rows)
+    return prepare
+
+
+def run_case(db, name, repeat, ex):
+    """
+    Runs the case `name` `repeat` times in this process with the
+    `nflcmd.executor.Executor` `ex` and returns its results as a
+    dictionary.
+    """
+    fun = dict(cases())[name](db, context(db))
+    seconds, queries, hits = [], [], []
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    try:
+        for _ in range(repeat):
+            sys.stdout = devnull
+            rec = nflcmd.profile.start()
+            start = time.time()
+            try:
+                with nflcmd.executor.use(ex):
+                    fun()
+            finally:
+                elapsed = time.time() - start
+                nflcmd.profile.stop()
+                sys.stdout = stdout
+            report = rec.report()
+            seconds.append(elapsed)
+            queries.append(report['queries'])
+            hits.append(report['cache_hits'])
+    finally:
+        devnull.close()
+    return {
+        'name': name, 'seconds': seconds, 'queries': queries,
+        'cache_hits': hits, 'max_rss_kb': max_rss_kb(),
+    }
+
+
+def max_rss_kb():
+    """
+    Returns the peak resident memory of this process in kilobytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def summarize(case):
+    """
+    Adds the summary values `cold` (the first repetition), `warm` (the
+    median of the others) and `warm_queries` to the results of a case.
+    """
+    secs = case['seconds']
+    warm = sorted(secs[1:] or secs)
+    case['cold'] = secs[0]
+    case['warm'] = warm[len(warm) // 2]
+    case['warm_queries'] = case['queries'][-1]
+    return case
+
+
+def compare(old, new, out=None):
+    """
+    Writes a table comparing the warm times, query counts and peak
+    memory of every case in the results `old` and `new`.
+    """
+    def ms(s):
+        return '-' if s is None else '%0.1f' % (1000 * s)
+
+    def mb(kb):
+        return '-' if kb is None else '%0.1f' % (kb / 1024)
+
+    oldcases = dict((c['name'], c) for c in old['cases'])
+    rows = [['Case', 'Old (ms)', 'New (ms)', 'Change', 'Old Q', 'New Q',
+             'Old RSS (MB)', 'New RSS (MB)']]
+    for c in new['cases']:
+        o = oldcases.get(c['name'], {})
+        change = '-'
+        if o.get('warm'):
+            change = '%+0.1f%%' % (100 * (c['warm'] - o['warm']) / o['warm'])
+        rows.append([c['name'], ms(o.get('warm')), ms(c['warm']), change,
+                     o.get('warm_queries', '-'), c['warm_queries'],
+                     mb(o.get('max_rss_kb')), mb(c['max_rss_kb'])])
+    nflcmd.write_table(rows, out)
+
+
+def setup(db, args):
+    """
+    Fills the database with the fixture if it's empty (or if
+    `--rebuild` is set) and returns the number of rows in each table.
+    """
+    n = fixture.counts(db)
+    if n['game'] > 0 and args.rebuild:
+        with nfldb.Tx(db) as cursor:
+            cursor.execute('''
+                TRUNCATE play_player, play, drive, game, player CASCADE
+            ''')
+        n['game'] = 0
+    if n['game'] == 0:
+        eprint('Building fixture with %d seasons, %d players and %d plays '
+               'per game...' % (args.seasons, args.players,
+                                args.plays_per_game))
+        start = time.time()
+        fixture.populate(db, args.seasons, args.players, args.plays_per_game,
+                         seed=args.seed)
+        eprint('Built fixture in %0.1f seconds.' % (time.time() - start))
+        n = fixture.counts(db)
+    else:
+        eprint('Using the existing data in %s (use --rebuild to replace it).'
+               % args.database)
+    return n
+
+
+def child_argv(args, name):
+    """
+    Returns the command that runs the case `name` in a new process.
+    """
+    argv = [sys.executable, os.path.abspath(__file__),
+            '--case', name, '--repeat', str(args.repeat),
+            '--jobs', str(args.jobs),
+            '--database', args.database]
+    for flag in ('user', 'password', 'host', 'port'):
+        if getattr(args, flag) is not None:
+            argv += ['--%s' % flag, str(getattr(args, flag))]
+    if args.cache:
+        argv.append('--cache')
+    return argv
+
+
+def connect(args):
+    """Connects to the database given on the command line."""
+    return nfldb.connect(database=args.database, user=args.user,
+                         password=args.password, host=args.host,
+                         port=args.port)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark nflcmd against a synthetic nfldb database.')
+    aa = parser.add_argument
+    aa('--database', type=str, default='nflcmd_bench',
+       help='The PostgreSQL database to fill and benchmark against.')
+    aa('--user', type=str, default=None)
+    aa('--password', type=str, default=None)
+    aa('--host', type=str, default=None)
+    aa('--port', type=int, default=None)
+    aa('--seasons', type=int, default=5,
+       help='The number of regular seasons in the fixture.')
+    aa('--players', type=int, default=2000,
+       help='The number of players in the fixture.')
+    aa('--plays-per-game', type=int, default=150,
+       help='The number of plays in each game of the fixture.')
+    aa('--seed', type=int, default=0,
+       help='The seed used to generate the fixture.')
+    aa('--rebuild', action='store_true',
+       help='Replace the data in the database with a new fixture.')
+    aa('--repeat', type=int, default=5,
+       help='The number of times each case is run.')
+    aa('--jobs', type=int, default=1,
+       help='The number of independent queries to run at once.')
+    aa('--only', type=str, default=[], nargs='+', metavar='CASE',
+       help='Only run cases whose names start with one of these.')
+    aa('--list', action='store_true',
+       help='List the names of every case and quit.')
+    aa('--cache', action='store_true',
+       help='Leave the query cache in nflcmd.cache enabled.')
+    aa('--out', type=str, default=None, metavar='FILE',
+       help='Write the results to FILE as JSON.')
+    aa('--compare', type=str, default=None, metavar='FILE',
+       help='Compare the results with those in FILE.')
+    aa('--case', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    if args.list:
+        for name, _ in cases():
+            print(name)
+        return
+
+    nflcmd.cache.enabled = args.cache
+    db = connect(args)
+    if args.case is not None:
+        # The commands run by the cases open their own executor
+        # (connecting with nfldb's configuration) unless one is
+        # already active, so always give them one for this database.
+        ex = nflcmd.executor.Executor(args.jobs, lambda: connect(args))
+        try:
+            json.dump(run_case(db, args.case, args.repeat, ex), sys.stdout)
+        finally:
+            ex.close()
+        return
+
+    results = {
+        'version': version,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': sys.version.split()[0],
+        'repeat': args.repeat,
+        'jobs': args.jobs,
+        'cache': args.cache,
+        'fixture': setup(db, args),
+        'cases': [],
+    }
+    names = [name for name, _ in cases()
+             if not args.only or any(name.startswith(p) for p in args.only)]
+    for name in names:
+        # Each case gets its own cache directory, so that the saved
+        # name index and cached queries of one case don't make the
+        # next one look fast.
+        cache_dir = tempfile.mkdtemp(prefix='nflcmd-bench-')
+        env = dict(os.environ, XDG_CACHE_HOME=cache_dir)
+        try:
+            out = subprocess.check_output(child_argv(args, name),
+                                          env=env)
+        except subprocess.CalledProcessError:
+            eprint('%s: failed' % name)
+            continue
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        case = summarize(json.loads(out))
+        results['cases'].append(case)
+        eprint('%s: %0.1f ms warm, %0.1f ms cold, %d queries'
+               % (name, 1000 * case['warm'], 1000 * case['cold'],
+                  case['warm_queries']))
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
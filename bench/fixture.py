@@ -0,0 +1,291 @@
+"""
+Module fixture fills an empty nfldb database with synthetic data for
+benchmarking nflcmd. The size of the data is controlled by the number
+of seasons, the number of players and the number of plays in each
+game. The data is generated from a seeded random number generator, so
+two databases built with the same parameters are identical.
+
+The statistics are not realistic, but every table used by nflcmd is
+populated with rows shaped like the real thing: players are spread
+over every team and position, every team plays one game in each week
+of the regular season and every play has a couple of players with
+statistics appropriate for their position (passes, runs, kicks,
+punts and tackles).
+
+Rows are written with `COPY`, so building a database with millions of
+`play_player` rows takes a few minutes at most.
+"""
+from __future__ import absolute_import, division, print_function
+import datetime
+import random
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import nfldb
+
+first_names = [
+    'Aaron', 'Adrian', 'Andre', 'Antonio', 'Ben', 'Brandon', 'Calvin',
+    'Cam', 'Chris', 'Colin', 'Darren', 'DeMarco', 'Drew', 'Eli', 'Frank',
+    'Jamaal', 'Jordy', 'Josh', 'Julio', 'Justin', 'LeSean', 'Marshawn',
+    'Matt', 'Michael', 'Peyton', 'Philip', 'Reggie', 'Robert', 'Russell',
+    'Stephen', 'Steve', 'Tom', 'Tony', 'Victor', 'Wes', 'Zach',
+]
+
+last_names = [
+    'Adams', 'Allen', 'Bailey', 'Brady', 'Brees', 'Brown', 'Bryant',
+    'Charles', 'Cobb', 'Cruz', 'Davis', 'Foster', 'Gore', 'Graham',
+    'Green', 'Gronkowski', 'Harris', 'Jackson', 'Johnson', 'Jones',
+    'Lynch', 'Manning', 'McCoy', 'Miller', 'Murray', 'Nelson', 'Peterson',
+    'Rice', 'Rivers', 'Rodgers', 'Smith', 'Stafford', 'Thomas', 'Welker',
+    'White', 'Williams', 'Wilson', 'Witten', 'Wright', 'Young',
+]
+
+positions = [
+    ('QB', 2), ('RB', 4), ('WR', 6), ('TE', 3), ('K', 1), ('P', 1),
+    ('CB', 4), ('SS', 2), ('FS', 2), ('DE', 3), ('DT', 3), ('OLB', 3),
+    ('MLB', 2), ('C', 2), ('G', 3), ('T', 3),
+]
+"""
+Pairs of positions and their weight when assigning positions to
+players. Each team gets its share of players in roughly these
+proportions.
+"""
+
+weeks = 17
+"""The number of regular season weeks generated in each season."""
+
+
+def populate(db, seasons, players, plays_per_game, last_year=None, seed=0):
+    """
+    Fills the empty nfldb database `db` with `players` players and
+    `seasons` regular seasons ending with `last_year` (which defaults
+    to the current year). Every game has `plays_per_game` plays.
+
+    A dictionary with the number of rows written to each table is
+    returned.
+    """
+    if last_year is None:
+        last_year = datetime.date.today().year
+    rng = random.Random(seed)
+    teams = [t[0] for t in nfldb.team.teams if t[0] != 'UNK']
+    rows = {}
+
+    roster, prows = _players(rng, teams, players)
+    rows['player'] = _copy(db, 'player', prows)
+
+    years = range(last_year - seasons + 1, last_year + 1)
+    games = _games(rng, teams, years)
+    rows['game'] = _copy(db, 'game', [g[1] for g in games])
+
+    drives, plays, pps = [], [], []
+    for gsis_id, game in games:
+        _game_plays(rng, roster, gsis_id, game, plays_per_game,
+                    drives, plays, pps)
+    rows['drive'] = _copy(db, 'drive', drives)
+    rows['play'] = _copy(db, 'play', plays)
+    rows['play_player'] = _copy(db, 'play_player', pps)
+
+    with nfldb.Tx(db) as cursor:
+        cursor.execute('''
+            UPDATE meta SET last_roster_download = NOW(),
+                            season_type = 'Regular',
+                            season_year = %s, week = %s
+        ''', (last_year, weeks))
+        cursor.execute('ANALYZE')
+    return rows
+
+
+def counts(db):
+    """
+    Returns a dictionary with the number of rows in each table that
+    `populate` writes to.
+    """
+    n = {}
+    with nfldb.Tx(db) as cursor:
+        for table in ('player', 'game', 'drive', 'play', 'play_player'):
+            cursor.execute('SELECT COUNT(*) AS n FROM %s' % table)
+            n[table] = cursor.fetchone()['n']
+    return n
+
+
+def _players(rng, teams, n):
+    """
+    Returns a roster, which maps each team to a dictionary from
+    position to player ids, along with the rows of the player table.
+    """
+    choices = []
+    for pos, weight in positions:
+        choices.extend([pos] * weight)
+
+    roster = dict((t, {}) for t in teams)
+    rows = []
+    for i in range(n):
+        pid = '00-%07d' % i
+        team = teams[i % len(teams)]
+        pos = choices[(i // len(teams)) % len(choices)]
+        first, last = rng.choice(first_names), rng.choice(last_names)
+        roster[team].setdefault(pos, []).append(pid)
+        rows.append({
+            'player_id': pid, 'gsis_name': '%s.%s' % (first[0], last),
+            'full_name': '%s %s' % (first, last), 'first_name': first,
+            'last_name': last, 'team': team, 'position': pos,
+            'status': 'Active',
+        })
+    return roster, rows
+
+
+def _games(rng, teams, years):
+    """
+    Returns a list of `(gsis_id, row)` pairs for every regular season
+    game in `years`. Every team plays once per week.
+    """
+    games = []
+    for year in years:
+        # The first Sunday on or after September 7th.
+        kickoff = datetime.date(year, 9, 7)
+        kickoff += datetime.timedelta(days=(6 - kickoff.weekday()) % 7)
+        for week in range(1, weeks + 1):
+            day = kickoff + datetime.timedelta(weeks=week - 1)
+            order = list(teams)
+            rng.shuffle(order)
+            for i in range(0, len(order) - 1, 2):
+                gsis_id = '%s%02d' % (day.strftime('%Y%m%d'), i // 2)
+                home, away = order[i], order[i+1]
+                stamp = '%s 17:00:00+00' % day.isoformat()
+                games.append((gsis_id, {
+                    'gsis_id': gsis_id, 'start_time': stamp, 'week': week,
+                    'day_of_week': 'Sunday', 'season_year': year,
+                    'season_type': 'Regular', 'finished': 't',
+                    'home_team': home, 'home_score': rng.randint(0, 45),
+                    'home_turnovers': rng.randint(0, 4),
+                    'away_team': away, 'away_score': rng.randint(0, 45),
+                    'away_turnovers': rng.randint(0, 4),
+                    'time_inserted': stamp, 'time_updated': stamp,
+                }))
+    return games
+
+
+def _game_plays(rng, roster, gsis_id, game, nplays, drives, plays, pps):
+    """
+    Appends the rows of the drives, plays and player statistics of
+    the game `game` to `drives`, `plays` and `pps`.
+    """
+    stamp = game['time_inserted']
+    offense = [game['home_team'], game['away_team']]
+    drive_id = 0
+    play_id = 0
+    while play_id < nplays:
+        drive_id += 1
+        team = offense[drive_id % 2]
+        defense = offense[(drive_id + 1) % 2]
+        count = min(rng.randint(3, 12), nplays - play_id)
+        quarter = 'Q%d' % min(4, 1 + (4 * play_id) // nplays)
+        drives.append({
+            'gsis_id': gsis_id, 'drive_id': drive_id,
+            'start_time': '(%s,0)' % quarter, 'end_time': '(%s,0)' % quarter,
+            'pos_team': team, 'first_downs': 0, 'penalty_yards': 0,
+            'yards_gained': 0, 'play_count': count,
+            'time_inserted': stamp, 'time_updated': stamp,
+        })
+        for i in range(count):
+            play_id += 1
+            plays.append({
+                'gsis_id': gsis_id, 'drive_id': drive_id,
+                'play_id': play_id, 'time': '(%s,0)' % quarter,
+                'pos_team': team,
+                'time_inserted': stamp, 'time_updated': stamp,
+            })
+            last = i == count - 1
+            play_stats = _play_stats(rng, roster, team, defense, last)
+            for pid, pteam, stats in play_stats:
+                row = {'gsis_id': gsis_id, 'drive_id': drive_id,
+                       'play_id': play_id, 'player_id': pid, 'team': pteam}
+                row.update(stats)
+                pps.append(row)
+
+
+def _play_stats(rng, roster, team, defense, last):
+    """
+    Returns a list of `(player_id, team, stats)` triples for a single
+    play by `team` against `defense`. The last play of a drive is a
+    field goal or a punt.
+    """
+    def player(t, *poss):
+        for pos in poss:
+            if roster[t].get(pos):
+                return rng.choice(roster[t][pos])
+        return None
+
+    out = []
+    tackler = player(defense, 'MLB', 'OLB', 'CB', 'SS', 'FS', 'DE', 'DT')
+    if last:
+        if rng.random() < 0.5:
+            kicker = player(team, 'K')
+            yds = rng.randint(18, 58)
+            if rng.random() < 0.85:
+                stats = {'kicking_fga': 1, 'kicking_fgm': 1,
+                         'kicking_fgm_yds': yds}
+            else:
+                stats = {'kicking_fga': 1, 'kicking_fgmissed': 1,
+                         'kicking_fgmissed_yds': yds}
+            out.append((kicker, team, stats))
+        else:
+            punter = player(team, 'P')
+            out.append((punter, team, {'punting_tot': 1,
+                                       'punting_yds': rng.randint(30, 60)}))
+    elif rng.random() < 0.55:
+        passer = player(team, 'QB')
+        target = player(team, *rng.choice([('WR',), ('TE',), ('RB',)]))
+        if rng.random() < 0.63:
+            yds = rng.randint(-2, 40)
+            out.append((passer, team, {'passing_att': 1, 'passing_cmp': 1,
+                                       'passing_yds': yds}))
+            out.append((target, team, {'receiving_tar': 1,
+                                       'receiving_rec': 1,
+                                       'receiving_yds': yds,
+                                       'receiving_yac_yds': yds // 2}))
+            out.append((tackler, defense, {'defense_tkl': 1}))
+        elif rng.random() < 0.05:
+            out.append((passer, team, {'passing_att': 1, 'passing_int': 1}))
+            out.append((tackler, defense, {'defense_int': 1}))
+        else:
+            out.append((passer, team, {'passing_att': 1,
+                                       'passing_incmp': 1}))
+            out.append((target, team, {'receiving_tar': 1}))
+    else:
+        rusher = player(team, 'RB', 'QB')
+        out.append((rusher, team, {'rushing_att': 1,
+                                   'rushing_yds': rng.randint(-3, 20)}))
+        out.append((tackler, defense, {'defense_tkl': 1}))
+
+    # A player can only appear once in a play and positions may be
+    # missing from tiny rosters.
+    seen, uniq = set(), []
+    for pid, t, stats in out:
+        if pid is not None and pid not in seen:
+            seen.add(pid)
+            uniq.append((pid, t, stats))
+    return uniq
+
+
+def _copy(db, table, rows):
+    """
+    Writes the dictionaries in `rows` to `table` with `COPY`. The
+    columns are the union of the keys of every row, and missing values
+    are left to the column defaults (which are `0` for statistics).
+    Returns the number of rows written.
+    """
+    if len(rows) == 0:
+        return 0
+    columns = sorted(set(k for r in rows for k in r))
+    defaults = dict((k, '0') for k in columns)
+    buf = StringIO()
+    for r in rows:
+        buf.write('\t'.join(str(r.get(k, defaults[k])) for k in columns))
+        buf.write('\n')
+    buf.seek(0)
+    with nfldb.Tx(db) as cursor:
+        cursor.copy_from(buf, table, columns=columns)
+    return len(rows)
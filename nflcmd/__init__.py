@@ -5,8 +5,24 @@ data, functions for aligning tabular data, and querying nfldb for aggregate
 statistics quickly.
 """
 
+import argparse
+import contextlib
+import csv
+import json
+import operator
+import os
+import sys
+import threading
+import time
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 import nfldb
 
+from nflcmd import aggtables, cache, executor, names, profile
+
 columns = {
     'game': {
         'passer': ['passing_cmp', 'passing_att', 'passing_ratio',
@@ -86,9 +102,27 @@ columns = {
                      'puntret_yds', 'puntret_tds',
                      ],
     },
+    'team': {
+        'offense': ['passing_cmp', 'passing_att', 'passing_ratio',
+                    'passing_yds', 'passing_yds_att', 'passing_tds',
+                    'passing_int',
+                    'rushing_att', 'rushing_yds', 'rushing_yds_att',
+                    'rushing_tds', 'fumbles_lost',
+                    'kicking_fgm', 'kicking_fga', 'fgm_ratio',
+                    ],
+        'defense': ['defense_tkl_tot', 'defense_sk', 'defense_int',
+                    'defense_frec', 'defense_ffum', 'defense_pass_def',
+                    'defense_int_tds', 'defense_frec_tds', 'defense_safe',
+                    'opp_passing_yds', 'opp_passing_tds',
+                    'opp_rushing_yds', 'opp_rushing_tds',
+                    ],
+    },
 }
 """
-Specifies the columns to show for game and season logs.
+Specifies the columns to show for game and season logs, and for team
+tables. Team tables may also use any player statistical category
+prefixed with `opp_`, which is the total of that category recorded
+against the team.
 """
 
 _epos = nfldb.Enums.player_pos
@@ -108,6 +142,10 @@ _defense_pos = ['C', 'CB', 'DB', 'DE', 'DL', 'DT', 'FS', 'G', 'ILB', 'LB',
 for pos in _defense_pos:
     pcolumns[_epos[pos]] = 'defender'
 
+_player_categories = [cat for cat, c in nfldb.stat_categories.items()
+                      if c.category_type is nfldb.Enums.category_scope.player]
+_player_category_set = frozenset(_player_categories)
+
 
 statfuns = {
     'passing_ratio': lambda p: percent(p.passing_cmp, p.passing_att),
@@ -123,6 +161,19 @@ A dictionary of derived statistics. Any of the keys in this
 dictionary may be used in `nflcmd.columns` and `nflcmd.abbrev`.
 """
 
+fg_ranges = [
+    ('fg_0_29', 0, 29), ('fg_30_39', 30, 39), ('fg_40_49', 40, 49),
+    ('fg_50', 50, 100),
+]
+"""
+The buckets of field goal distances, as triples of column name and
+inclusive range of yards. Any of the column names may be used in
+`nflcmd.columns` and `nflcmd.abbrev`, where they show the number of
+field goals made and attempted in that range.
+"""
+
+_fg_columns = frozenset(name for name, _, _ in fg_ranges)
+
 abbrev = {
     'passing_cmp': 'CMP', 'passing_att': 'P Att', 'passing_ratio': '%',
     'passing_yds': 'P Yds', 'passing_yds_att': 'Y/Att',
@@ -157,20 +208,39 @@ abbrev = {
 
     # Prefixes for season logs
     'year': 'Year', 'teams': 'Team', 'game_count': 'G',
+    'split': 'Split',
+
+    # Team tables
+    'record': 'W-L', 'points_for': 'PF', 'points_against': 'PA',
+    'opp_passing_yds': 'P Yds Alw', 'opp_passing_tds': 'P TDs Alw',
+    'opp_rushing_yds': 'R Yds Alw', 'opp_rushing_tds': 'R TDs Alw',
 
     # Misc.
-    'name': 'Player', 'team': 'Team',
+    'name': 'Player', 'team': 'Team', 'score': 'Pts', 'window': 'Weeks',
 }
 """
 Abbreviations for statistical fields. (Used in the header of tables.)
 """
 
 
+game_fields = ['gsis_id', 'start_time', 'week', 'day_of_week',
+               'season_year', 'season_type',
+               'home_team', 'home_score', 'away_team', 'away_score',
+               'winner', 'loser']
+"""
+The attributes of `nfldb.Game` that are copied into each `nflcmd.Game`
+row. Other attributes of the game are not available from a row.
+"""
+
+
 class Game (object):
     """
     Represents a row of player statistics corresponding to a single
     game.
     """
+    __slots__ = ['_db', 'team', 'player_id', 'stats', '_pstat',
+                 '_fg_hist', '_summary'] + game_fields
+
     @staticmethod
     def make(db, player, game):
         """
@@ -178,73 +248,59 @@ class Game (object):
         `nfldb.Game` objects.
         """
         pstat = game_stats(db, game, player)
-        team = player_team_in_game(db, game, player)
-        return Game(db, game, team, pstat)
+        return Game(db, game, pstat.team, pstat)
 
     def __init__(self, db, game, team, pstat):
         self._db = db
-        self._game = game
         self.team = team
+        self.player_id = pstat.player_id
+        self.stats = _copy_stats(pstat)
         self._pstat = pstat
-        self._fgs = None
-
-    @property
-    def fgs(self):
-        if self._fgs is None:
-            q = nfldb.Query(self._db)
-            q.play_player(gsis_id=self.gsis_id, player_id=self.player_id)
-            q.play_player(kicking_fga=1)
-            self._fgs = q.as_play_players()
-        return self._fgs
+        self._fg_hist = None
 
-    @property
-    def fg_0_29(self):
-        fgs = fgs_range(self.fgs, 0, 29)
-        return '%d/%d' % (len(filter(fg_made, fgs)), len(fgs))
-
-    @property
-    def fg_30_39(self):
-        fgs = fgs_range(self.fgs, 30, 39)
-        return '%d/%d' % (len(filter(fg_made, fgs)), len(fgs))
-
-    @property
-    def fg_40_49(self):
-        fgs = fgs_range(self.fgs, 40, 49)
-        return '%d/%d' % (len(filter(fg_made, fgs)), len(fgs))
+        # A row without a game summarizes many games. Its game fields
+        # come from the aggregate statistics instead (if they exist).
+        self._summary = game is None
+        src = pstat if game is None else game
+        for f in game_fields:
+            setattr(self, f, getattr(src, f, '-'))
 
     @property
-    def fg_50(self):
-        fgs = fgs_range(self.fgs, 50, 100)
-        return '%d/%d' % (len(filter(fg_made, fgs)), len(fgs))
+    def fg_hist(self):
+        if self._fg_hist is None:
+            self._fg_hist = fg_histogram(self._db, self.player_id,
+                                         [self.gsis_id])
+        return self._fg_hist
 
     @property
     def outcome(self):
-        if self._game is None:
+        if self._summary:
             return '-'
         return 'W' if self.team == self.winner else 'L'
 
     @property
     def game_date(self):
-        if self._game is None:
+        if self._summary:
             return '-'
         return '{d:%b} {d.day}'.format(d=self.start_time)
 
     @property
     def opp(self):
-        if self._game is None:
+        if self._summary:
             return '-'
         if self.team == self.away_team:
             return '@' + self.home_team
         return self.away_team
 
     def __getattr__(self, k):
+        if FieldGoals.is_column(k):
+            return self.fg_hist.column(k)
+        if k in _player_category_set:
+            return self.stats.get(k, 0)
         try:
-            return getattr(self._game, k)
+            return getattr(self._pstat, k)
         except AttributeError:
-            try:
-                return getattr(self._pstat, k)
-            except AttributeError:
-                return '-'
+            return '-'
 
 
 class Games (object):
@@ -252,25 +308,35 @@ class Games (object):
     Represents a row of player statistics corresponding to multiple
     games.
     """
-    def __init__(self, db, year, games, pstat):
+    __slots__ = ['_db', 'year', 'games', 'player_id', 'stats', '_pstat',
+                 '_fg_hist', '_player']
+
+    def __init__(self, db, year, games, pstat, player=None):
         self._db = db
         self.year = year
         self.games = games
+        self.player_id = pstat.player_id
+        self.stats = _copy_stats(pstat)
         self._pstat = pstat
-        self._fgs = None
+        self._fg_hist = None
+        self._player = player
 
     @property
-    def fgs(self):
-        if self._fgs is None:
-            q = nfldb.Query(self._db)
-            q.play_player(gsis_id=[g.gsis_id for g in self.games])
-            q.play_player(player_id=self.player_id, kicking_fga=1)
-            self._fgs = q.as_play_players()
-        return self._fgs
+    def fg_hist(self):
+        if self._fg_hist is None:
+            self._fg_hist = fg_histogram(self._db, self.player_id,
+                                         [g.gsis_id for g in self.games])
+        return self._fg_hist
 
     @property
     def passing_yds_game(self):
-        return ratio(self.passing_yds, len(self.games))
+        return ratio(self.passing_yds, self.game_count)
+
+    @property
+    def player(self):
+        if self._player is None:
+            return self._pstat.player
+        return self._player
 
     @property
     def name(self):
@@ -280,26 +346,6 @@ class Games (object):
     def passing_300(self):
         return len(filter(lambda p: p.passing_yds >= 300, self.games))
 
-    @property
-    def fg_0_29(self):
-        fgs = fgs_range(self.fgs, 0, 29)
-        return '%d/%d' % (len(filter(fg_made, fgs)), len(fgs))
-
-    @property
-    def fg_30_39(self):
-        fgs = fgs_range(self.fgs, 30, 39)
-        return '%d/%d' % (len(filter(fg_made, fgs)), len(fgs))
-
-    @property
-    def fg_40_49(self):
-        fgs = fgs_range(self.fgs, 40, 49)
-        return '%d/%d' % (len(filter(fg_made, fgs)), len(fgs))
-
-    @property
-    def fg_50(self):
-        fgs = fgs_range(self.fgs, 50, 100)
-        return '%d/%d' % (len(filter(fg_made, fgs)), len(fgs))
-
     @property
     def game_count(self):
         return len(self.games)
@@ -310,45 +356,682 @@ class Games (object):
 
     @property
     def teams(self):
-        teams = []
-        for g in self.games:
-            if len(teams) == 0 or teams[-1] != g.team:
-                teams.append(g.team)
-        return '/'.join(teams)
+        return '/'.join(team_sequence(g.team for g in self.games))
 
     def __getattr__(self, k):
+        if FieldGoals.is_column(k):
+            return self.fg_hist.column(k)
+        if k in _player_category_set:
+            return self.stats.get(k, 0)
         try:
             return getattr(self._pstat, k)
         except AttributeError:
             return '-'
 
 
+class Totals (Games):
+    """
+    Represents a row of player statistics corresponding to multiple
+    games, where the per-game information needed by the columns in
+    `nflcmd.columns` was summarized by the database. Namely, the
+    GSIS identifiers of the games, the team the player was on in each
+    game and the number of 300 yard passing games.
+
+    Unlike `nflcmd.Games`, no `nflcmd.Game` objects are required.
+    Consequently, the `games` attribute is always empty.
+    """
+    __slots__ = ['gsis_ids', '_teams', '_passing_300']
+
+    def __init__(self, db, year, pstat, gsis_ids, teams, passing_300,
+                 player=None):
+        super(Totals, self).__init__(db, year, [], pstat, player)
+        self.gsis_ids = gsis_ids
+        self._teams = teams
+        self._passing_300 = passing_300
+
+    @property
+    def fg_hist(self):
+        if self._fg_hist is None:
+            self._fg_hist = fg_histogram(self._db, self.player_id,
+                                         self.gsis_ids)
+        return self._fg_hist
+
+    @property
+    def passing_300(self):
+        return self._passing_300
+
+    @property
+    def game_count(self):
+        return len(self.gsis_ids)
+
+    @property
+    def teams(self):
+        return '/'.join(team_sequence(self._teams))
+
+
+class Summary (Games):
+    """
+    Represents a row of player statistics summarizing many other rows,
+    built from the totals in a `nflcmd.Accumulator`. Only the totals
+    are kept, so the `games` attribute is always empty.
+    """
+    __slots__ = ['_game_count', '_teams', '_passing_300']
+
+    def __init__(self, db, year, acc, player=None):
+        super(Summary, self).__init__(db, year, [], acc.pstat(db), player)
+        self._fg_hist = acc.fg_hist
+        self._game_count = acc.game_count
+        self._teams = acc.teams
+        self._passing_300 = acc.passing_300
+
+    @property
+    def passing_300(self):
+        return self._passing_300
+
+    @property
+    def game_count(self):
+        return self._game_count
+
+    @property
+    def teams(self):
+        return '/'.join(self._teams)
+
+
+def _copy_stats(pstat):
+    """
+    Returns a dictionary of the statistics recorded in the
+    `nfldb.PlayPlayer` object `pstat`. Categories that aren't in the
+    dictionary are zero.
+    """
+    return dict((k, getattr(pstat, k)) for k in pstat.fields
+                if k in _player_category_set)
+
+
+class FieldGoals (object):
+    """
+    Represents a histogram of field goals made and attempted, bucketed
+    by distance according to `nflcmd.fg_ranges`. Histograms can be
+    summed with `+=` and subtracted with `-=`.
+    """
+    @staticmethod
+    def is_column(k):
+        """
+        Returns `True` if and only if `k` is a column name in
+        `nflcmd.fg_ranges`.
+        """
+        return k in _fg_columns
+
+    def __init__(self, counts=None):
+        self.counts = {} if counts is None else counts
+        """
+        A dictionary mapping column names in `nflcmd.fg_ranges` to a
+        list of field goals made and attempted.
+        """
+
+    def column(self, k):
+        """
+        Returns the field goals made and attempted in the bucket `k`
+        formatted as `made/attempted`.
+        """
+        made, att = self.counts.get(k, (0, 0))
+        return '%d/%d' % (made, att)
+
+    def __iadd__(self, other):
+        for k, (made, att) in other.counts.items():
+            mine = self.counts.setdefault(k, [0, 0])
+            mine[0] += made
+            mine[1] += att
+        return self
+
+    def __isub__(self, other):
+        for k, (made, att) in other.counts.items():
+            mine = self.counts.setdefault(k, [0, 0])
+            mine[0] -= made
+            mine[1] -= att
+        return self
+
+    def copy(self):
+        """
+        Returns a new histogram with the same counts.
+        """
+        return FieldGoals(dict((k, list(v)) for k, v in self.counts.items()))
+
+
+class Accumulator (object):
+    """
+    Accumulates the totals of rows of player statistics (any of
+    `nflcmd.Game`, `nflcmd.Games` or `nflcmd.Totals`) one row at a
+    time: the sum of every statistical category, the field goal
+    histogram, the number of games and 300 yard passing games, and the
+    sequence of teams. Only the totals are kept, so the memory used
+    doesn't depend on the number of rows or games added. Accumulators
+    can be merged with `+=`.
+
+    Rows should be added in chronological order, so that the sequence
+    of teams is too.
+    """
+    __slots__ = ['player_id', 'rows', 'stats', 'fg_hist', 'game_count',
+                 'passing_300', 'teams']
+
+    def __init__(self):
+        self.player_id = None
+        self.rows = 0
+        """The number of rows added."""
+        self.stats = {}
+        self.fg_hist = FieldGoals()
+        self.game_count = 0
+        self.passing_300 = 0
+        self.teams = []
+        """The sequence of teams, as returned by `nflcmd.team_sequence`."""
+
+    def add(self, row):
+        """
+        Adds the statistics of `row` to the totals.
+        """
+        if self.player_id is None:
+            self.player_id = row.player_id
+        self.rows += 1
+        for k, v in row.stats.items():
+            self.stats[k] = self.stats.get(k, 0) + v
+        self.fg_hist += row.fg_hist
+        if isinstance(row, Game):
+            self.game_count += 1
+            self.passing_300 += int(row.stats.get('passing_yds', 0) >= 300)
+            self._extend([row.team])
+        else:
+            self.game_count += row.game_count
+            self.passing_300 += row.passing_300
+            self._extend(t for t in row.teams.split('/') if len(t) > 0)
+
+    def fold(self, rows, summarize=None):
+        """
+        Generates every row in `rows` after adding it to the totals. If
+        `summarize` is given and more than one row was added, then the
+        row returned by `summarize(self)` is generated last (e.g.,
+        `nflcmd.Accumulator.game` or `nflcmd.Accumulator.summary`).
+        """
+        for row in rows:
+            self.add(row)
+            yield row
+        if summarize is not None and self.rows > 1:
+            yield summarize(self)
+
+    def pstat(self, db):
+        """
+        Returns an aggregate `nfldb.PlayPlayer` object with the totals
+        of every statistical category.
+        """
+        stats = dict((k, v) for k, v in self.stats.items() if v != 0)
+        return nfldb.PlayPlayer(db, None, None, None, self.player_id, None,
+                                stats)
+
+    def game(self, db):
+        """
+        Returns a `nflcmd.Game` row without a game with the totals,
+        like the summary row of a game log.
+        """
+        row = Game(db, None, '-', self.pstat(db))
+        row._fg_hist = self.fg_hist
+        return row
+
+    def summary(self, db, year='-'):
+        """
+        Returns a `nflcmd.Summary` row with the totals, using `year` as
+        the year of the row.
+        """
+        return Summary(db, year, self)
+
+    def _extend(self, teams):
+        for team in teams:
+            if len(self.teams) == 0 or self.teams[-1] != team:
+                self.teams.append(team)
+
+    def __iadd__(self, other):
+        if self.player_id is None:
+            self.player_id = other.player_id
+        self.rows += other.rows
+        for k, v in other.stats.items():
+            self.stats[k] = self.stats.get(k, 0) + v
+        self.fg_hist += other.fg_hist
+        self.game_count += other.game_count
+        self.passing_300 += other.passing_300
+        self._extend(other.teams)
+        return self
+
+
 def game_stats(db, game, player):
     """
     Returns aggregate statistics for a particular `nfldb.Player` in a
     single `nfldb.Game`.
     """
-    q = nfldb.Query(db).game(gsis_id=game.gsis_id)
-    q.player(player_id=player.player_id)
-    return q.as_aggregate()[0]
+    return games_stats(db, [game], player)[game.gsis_id]
+
 
+def games_stats(db, games, player):
+    """
+    Returns a dictionary mapping GSIS identifiers to aggregate
+    statistics for a particular `nfldb.Player` in each of the given
+    `nfldb.Game` objects. The `team` attribute of each aggregate is
+    set to the team that the player belonged to in that game.
+
+    Unlike `nflcmd.game_stats`, this issues a single query regardless
+    of the number of games. The results are cached by
+    `nflcmd.cache.fetchall`.
+    """
+    if len(games) == 0:
+        return {}
+    where = 'play_player.player_id = %s AND play_player.gsis_id IN %s'
+    params = [player.player_id, tuple(g.gsis_id for g in games)]
+    seasons = set((g.season_year, g.season_type) for g in games)
+    stats = _player_game_stats(db, where, params, seasons)
+    return dict((gid, pstat) for (_, gid), pstat in stats.items())
 
-def search(db, name, team, pos, soundex=False):
+
+def fg_histogram(db, player_id, gsis_ids):
+    """
+    Returns a `nflcmd.FieldGoals` histogram of the field goals
+    attempted by the player with identifier `player_id` in all of the
+    games given by their GSIS identifiers. The histogram is computed by
+    the database with a single query.
+    """
+    if len(gsis_ids) == 0:
+        return FieldGoals()
+    where = 'play_player.player_id = %s AND play_player.gsis_id IN %s'
+    hists = _fg_histograms(db, ['play_player.player_id'], where,
+                           [player_id, tuple(gsis_ids)])
+    return hists.get(player_id, FieldGoals())
+
+
+def game_log(db, player, year, stype, week_range=None):
+    """
+    Returns a list of `nflcmd.Game` objects for a particular
+    `nfldb.Player` corresponding to the games matched by
+    `nflcmd.query_games`.
+
+    This is equivalent to calling `nflcmd.Game.make` on every game,
+    except that the games, the per-game aggregate statistics (with
+    the player's team) and the field goal attempts are each fetched
+    with a single query. That is, the number of queries issued does
+    not depend on the number of games. The three queries are run
+    concurrently when an `nflcmd.executor.Executor` is active, and
+    their results are cached by `nflcmd.cache.fetchall`.
+    """
+    return game_logs(db, [player], year, stype, week_range)[player.player_id]
+
+
+def game_logs(db, players, year, stype, week_range=None):
+    """
+    Like `nflcmd.game_log`, except game logs are built for every
+    `nfldb.Player` in `players` with the same three queries. A
+    dictionary is returned that maps each player identifier to its
+    list of `nflcmd.Game` objects.
+    """
+    pids = tuple(set(p.player_id for p in players))
+    logs = dict((pid, []) for pid in pids)
+    if len(pids) == 0:
+        return logs
+
+    seasons = _seasons([year], stype)
+    gwhere, gparams = _game_where([year], stype, week_range)
+    where = 'play_player.player_id IN %s AND ' + gwhere
+    params = [pids] + gparams
+    fg_keys = ['play_player.player_id', 'play_player.gsis_id']
+    games, stats, fg_hists = executor.gather(db, [
+        lambda conn: _player_games(db, pids, gwhere, gparams, seasons,
+                                   conn=conn),
+        lambda conn: _player_game_stats(db, where, params, seasons,
+                                        conn=conn),
+        lambda conn: _fg_histograms(conn, fg_keys, where, params, seasons),
+    ])
+    for pid, gid in sorted(stats):
+        pstat = stats[(pid, gid)]
+        row = Game(db, games[gid], pstat.team, pstat)
+        row._fg_hist = fg_hists.get((pid, gid), FieldGoals())
+        logs[pid].append(row)
+    return logs
+
+
+def season_log(db, player, years, stype, week_range=None):
+    """
+    Returns a list of `nflcmd.Totals` objects for a particular
+    `nfldb.Player`, with one element for each year in `years` in which
+    the player recorded statistics. The list is sorted by year.
+
+    The aggregate statistics, game counts, team sequences and number of
+    300 yard passing games for every year are computed with a single
+    query grouped by season. The field goal histograms for every year
+    are computed with one more query. Both queries are run concurrently
+    when an `nflcmd.executor.Executor` is active, and their results are
+    cached by `nflcmd.cache.fetchall`.
+    """
+    return season_logs(db, [player], years, stype,
+                       week_range)[player.player_id]
+
+
+def season_logs(db, players, years, stype, week_range=None):
+    """
+    Like `nflcmd.season_log`, except season logs are built for every
+    `nfldb.Player` in `players` with the same two queries. A
+    dictionary is returned that maps each player identifier to its
+    list of `nflcmd.Totals` objects.
+    """
+    pids = tuple(set(p.player_id for p in players))
+    logs = dict((pid, []) for pid in pids)
+    if len(pids) == 0:
+        return logs
+
+    seasons = _seasons(years, stype)
+    where, params = _game_where(years, stype, week_range)
+    where = 'play_player.player_id IN %s AND ' + where
+    params = [pids] + params
+
+    keys = ['player_id', 'season_year']
+    fg_keys = ['play_player.player_id', 'game.season_year']
+    totals, fg_hists = executor.gather(db, [
+        lambda conn: _game_totals(conn, keys, where, params, seasons),
+        lambda conn: _fg_histograms(conn, fg_keys, where, params, seasons),
+    ])
+    for r in totals:
+        pid, year = r['player_id'], r['season_year']
+        row = Totals(db, year, _pstat_from_row(db, r, pid),
+                     r['gsis_ids'], r['teams'], r['passing_300'])
+        row._fg_hist = fg_hists.get((pid, year), FieldGoals())
+        logs[pid].append(row)
+    return logs
+
+
+def player_totals(db, pstats, label, years, stype, week_range=None):
     """
-    Provides a thin wrapper over nfldb's player search. Namely, if
-    `name` is one word, then it assumes that it's a first/last name and
-    tries to match it exactly against the list of results returned from
-    the Levenshtein/Soundex search.
+    Returns a list of `nflcmd.Totals` objects, one for each aggregate
+    `nfldb.PlayPlayer` object in `pstats` (in the same order), using
+    `label` as the year of each row.
+
+    The games played, teams and 300 yard passing games are restricted
+    to the given seasons, season phase and optional range of weeks.
+    They are fetched for all players with a single query, and the
+    `nfldb.Player` objects are fetched with one more. Both queries are
+    run concurrently when an `nflcmd.executor.Executor` is active.
     """
-    matches = nfldb.player_search(db, name, team, pos,
-                                  limit=100, soundex=soundex)
-    if len(matches) == 0:
+    if len(pstats) == 0:
+        return []
+    pids = tuple(set(p.player_id for p in pstats))
+    where, params = _game_where(years, stype, week_range)
+    where = 'play_player.player_id IN %s AND ' + where
+    params = [pids] + params
+
+    seasons = _seasons(years, stype)
+    totals, players = executor.gather(db, [
+        lambda conn: _game_totals(conn, ['player_id'], where, params,
+                                  seasons),
+        lambda conn: _players_by_id(db, pids, conn=conn),
+    ])
+    summaries = dict((r['player_id'], r) for r in totals)
+
+    rows = []
+    for pstat in pstats:
+        r = summaries.get(pstat.player_id)
+        if r is None:
+            r = {'gsis_ids': [], 'teams': [], 'passing_300': 0}
+        rows.append(Totals(db, label, pstat, r['gsis_ids'], r['teams'],
+                           r['passing_300'],
+                           player=players.get(pstat.player_id)))
+    return rows
+
+
+class TeamTotals (object):
+    """
+    Represents a row of team statistics over many games: the team's
+    record and points, the sum of the statistics recorded by the
+    team's players and the sum of the statistics recorded by their
+    opponents, which are available as columns prefixed with `opp_`
+    (e.g., `opp_rushing_yds` is the rushing yards allowed).
+    """
+    __slots__ = ['team', 'game_count', 'wins', 'losses', 'ties',
+                 'points_for', 'points_against', 'stats', 'allowed']
+
+    def __init__(self, team):
+        self.team = team
+        self.game_count = 0
+        self.wins, self.losses, self.ties = 0, 0, 0
+        self.points_for, self.points_against = 0, 0
+        self.stats = {}
+        self.allowed = {}
+
+    @property
+    def record(self):
+        if self.ties > 0:
+            return '%d-%d-%d' % (self.wins, self.losses, self.ties)
+        return '%d-%d' % (self.wins, self.losses)
+
+    def __getattr__(self, k):
+        if k in _player_category_set:
+            return self.stats.get(k, 0)
+        if k.startswith('opp_') and k[4:] in _player_category_set:
+            return self.allowed.get(k[4:], 0)
+        return '-'
+
+
+def team_totals(db, years, stype, week_range=None):
+    """
+    Returns a dictionary mapping team abbreviations to
+    `nflcmd.TeamTotals` objects for every team with a game in the
+    given seasons, season phase and optional range of weeks.
+
+    The statistics of every team (and of every team's opponents) are
+    summed by the database with a single query grouped by team and
+    opponent, so no per-player aggregates are built. Records and
+    points come from one more query on the `game` table. Both queries
+    are run concurrently when an `nflcmd.executor.Executor` is active,
+    and their results are cached by `nflcmd.cache.fetchall`.
+
+    Only finished games are counted, so a game in progress doesn't add
+    statistics to a team without adding to its game count or record.
+    """
+    seasons = _seasons(years, stype)
+    where, params = _game_where(years, stype, week_range)
+    q_stats = '''
+        SELECT play_player.team,
+               CASE WHEN play_player.team = game.home_team
+                   THEN game.away_team
+                   ELSE game.home_team
+               END AS opp,
+               {sum_fields}
+        FROM {play_player}
+        JOIN game ON game.gsis_id = play_player.gsis_id
+        WHERE {where} AND game.finished AND play_player.team <> 'UNK'
+        GROUP BY 1, 2
+    '''.format(sum_fields=_sum_fields(), where=where,
+               play_player=aggtables.play_player_table(db, seasons))
+    q_games = '''
+        SELECT game.home_team, game.away_team, game.home_score,
+               game.away_score, game.finished
+        FROM game
+        WHERE {where}
+    '''.format(where=where)
+    stats, games = executor.gather(db, [
+        lambda conn: cache.fetchall(conn, q_stats, params, seasons),
+        lambda conn: cache.fetchall(conn, q_games, params, seasons),
+    ])
+
+    teams = {}
+
+    def team(t):
+        if t not in teams:
+            teams[t] = TeamTotals(t)
+        return teams[t]
+    for g in games:
+        if not g['finished']:
+            continue
+        home, away = team(g['home_team']), team(g['away_team'])
+        home.game_count += 1
+        away.game_count += 1
+        for t, pf, pa in ((home, g['home_score'], g['away_score']),
+                          (away, g['away_score'], g['home_score'])):
+            t.points_for += pf
+            t.points_against += pa
+            if pf > pa:
+                t.wins += 1
+            elif pf < pa:
+                t.losses += 1
+            else:
+                t.ties += 1
+    for r in stats:
+        us, them = team(r['team']), team(r['opp'])
+        for cat in _player_categories:
+            v = r[cat]
+            if v != 0:
+                us.stats[cat] = us.stats.get(cat, 0) + v
+                them.allowed[cat] = them.allowed.get(cat, 0) + v
+    return teams
+
+
+current_ttl = 60
+"""
+The number of seconds that `nflcmd.current` remembers the current
+season phase, year and week of a database connection.
+"""
+
+_current = {}
+_current_lock = threading.Lock()
+
+
+def current(db):
+    """
+    Returns the same triple as `nfldb.current`, except that the answer
+    is remembered for `nflcmd.current_ttl` seconds. This is useful for
+    long running processes that run many commands.
+    """
+    with _current_lock:
+        fetched, cur = _current.get(db, (0, None))
+    if cur is None or time.time() - fetched > current_ttl:
+        with profile.query() as pq:
+            cur = nfldb.current(db)
+            pq.rows = 1
+        with _current_lock:
+            _current[db] = (time.time(), cur)
+    return cur
+
+
+def search(db, name, team, pos, soundex=False, idx=None):
+    """
+    Returns the `nfldb.Player` whose name best matches `name`, or
+    `None` if no player matches. Players are looked up in the local
+    name index provided by `nflcmd.names`, so the database is not
+    searched.
+
+    An exact match of the full name wins. Otherwise, if `name` is one
+    word, then it assumes that it's a first/last name and tries to match
+    it exactly, preferring the closest full name. Failing that, the
+    player with the smallest Levenshtein distance (or the greatest
+    Soundex similarity) is returned.
+
+    If `idx` is given, then players are looked up in that
+    `nflcmd.names.NameIndex` instead (e.g., one built from a snapshot
+    by `nflcmd.snapshot.Snapshot.names`).
+    """
+    if idx is None:
+        idx = names.index(db)
+    ids = idx.exact(name, team, pos)
+    if len(ids) == 0 and len(name.split()) == 1:
+        ids = idx.first_or_last(name, team, pos)
+        key = names._normalize(name)
+        ids.sort(key=lambda i: (names.levenshtein(key, idx.names[i]), i))
+    if len(ids) == 0:
+        if soundex:
+            ids = [i for i, _ in idx.soundex(name, team, pos)]
+        else:
+            ids = [i for i, _ in idx.fuzzy(name, team, pos)]
+    if len(ids) == 0:
         return None
-    if ' ' not in name:
-        for p, _ in matches:
-            if name.lower() in map(str.lower, [p.first_name, p.last_name]):
-                return p
-    return matches[0][0]
+    return idx.player(db, ids[0])
+
+
+def player_position(db, player, show_as=None):
+    """
+    Returns the position that `player` should be displayed as. If
+    `show_as` is given, then it is used as the name of the position.
+    Otherwise, the player's position is used if it's known, or else it
+    is guessed from a histogram of the player's plays with
+    `nflcmd.guess_position`, which doesn't require fetching every play.
+    If the position can't be guessed, then `nfldb.Enums.player_pos.UNK`
+    is returned.
+    """
+    if show_as is not None:
+        return nfldb.Enums.player_pos[show_as]
+    if player.position != nfldb.Enums.player_pos.UNK:
+        return player.position
+    return guess_position(position_histogram(db, player.player_id))
+
+
+_guess_positions = [
+    ('QB', ['passing_att']),
+    ('RB', ['rushing_att']),
+    ('WR', ['receiving_tar']),
+    ('P', ['punting_tot']),
+    ('K', ['kicking_tot', 'kicking_fga', 'kicking_xpa']),
+    ('LB', sorted(c for c in _player_categories if c.startswith('defense_'))),
+]
+"""
+The positions guessed by `nflcmd.guess_position`, in order of
+precedence, along with the statistical categories that suggest each
+one. This is the same order used by `nfldb.PlayPlayer.guess_position`.
+"""
+
+
+def position_histogram(db, player_id):
+    """
+    Returns a dictionary mapping the names of positions in
+    `nflcmd._guess_positions` (and `UNK`) to the number of plays in
+    which the player with identifier `player_id` recorded statistics
+    suggesting that position. Each play is counted once, for the first
+    position it suggests.
+
+    The plays are classified and counted by the database, so only a
+    handful of rows are fetched no matter how long the player's career
+    is. The histogram is cached by `nflcmd.cache.fetchall` forever,
+    since it's only used for players who are no longer on a roster.
+    """
+    q = '''
+        SELECT {pos} AS pos, COUNT(*) AS plays
+        FROM play_player
+        WHERE player_id = %s
+        GROUP BY 1
+    '''.format(pos=_play_position_case())
+    rows = cache.fetchall(db, q, [player_id], [])
+    return dict((r['pos'], r['plays']) for r in rows)
+
+
+def _play_position_case():
+    """
+    Returns a SQL CASE expression naming the first position in
+    `nflcmd._guess_positions` suggested by a row of `play_player`
+    (i.e., a single play), or `UNK`.
+    """
+    cases = []
+    for pos, cats in _guess_positions:
+        cond = ' OR '.join('play_player.%s != 0' % c for c in cats
+                           if c in _player_category_set)
+        cases.append("WHEN %s THEN '%s'" % (cond, pos))
+    return "CASE %s ELSE 'UNK' END" % ' '.join(cases)
+
+
+def guess_position(hist):
+    """
+    Returns the position with the most plays in the histogram `hist`
+    (as returned by `nflcmd.position_histogram`) as a
+    `nfldb.Enums.player_pos`, preferring the positions that come first
+    in `nflcmd._guess_positions` when there's a tie.
+
+    This is the same majority vote as `nfldb.guess_position`, except
+    that plays that don't suggest any position (e.g., a fumble) don't
+    count. `UNK` is returned only if no play suggests a position.
+    """
+    best = None
+    for pos, _ in _guess_positions:
+        if hist.get(pos, 0) > 0:
+            if best is None or hist[pos] > hist[best]:
+                best = pos
+    return nfldb.Enums.player_pos[best or 'UNK']
 
 
 def percent(num, den):
@@ -371,23 +1054,222 @@ def ratio(num, den):
         return 0.0
 
 
-def fg_made(p):
+def _sum_fields(prefix='play_player.'):
+    """
+    Returns a SQL SELECT string that sums every player statistical
+    category. Each sum is named after its category.
+    """
+    sql = 'SUM({prefix}{f}) AS {f}'
+    return ', '.join(sql.format(prefix=prefix, f=f)
+                     for f in _player_categories)
+
+
+def _game_where(years, stype, week_range=None):
+    """
+    Returns a SQL boolean expression on the `game` table and its
+    parameters restricting games to the given seasons, season phase
+    and an optional range of weeks.
+    """
+    where = 'game.season_year = ANY(%s) AND game.season_type = %s'
+    params = [[int(y) for y in years], stype]
+    if week_range is not None:
+        where += ' AND game.week = ANY(%s)'
+        params.append([int(w) for w in week_range])
+    return where, params
+
+
+def _seasons(years, stype):
+    """
+    Returns the list of `(season_year, season_type)` pairs for the
+    given years and season phase. (This is the form of seasons used
+    by `nflcmd.cache.fetchall`.)
+    """
+    return [(int(year), stype) for year in years]
+
+
+def _player_games(db, pids, where, params, seasons=None, conn=None):
+    """
+    Returns a dictionary mapping GSIS identifiers to `nfldb.Game`
+    objects for every game matching `where` (a SQL boolean expression
+    on the `game` table) in which any of the players in `pids` recorded
+    a statistic. If `seasons` is not `None`, then the rows are cached
+    by `nflcmd.cache.fetchall`.
+
+    The query is run on `conn` if it's given (e.g., a connection
+    handed out by `nflcmd.executor.gather`), but the games returned
+    always use `db`.
+    """
+    q = '''
+        SELECT {columns}
+        FROM game
+        WHERE {where} AND game.gsis_id IN (
+            SELECT play_player.gsis_id FROM play_player
+            WHERE play_player.player_id IN %s
+        )
+    '''.format(columns=nfldb.select_columns(nfldb.Game), where=where)
+    games = {}
+    for r in cache.fetchall(conn or db, q, params + [pids], seasons):
+        g = nfldb.Game.from_row(db, r)
+        games[g.gsis_id] = g
+    return games
+
+
+def _players_by_id(db, pids, conn=None):
+    """
+    Returns a dictionary mapping the player identifiers in `pids` to
+    `nfldb.Player` objects, which are fetched with a single query on
+    `conn` (or `db` if it isn't given).
+    """
+    q = 'SELECT %s FROM player WHERE player_id IN %%s' \
+        % nfldb.select_columns(nfldb.Player)
+    with profile.query() as pq:
+        with nfldb.Tx(conn or db) as cursor:
+            cursor.execute(q, (tuple(pids),))
+            rows = cursor.fetchall()
+        pq.rows = len(rows)
+    return dict((r['player_id'], nfldb.Player.from_row(db, r))
+                for r in rows)
+
+
+def _player_game_stats(db, where, params, seasons=None, conn=None):
+    """
+    Returns a dictionary mapping `(player_id, gsis_id)` pairs to the
+    aggregate statistics of each player in each game matching `where`
+    (a SQL boolean expression on the `play_player` and `game` tables).
+    The `team` attribute of each aggregate is set to the team that the
+    player belonged to in that game. If `seasons` is not `None`, then
+    the rows are cached by `nflcmd.cache.fetchall`.
+
+    The query is run on `conn` if it's given, but the aggregates
+    returned always use `db`. The per-game totals maintained by
+    `nflcmd.aggtables` are used when they're fresh.
+    """
+    q = '''
+        SELECT play_player.player_id, play_player.gsis_id,
+               MIN(play_player.team) AS team, {sum_fields}
+        FROM {play_player}
+        JOIN game ON game.gsis_id = play_player.gsis_id
+        WHERE {where}
+        GROUP BY play_player.player_id, play_player.gsis_id
+    '''.format(sum_fields=_sum_fields(), where=where,
+               play_player=aggtables.play_player_table(conn or db, seasons))
+    stats = {}
+    for row in cache.fetchall(conn or db, q, params, seasons):
+        pid, gid = row['player_id'], row['gsis_id']
+        stats[(pid, gid)] = _pstat_from_row(db, row, pid, gid, row['team'])
+    return stats
+
+
+def _game_totals(db, keys, where, params, seasons=None):
+    """
+    Sums the statistics of each player in each game matching `where`
+    (a SQL boolean expression on the `play_player` and `game` tables)
+    and then sums those per-game statistics grouped by `keys`, which
+    must be a list of `player_id` and/or `season_year`.
+
+    Each row returned has the sum of every player statistical category
+    along with `gsis_ids` and `teams` (the games and the player's team
+    in each game, sorted by GSIS identifier) and `passing_300` (the
+    number of games with at least 300 passing yards). Rows are sorted
+    by `keys`. If `seasons` is not `None`, then the rows are cached by
+    `nflcmd.cache.fetchall` and the per-game totals maintained by
+    `nflcmd.aggtables` are used when they're fresh.
+    """
+    assert set(keys) <= set(['player_id', 'season_year'])
+    q = '''
+        SELECT {keys},
+               array_agg(pg.gsis_id ORDER BY pg.gsis_id) AS gsis_ids,
+               array_agg(pg.team ORDER BY pg.gsis_id) AS teams,
+               SUM(CASE WHEN pg.passing_yds >= 300 THEN 1 ELSE 0 END)
+                 AS passing_300,
+               {pg_sum_fields}
+        FROM (
+            SELECT play_player.player_id, play_player.gsis_id,
+                   game.season_year, MIN(play_player.team) AS team,
+                   {sum_fields}
+            FROM {play_player}
+            JOIN game ON game.gsis_id = play_player.gsis_id
+            WHERE {where}
+            GROUP BY play_player.player_id, play_player.gsis_id,
+                     game.season_year
+        ) AS pg
+        GROUP BY {keys}
+        ORDER BY {keys}
+    '''.format(keys=', '.join('pg.%s' % k for k in keys), where=where,
+               sum_fields=_sum_fields(), pg_sum_fields=_sum_fields('pg.'),
+               play_player=aggtables.play_player_table(db, seasons))
+    return cache.fetchall(db, q, params, seasons)
+
+
+def _fg_histograms(db, keys, where, params, seasons=None):
+    """
+    Returns a dictionary mapping values of `keys` (columns of the
+    `play_player` or `game` tables) to `nflcmd.FieldGoals` histograms.
+    Only field goals matching `where` are counted. When there is more
+    than one key, the dictionary is keyed by tuples of their values.
+
+    The field goals are bucketed and counted by the database. If
+    `seasons` is not `None`, then the counts are cached by
+    `nflcmd.cache.fetchall`.
+    """
+    dist = '''
+        CASE WHEN play_player.kicking_fgm = 1
+            THEN play_player.kicking_fgm_yds
+            ELSE play_player.kicking_fgmissed_yds
+        END'''
+    cases, case_params = [], []
+    for name, start, end in fg_ranges:
+        cases.append('WHEN %s BETWEEN %%s AND %%s THEN %%s' % dist)
+        case_params += [start, end, name]
+    q = '''
+        SELECT {keys}, CASE {cases} END AS bucket,
+               SUM(play_player.kicking_fgm) AS made, COUNT(*) AS att
+        FROM play_player
+        JOIN game ON game.gsis_id = play_player.gsis_id
+        WHERE play_player.kicking_fga = 1 AND {where}
+        GROUP BY {groups}
+    '''.format(keys=', '.join('%s AS key%d' % (k, i)
+                              for i, k in enumerate(keys)),
+               cases=' '.join(cases), where=where,
+               groups=', '.join(str(i+1) for i in range(len(keys) + 1)))
+
+    hists = {}
+    for row in cache.fetchall(db, q, case_params + list(params), seasons):
+        if row['bucket'] is None:
+            continue
+        key = tuple(row['key%d' % i] for i in range(len(keys)))
+        if len(keys) == 1:
+            key = key[0]
+        hist = hists.setdefault(key, FieldGoals())
+        hist.counts[row['bucket']] = [row['made'], row['att']]
+    return hists
+
+
+def _pstat_from_row(db, row, player_id, gsis_id=None, team=None):
     """
-    Returns `True` if and only if `p` corresponds to a made field goal.
+    Returns a `nfldb.PlayPlayer` object from a SQL row containing a
+    sum for every player statistical category. (e.g., the result of
+    using `nflcmd._sum_fields` in a query.)
     """
-    return p.kicking_fgm == 1
+    stats = {}
+    for f in _player_categories:
+        if row[f] != 0:
+            stats[f] = row[f]
+    return nfldb.PlayPlayer(db, gsis_id, None, None, player_id, team, stats)
 
 
-def fgs_range(fg_plays, start, end):
+def team_sequence(teams):
     """
-    Given a list of field goal `nfldb.PlayPlayer` objects, return only
-    the field goals in the range `[start, end]`.
+    Given an iterable of teams (one for each game in chronological
+    order), return the list of teams with consecutive duplicates
+    removed. e.g., `['NE', 'NE', 'NYJ', 'NE']` becomes
+    `['NE', 'NYJ', 'NE']`.
     """
-    def pred(p):
-        if p.kicking_fgm == 1:
-            return start <= p.kicking_fgm_yds <= end
-        return start <= p.kicking_fgmissed_yds <= end
-    return filter(pred, fg_plays)
+    seq = []
+    for team in teams:
+        if len(seq) == 0 or seq[-1] != team:
+            seq.append(team)
+    return seq
 
 
 def query_games(db, player, year, stype, week_range=None):
@@ -409,10 +1291,7 @@ def player_team_in_game(db, game, player):
     Returns the team that the `nfldb.Player` belonged to in a
     particular `nfldb.Game`.
     """
-    q = nfldb.Query(db).game(gsis_id=game.gsis_id)
-    q.player(player_id=player.player_id)
-    q.limit(1)
-    return q.as_play_players()[0].team
+    return games_stats(db, [game], player)[game.gsis_id].team
 
 
 def pstat_to_row(spec, pstat):
@@ -421,18 +1300,85 @@ def pstat_to_row(spec, pstat):
     to the given spec. Note that `pstat` should be like a
     `nfldb.PlayPlayer` object.
     """
-    row = []
-    for column in spec:
-        v = 0
-        if column in statfuns:
-            v = statfuns[column](pstat)
-        else:
-            v = getattr(pstat, column)
-        if isinstance(v, float):
-            row.append('%0.1f' % v)
-        else:
-            row.append(v)
-    return row
+    return compile_spec(spec).row(pstat)
+
+
+def pstat_to_values(spec, pstat):
+    """
+    Like `nflcmd.pstat_to_row`, except the values are not formatted.
+    """
+    return compile_spec(spec).values(pstat)
+
+
+_projections = {}
+
+
+def compile_spec(spec):
+    """
+    Returns a `nflcmd.Projection` for the list of columns in `spec`.
+    Projections are remembered, so compiling the same spec twice is
+    cheap.
+    """
+    key = tuple(spec)
+    proj = _projections.get(key)
+    if proj is None:
+        proj = _projections[key] = Projection(spec)
+    return proj
+
+
+class Projection (object):
+    """
+    A compiled form of a spec (a list of columns, like those in
+    `nflcmd.columns`) that extracts and formats the columns of rows.
+
+    How each column is fetched is resolved once for each type of row.
+    For `nflcmd.Game` and `nflcmd.Games` rows, statistical categories
+    are read straight from the `stats` dictionary copied into each row
+    instead of going through `__getattr__`. Each value is formatted on
+    its own, since the same column may hold integers, floats and
+    strings in different rows: floats are shown with one decimal place.
+    """
+    def __init__(self, spec):
+        self.spec = list(spec)
+        self._getters = {}
+
+    def values(self, pstat):
+        """
+        Returns the list of values in `pstat` for each column.
+        """
+        getters = self._getters.get(type(pstat))
+        if getters is None:
+            getters = [_getter(type(pstat), c) for c in self.spec]
+            self._getters[type(pstat)] = getters
+        return [get(pstat) for get in getters]
+
+    def row(self, pstat):
+        """
+        Returns the list of formatted values in `pstat` for each
+        column, like `nflcmd.pstat_to_row`.
+        """
+        return [_format(v) for v in self.values(pstat)]
+
+
+def _getter(rowtype, column):
+    """
+    Returns a function that fetches `column` from a row of type
+    `rowtype`.
+    """
+    if column in statfuns:
+        return statfuns[column]
+    if issubclass(rowtype, (Game, Games)):
+        if FieldGoals.is_column(column):
+            return lambda row: row.fg_hist.column(column)
+        if hasattr(rowtype, column):
+            return operator.attrgetter(column)
+        if column in _player_category_set:
+            return lambda row: row.stats.get(column, 0)
+    return operator.attrgetter(column)
+
+
+def _format(v):
+    return '%0.1f' % v if isinstance(v, float) else v
 
 
 def header_row(spec):
@@ -442,7 +1388,12 @@ def header_row(spec):
     """
     header = []
     for column in spec:
-        header.append(abbrev.get(column, column))
+        if column not in abbrev and column.endswith('_pct'):
+            # A percentile column from `nflcmd.league.League.spec`.
+            base = column[:-4]
+            header.append('%s %%ile' % abbrev.get(base, base))
+        else:
+            header.append(abbrev.get(column, column))
     return header
 
 
@@ -457,38 +1408,92 @@ def table(lst):
     (or maybe it was Go's standard library), but I'm on an airplane and
     pydoc sucks.
     """
+    buf = StringIO()
+    write_table(lst, buf)
+    return buf.getvalue()[:-1]
+
+
+def write_table(lst, out=None):
+    """
+    Like `nflcmd.table`, except the table is written to `out` (which
+    defaults to `sys.stdout`) one line at a time. Since the width of
+    a column depends on every row, each row is first converted to
+    strings and buffered (computing the column widths as it goes),
+    but the padded lines of the table are never joined into one
+    string in memory.
+    """
+    out = sys.stdout if out is None else out
     pad = 2
     maxcols = []
     output = []
-    first_row = True
     for row in lst:
         if row is None:
             output.append([])
             continue
 
-        output_row = []
-        for i, cell in enumerate(row):
-            cell = str(cell)
-            if first_row:
+        output_row = [str(cell) for cell in row]
+        for i, cell in enumerate(output_row):
+            if i == len(maxcols):
                 maxcols.append(len(cell) + pad)
             else:
-                maxcols[i] = max([maxcols[i], len(cell) + pad])
-            output_row.append(cell)
-
+                maxcols[i] = max(maxcols[i], len(cell) + pad)
         output.append(output_row)
-        first_row = False
 
     rowsep = '-' * sum(maxcols)
-    nice = []
     for i, row in enumerate(output):
-        nice_row = []
-        for j, cell in enumerate(row):
-            nice_row.append(cell.rjust(maxcols[j]))
-        nice.append(''.join(nice_row))
+        out.write(''.join(cell.rjust(maxcols[j])
+                          for j, cell in enumerate(row)))
+        out.write('\n')
         if i < len(output) - 1:
-            nice.append(rowsep)
+            out.write(rowsep + '\n')
+
+
+formats = ['table', 'csv', 'tsv', 'json', 'ndjson']
+"""
+The output formats supported by `nflcmd.write_pstats`.
+"""
+
+
+def write_pstats(fmt, spec, pstats, out=None, extra=None):
+    """
+    Writes a row for each player statistic in `pstats` to `out` (which
+    defaults to `sys.stdout`) in the format `fmt`, which must be one
+    of `nflcmd.formats`. Each row corresponds to the columns in
+    `spec`.
+
+    With the exception of `table`, every format is written one row at
+    a time as `pstats` is iterated. Machine readable formats use the
+    column names in `spec` rather than the abbreviations in
+    `nflcmd.abbrev`. The `json` and `ndjson` formats write values
+    without formatting them first, along with the values in the
+    dictionary `extra` (if given).
+    """
+    assert fmt in formats
+    out = sys.stdout if out is None else out
+    proj = compile_spec(spec)
+    if fmt == 'table':
+        rows = [header_row(spec)]
+        rows += (proj.row(pstat) for pstat in pstats)
+        write_table(rows, out)
+    elif fmt in ('csv', 'tsv'):
+        w = csv.writer(out, delimiter=',' if fmt == 'csv' else '\t',
+                       lineterminator='\n')
+        w.writerow(spec)
+        for pstat in pstats:
+            w.writerow(proj.row(pstat))
+    else:
+        sep = '[' if fmt == 'json' else ''
+        for pstat in pstats:
+            values = dict(zip(spec, proj.values(pstat)))
+            values.update(extra or {})
+            out.write(sep)
+            out.write(json.dumps(values, default=str, sort_keys=True))
+            sep = ',\n' if fmt == 'json' else '\n'
+        if fmt == 'json':
+            out.write(']\n' if sep != '[' else '[]\n')
+        elif sep != '':
+            out.write('\n')
 
-    return '\n'.join(nice)
 
 def arg_range(arg, lo, hi):
     """
@@ -511,3 +1516,40 @@ def arg_range(arg, lo, hi):
         return range(int(start), hi+1)
     else:
         return range(int(start), int(end)+1)
+
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def working_directory(cwd):
+    """
+    Resolves relative paths given to `nflcmd.path_arg` in the current
+    thread against `cwd` instead of the working directory of the
+    process, until the context exits. Standard input can't be read in
+    this context either. This is used by `nflcmd serve`, where each
+    command runs on behalf of a client with its own working directory.
+    """
+    old = getattr(_local, 'cwd', None)
+    _local.cwd = cwd
+    try:
+        yield
+    finally:
+        _local.cwd = old
+
+
+def path_arg(arg):
+    """
+    An `argparse` type for file paths. Relative paths are made
+    absolute with the working directory of the command (see
+    `nflcmd.working_directory`). The path `-`, which some commands use
+    for standard input, is returned unchanged.
+    """
+    cwd = getattr(_local, 'cwd', None)
+    if arg == '-':
+        if cwd is not None:
+            raise argparse.ArgumentTypeError(
+                'standard input is not available to commands run by '
+                '"nflcmd serve"')
+        return arg
+    return os.path.join(cwd or os.getcwd(), arg)
@@ -0,0 +1,460 @@
+"""
+Module nflcmd.aggtables maintains tables of precomputed aggregate
+statistics alongside nfldb's tables, in the same database:
+
+* `nflcmd_player_game` has the sum of every player statistic for each
+  player in each game, along with the player's team and the game's
+  season and week.
+* `nflcmd_player_season` has the same sums for each player in each
+  season, along with the number of games played and the number of 300
+  yard passing games.
+* `nflcmd_agg_state` records, for each season, the last time a game
+  in that season was updated when the season was last refreshed.
+
+Both player tables also list the categories (in `nonzero`) that the
+player recorded on at least one play. A sum can be zero even when some
+plays weren't (e.g., a 5 yard run and a -5 yard run), and `nflrank`
+ranks every player who recorded a category on any play. They also
+count the plays suggesting each position in `nflcmd._guess_positions`
+(e.g., `plays_qb`), which `nflcmd.league` uses to tell the position a
+player played.
+
+The tables are created and refreshed by `nflcmd aggregate` (see
+`nflcmd.cmds.aggregate`). A refresh only re-aggregates the games that
+have been updated since the last refresh, so running it after every
+`nfldb-update` is cheap.
+
+A season is fresh when none of its games have been updated since it
+was refreshed, which is checked the same way (and with the same
+`nflcmd.cache.stamp_ttl`) as the query cache. When every season used
+by a query is fresh, nflcmd reads per-game totals from
+`nflcmd_player_game` instead of aggregating `play_player` and ranks
+players with `nflcmd_player_season`. Otherwise, the tables are ignored
+and results are computed from nfldb's tables as usual.
+"""
+from __future__ import absolute_import, division, print_function
+import threading
+import time
+
+import nfldb
+
+from nflcmd import cache
+
+_categories = [cat for cat, c in nfldb.stat_categories.items()
+               if c.category_type is nfldb.Enums.category_scope.player]
+
+_states = {}
+_lock = threading.Lock()
+
+
+def create(db):
+    """
+    Creates the aggregate tables if they don't already exist. They
+    are empty until `nflcmd.aggtables.refresh` is called.
+
+    Tables written by an older version of nflcmd (see
+    `nflcmd.aggtables.exists`) are dropped and created again.
+    """
+    if exists(db):
+        return
+    drop(db)
+    cats = ', '.join('%s %s NOT NULL DEFAULT 0'
+                     % (c, 'real' if nfldb.stat_categories[c].is_real
+                        else 'integer')
+                     for c in _categories)
+    cats += ''.join(', %s integer NOT NULL DEFAULT 0' % c
+                    for c in _plays_columns())
+    with nfldb.Tx(db) as cursor:
+        cursor.execute('''
+            CREATE TABLE nflcmd_player_game (
+                player_id character varying (10) NOT NULL,
+                gsis_id gameid NOT NULL,
+                team character varying (3) NOT NULL,
+                season_year usmallint NOT NULL,
+                season_type season_phase NOT NULL,
+                week usmallint NOT NULL,
+                nonzero text[] NOT NULL DEFAULT '{}',
+                %s,
+                PRIMARY KEY (player_id, gsis_id),
+                FOREIGN KEY (gsis_id)
+                    REFERENCES game (gsis_id)
+                    ON DELETE CASCADE
+            )
+        ''' % cats)
+        cursor.execute('''
+            CREATE INDEX nflcmd_pg_in_gsis_id
+                ON nflcmd_player_game (gsis_id ASC);
+            CREATE INDEX nflcmd_pg_in_season
+                ON nflcmd_player_game (season_year ASC, season_type ASC,
+                                       week ASC);
+        ''')
+        cursor.execute('''
+            CREATE TABLE nflcmd_player_season (
+                player_id character varying (10) NOT NULL,
+                season_year usmallint NOT NULL,
+                season_type season_phase NOT NULL,
+                game_count usmallint NOT NULL,
+                passing_300 usmallint NOT NULL,
+                nonzero text[] NOT NULL DEFAULT '{}',
+                %s,
+                PRIMARY KEY (season_year, season_type, player_id)
+            )
+        ''' % cats)
+        cursor.execute('''
+            CREATE TABLE nflcmd_agg_state (
+                season_year usmallint NOT NULL,
+                season_type season_phase NOT NULL,
+                updated timestamp with time zone NOT NULL,
+                min_week usmallint NOT NULL,
+                max_week usmallint NOT NULL,
+                refreshed timestamp with time zone NOT NULL,
+                PRIMARY KEY (season_year, season_type)
+            )
+        ''')
+    _forget(db)
+
+
+def drop(db):
+    """
+    Drops the aggregate tables. nflcmd goes back to aggregating
+    nfldb's tables for every query.
+    """
+    with nfldb.Tx(db) as cursor:
+        cursor.execute('''
+            DROP TABLE IF EXISTS
+                nflcmd_agg_state, nflcmd_player_season, nflcmd_player_game
+        ''')
+    _forget(db)
+
+
+def exists(db):
+    """
+    Returns `True` if and only if the aggregate tables have been
+    created in the database of `db` with every column this version of
+    nflcmd uses. Tables missing a column are ignored until they're
+    rebuilt by `nflcmd aggregate`.
+    """
+    q = '''
+        SELECT
+            (SELECT COUNT(*) FROM information_schema.tables
+             WHERE table_name IN ('nflcmd_player_game',
+                                  'nflcmd_player_season',
+                                  'nflcmd_agg_state')
+               AND table_schema = current_schema()) AS tables,
+            (SELECT COUNT(*) FROM information_schema.columns
+             WHERE table_name IN ('nflcmd_player_game',
+                                  'nflcmd_player_season')
+               AND column_name IN %s
+               AND table_schema = current_schema()) AS columns
+    '''
+    params = tuple(['nonzero'] + _plays_columns())
+    row = cache.fetchall(db, q, [params])[0]
+    return row['tables'] == 3 and row['columns'] == 2 * len(params)
+
+
+def refresh(db, full=False):
+    """
+    Re-aggregates every game that was updated since its season was
+    last refreshed (or every game, if `full` is `True`). The tables are
+    created first if they don't exist.
+
+    A pair of the number of games and the number of seasons that were
+    refreshed is returned.
+    """
+    create(db)
+    cats = ', '.join(_categories)
+    sums = ', '.join('SUM(%s) AS %s' % (c, c) for c in _categories)
+    pp_sums = ', '.join('SUM(play_player.%s)' % c for c in _categories)
+    pp_nonzero = _nonzero('BOOL_OR(play_player.{c} <> 0)')
+    pg_nonzero = _nonzero("BOOL_OR('{c}' = ANY(pg.nonzero))")
+    plays = ', '.join(_plays_columns())
+    pp_plays = ', '.join('SUM(%s)' % e
+                         for _, e in position_plays('play_player'))
+    pg_plays = ', '.join('SUM(pg.%s)' % c for c in _plays_columns())
+    with nfldb.Tx(db) as cursor:
+        # Every statement should see the same snapshot of nfldb, so
+        # that the update times recorded match the data aggregated.
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        if full:
+            cursor.execute('DELETE FROM nflcmd_agg_state')
+        cursor.execute('''
+            CREATE TEMPORARY TABLE nflcmd_changed ON COMMIT DROP AS
+            SELECT game.gsis_id, game.season_year, game.season_type
+            FROM game
+            LEFT JOIN nflcmd_agg_state AS s
+                ON s.season_year = game.season_year
+               AND s.season_type = game.season_type
+            WHERE s.updated IS NULL OR game.time_updated > s.updated
+        ''')
+        cursor.execute('SELECT COUNT(*) AS n FROM nflcmd_changed')
+        games = cursor.fetchone()['n']
+        cursor.execute('''
+            CREATE TEMPORARY TABLE nflcmd_changed_seasons ON COMMIT DROP AS
+            SELECT DISTINCT season_year, season_type FROM nflcmd_changed
+        ''')
+        cursor.execute('SELECT COUNT(*) AS n FROM nflcmd_changed_seasons')
+        seasons = cursor.fetchone()['n']
+        if full:
+            cursor.execute('TRUNCATE nflcmd_player_game, '
+                           'nflcmd_player_season')
+        if games == 0:
+            return 0, 0
+
+        cursor.execute('''
+            DELETE FROM nflcmd_player_game AS pg
+            USING nflcmd_changed AS c
+            WHERE pg.gsis_id = c.gsis_id
+        ''')
+        cursor.execute('''
+            INSERT INTO nflcmd_player_game
+                (player_id, gsis_id, team, season_year, season_type, week,
+                 nonzero, {plays}, {cats})
+            SELECT play_player.player_id, play_player.gsis_id,
+                   MIN(play_player.team), game.season_year,
+                   game.season_type, game.week, {pp_nonzero}, {pp_plays},
+                   {pp_sums}
+            FROM play_player
+            JOIN nflcmd_changed AS c ON c.gsis_id = play_player.gsis_id
+            JOIN game ON game.gsis_id = play_player.gsis_id
+            GROUP BY play_player.player_id, play_player.gsis_id,
+                     game.season_year, game.season_type, game.week
+        '''.format(cats=cats, plays=plays, pp_nonzero=pp_nonzero,
+                   pp_plays=pp_plays, pp_sums=pp_sums))
+
+        cursor.execute('''
+            DELETE FROM nflcmd_player_season AS ps
+            USING nflcmd_changed_seasons AS c
+            WHERE ps.season_year = c.season_year
+              AND ps.season_type = c.season_type
+        ''')
+        cursor.execute('''
+            INSERT INTO nflcmd_player_season
+                (player_id, season_year, season_type, game_count,
+                 passing_300, nonzero, {plays}, {cats})
+            SELECT pg.player_id, pg.season_year, pg.season_type, COUNT(*),
+                   SUM(CASE WHEN pg.passing_yds >= 300 THEN 1 ELSE 0 END),
+                   {pg_nonzero}, {pg_plays}, {sums}
+            FROM nflcmd_player_game AS pg
+            JOIN nflcmd_changed_seasons AS c
+                ON c.season_year = pg.season_year
+               AND c.season_type = pg.season_type
+            GROUP BY pg.player_id, pg.season_year, pg.season_type
+        '''.format(cats=cats, plays=plays, pg_nonzero=pg_nonzero,
+                   pg_plays=pg_plays, sums=sums))
+
+        cursor.execute('''
+            DELETE FROM nflcmd_agg_state AS s
+            USING nflcmd_changed_seasons AS c
+            WHERE s.season_year = c.season_year
+              AND s.season_type = c.season_type
+        ''')
+        cursor.execute('''
+            INSERT INTO nflcmd_agg_state
+                (season_year, season_type, updated, min_week, max_week,
+                 refreshed)
+            SELECT game.season_year, game.season_type,
+                   MAX(game.time_updated), MIN(game.week), MAX(game.week),
+                   NOW()
+            FROM game
+            JOIN nflcmd_changed_seasons AS c
+                ON c.season_year = game.season_year
+               AND c.season_type = game.season_type
+            GROUP BY game.season_year, game.season_type
+        ''')
+    _forget(db)
+    return games, seasons
+
+
+def status(db):
+    """
+    Returns a list of rows, one for each season in nfldb sorted by
+    year and phase, with the keys `season_year`, `season_type`,
+    `games`, `refreshed` (the time the season was last refreshed, or
+    `None`) and `fresh`. The tables must exist.
+    """
+    q = '''
+        SELECT game.season_year, game.season_type, COUNT(*) AS games,
+               MAX(game.time_updated) AS updated,
+               MIN(s.updated) AS refreshed_updated,
+               MIN(s.refreshed) AS refreshed
+        FROM game
+        LEFT JOIN nflcmd_agg_state AS s
+            ON s.season_year = game.season_year
+           AND s.season_type = game.season_type
+        GROUP BY game.season_year, game.season_type
+        ORDER BY game.season_year, game.season_type
+    '''
+    rows = cache.fetchall(db, q, [])
+    for row in rows:
+        row['fresh'] = row.pop('refreshed_updated') == row.pop('updated')
+    return rows
+
+
+def state(db):
+    """
+    Returns a dictionary mapping `(season_year, season_type)` pairs to
+    the refresh state of each season in the aggregate tables: a
+    dictionary with the keys `updated`, `min_week`, `max_week` and
+    `refreshed`. If the tables don't exist, then `None` is returned.
+
+    The state is fetched at most once every `nflcmd.cache.stamp_ttl`
+    seconds for each connection.
+    """
+    with _lock:
+        fetched, st = _states.get(db, (0, None))
+    if fetched > 0 and time.time() - fetched <= cache.stamp_ttl:
+        return st
+    st = None
+    if exists(db):
+        st = {}
+        q = 'SELECT * FROM nflcmd_agg_state'
+        for row in cache.fetchall(db, q, []):
+            season = cache._season_key((row['season_year'],
+                                        row['season_type']))
+            st[season] = row
+    with _lock:
+        _states[db] = (time.time(), st)
+    return st
+
+
+def fresh(db, seasons):
+    """
+    Returns `True` if and only if the aggregate tables are up to date
+    for every `(season_year, season_type)` pair in `seasons`. Seasons
+    without any games are always up to date.
+    """
+    st = state(db)
+    if st is None:
+        return False
+    for season, updated in cache.season_stamps(db, seasons).items():
+        if updated is None:
+            continue
+        if season not in st or st[season]['updated'] != updated:
+            return False
+    return True
+
+
+def play_player_table(db, seasons):
+    """
+    Returns a SQL table expression named `play_player` to aggregate
+    player statistics from in the given seasons. If the aggregate
+    tables are fresh, this is `nflcmd_player_game`, which has one row
+    for each player in each game, so that summing its rows grouped by
+    player and game (or any coarser grouping) gives the same results
+    as summing `play_player` with far fewer rows. Otherwise, it's just
+    `play_player`.
+
+    N.B. `nflcmd_player_game` doesn't have the play level columns of
+    `play_player` (e.g., `drive_id` and `play_id`), and a player has a
+    row in a game if they recorded any statistic in that game.
+    """
+    if seasons is not None and fresh(db, seasons):
+        return 'nflcmd_player_game AS play_player'
+    return 'play_player'
+
+
+def position_plays(table):
+    """
+    Returns a list of pairs of each position in
+    `nflcmd._guess_positions` and a SQL expression that, summed over
+    the rows of `table` (as returned by
+    `nflcmd.aggtables.play_player_table`), counts the plays suggesting
+    that position. Each play is counted once, for the first position
+    it suggests.
+    """
+    import nflcmd
+
+    pairs = []
+    for pos, c in zip(_positions(), _plays_columns()):
+        if table == 'play_player':
+            e = "CASE WHEN %s = '%s' THEN 1 ELSE 0 END" % (
+                nflcmd._play_position_case(), pos)
+        else:
+            e = 'play_player.%s' % c
+        pairs.append((pos, e))
+    return pairs
+
+
+def rank(db, cats, years, stype, weeks, pos, teams, limit):
+    """
+    Returns the same aggregate statistics as `nflcmd.cmds.rank.rank_query`
+    using the aggregate tables, or `None` if the tables aren't fresh
+    for the seasons given.
+
+    When every week of each season is included, the per-season totals
+    in `nflcmd_player_season` are summed. Otherwise, the per-game
+    totals in `nflcmd_player_game` for the given weeks are summed.
+
+    Like the query on nfldb's tables, a player is ranked if they
+    recorded one of the categories in `cats` on any play, even if its
+    total is zero.
+    """
+    import nflcmd
+
+    seasons = [(int(y), stype) for y in years]
+    if not fresh(db, seasons):
+        return None
+    pos = tuple(str(nfldb.Enums.player_pos[p]) for p in pos)
+
+    st = state(db)
+    weekset = set(int(w) for w in weeks)
+    whole = True
+    for season in map(cache._season_key, seasons):
+        s = st.get(season)
+        if s is not None:
+            whole = whole and weekset.issuperset(
+                range(s['min_week'], s['max_week'] + 1))
+
+    table = 'nflcmd_player_season' if whole else 'nflcmd_player_game'
+    where = ['agg.season_year = ANY(%s)', 'agg.season_type = %s']
+    params = [[int(y) for y in years], stype]
+    if not whole:
+        where.append('agg.week = ANY(%s)')
+        params.append(sorted(weekset))
+    join_player = ''
+    if pos or teams:
+        join_player = 'JOIN player ON player.player_id = agg.player_id'
+    if pos:
+        where.append('player.position IN %s')
+        params.append(pos)
+    if teams:
+        where.append('player.team IN %s')
+        params.append(tuple(teams))
+    q = '''
+        SELECT agg.player_id, {sums}
+        FROM {table} AS agg
+        {join_player}
+        WHERE {where}
+        GROUP BY agg.player_id
+        HAVING BOOL_OR(agg.nonzero && %s::text[])
+        ORDER BY {order}, agg.player_id
+        LIMIT %s
+    '''.format(sums=', '.join('SUM(agg.%s) AS %s' % (c, c)
+                              for c in _categories),
+               table=table, join_player=join_player,
+               where=' AND '.join(where),
+               order=', '.join('SUM(agg.%s) DESC' % c for c in cats))
+    rows = cache.fetchall(db, q, params + [list(cats), limit], seasons)
+    return [nflcmd._pstat_from_row(db, r, r['player_id']) for r in rows]
+
+
+def _positions():
+    import nflcmd
+    return [pos for pos, _ in nflcmd._guess_positions]
+
+
+def _plays_columns():
+    return ['plays_%s' % pos.lower() for pos in _positions()]
+
+
+def _nonzero(recorded):
+    # A SQL array of the categories for which `recorded` (formatted with
+    # the name of each category as `c`) is true in a group of rows.
+    cases = ["CASE WHEN %s THEN '%s' END" % (recorded.format(c=c), c)
+             for c in _categories]
+    return 'ARRAY_REMOVE(ARRAY[%s]::text[], NULL)' % ', '.join(cases)
+
+
+def _forget(db):
+    with _lock:
+        _states.pop(db, None)
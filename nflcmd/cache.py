@@ -0,0 +1,284 @@
+"""
+Module nflcmd.cache provides a persistent cache of query results that
+is stored in a SQLite database on disk. By default, the database is
+at `$XDG_CACHE_HOME/nflcmd/cache.sqlite` (or `~/.cache/nflcmd/...`).
+
+Every cached result is tagged with the seasons that it depends on
+along with the last time each of those seasons was updated in nfldb.
+A result is only used if none of its seasons have been updated since.
+In practice, this means that results for past seasons are cached
+forever (or until evicted) while results for the current season are
+invalidated whenever `nfldb-update` changes a game in that season.
+
+When the cache exceeds `nflcmd.cache.max_bytes`, the least recently
+used results are evicted.
+"""
+from __future__ import absolute_import, division, print_function
+import enum
+import hashlib
+import os
+import os.path as path
+import sqlite3
+import threading
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import nfldb
+
+from nflcmd import profile
+
+enabled = True
+"""
+When `False`, `nflcmd.cache.fetchall` always queries the database.
+"""
+
+max_bytes = 64 * 1024 * 1024
+"""
+The maximum total size, in bytes, of all cached results.
+"""
+
+stamp_ttl = 60
+"""
+The number of seconds that the last update times of seasons are
+trusted before they are fetched from nfldb again.
+"""
+
+_cache = None
+_cache_lock = threading.Lock()
+_stamps = {}
+
+
+def cache_path():
+    """
+    Returns the file path of the cache database.
+    """
+    home = os.getenv('XDG_CACHE_HOME', path.join('~', '.cache'))
+    return path.join(path.expanduser(home), 'nflcmd', 'cache.sqlite')
+
+
+def fetchall(db, q, params, seasons=None):
+    """
+    Executes the SQL query `q` with `params` and returns all of its
+    rows as dictionaries. `seasons` should be a list of
+    `(season_year, season_type)` pairs corresponding to the seasons
+    that the results depend on. If it's `None`, then the results are
+    never cached. (An empty list means the results never change.)
+    """
+    c = _default() if enabled and seasons is not None else None
+    if c is None:
+        return _execute(db, q, params)
+
+    key = _key(db, q, params)
+    stamps = season_stamps(db, seasons)
+    rows = c.get(key, stamps)
+    if rows is None:
+        rows = _execute(db, q, params)
+        c.put(key, rows, stamps)
+    else:
+        profile.hit(len(rows))
+    return rows
+
+
+def season_stamps(db, seasons):
+    """
+    Returns a dictionary mapping each `(season_year, season_type)` pair
+    in `seasons` to the last time a game in that season was updated.
+    Seasons without any games map to `None`.
+
+    The update times of all seasons are fetched from the database with
+    a single query at most once every `nflcmd.cache.stamp_ttl` seconds
+    for each connection.
+    """
+    fetched, stamps = _stamps.get(db, (0, None))
+    if stamps is None or time.time() - fetched > stamp_ttl:
+        q = '''
+            SELECT season_year, season_type, MAX(time_updated) AS updated
+            FROM game
+            GROUP BY season_year, season_type
+        '''
+        stamps = {}
+        for row in _execute(db, q, []):
+            season = (row['season_year'], row['season_type'])
+            stamps[_season_key(season)] = row['updated']
+        _stamps[db] = (time.time(), stamps)
+    return dict((k, stamps.get(k)) for k in map(_season_key, seasons))
+
+
+def clear():
+    """
+    Removes all cached results.
+    """
+    c = _default()
+    if c is not None:
+        c.clear()
+    _stamps.clear()
+
+
+class Cache (object):
+    """
+    A size bounded key-value store with least recently used eviction.
+    Every value is stored along with the season update times that it
+    was computed from.
+    """
+    def __init__(self, fpath, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(fpath, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS entry (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                stamps BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                atime REAL NOT NULL
+            )
+        ''')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS entry_atime ON entry (atime)')
+        self._conn.commit()
+
+    def get(self, key, stamps):
+        """
+        Returns the value for `key` if it exists and was stored with
+        the same season update times as `stamps`. Otherwise, `None` is
+        returned.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, stamps FROM entry WHERE key = ?',
+                (key,)).fetchone()
+            if row is None:
+                return None
+            if _loads(row[1]) != stamps:
+                self._conn.execute('DELETE FROM entry WHERE key = ?', (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute('UPDATE entry SET atime = ? WHERE key = ?',
+                               (time.time(), key))
+            self._conn.commit()
+            return _loads(row[0])
+
+    def put(self, key, value, stamps):
+        """
+        Stores `value` for `key`, evicting the least recently used
+        values if the cache has grown too large. Values that cannot be
+        serialized are silently ignored.
+        """
+        try:
+            blob, sblob = _dumps(value), _dumps(stamps)
+        except (pickle.PicklingError, TypeError):
+            return
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?, ?)',
+                (key, sqlite3.Binary(blob), sqlite3.Binary(sblob),
+                 len(blob), time.time()))
+            self._evict()
+            self._conn.commit()
+
+    def clear(self):
+        """Removes all values."""
+        with self._lock:
+            self._conn.execute('DELETE FROM entry')
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entry').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        lru = self._conn.execute(
+            'SELECT key, size FROM entry ORDER BY atime').fetchall()
+        evict = []
+        for key, size in lru:
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        self._conn.executemany('DELETE FROM entry WHERE key = ?', evict)
+
+
+def _default():
+    """
+    Returns the default `nflcmd.cache.Cache`, opening it if necessary.
+    If the cache cannot be opened, then it is disabled and `None` is
+    returned.
+    """
+    global _cache, enabled
+    with _cache_lock:
+        if _cache is None and enabled:
+            fpath = cache_path()
+            try:
+                if not path.isdir(path.dirname(fpath)):
+                    os.makedirs(path.dirname(fpath))
+                _cache = Cache(fpath, max_bytes)
+            except (OSError, sqlite3.Error):
+                enabled = False
+        return _cache
+
+
+def _execute(db, q, params):
+    with profile.query() as pq:
+        with nfldb.Tx(db) as cursor:
+            cursor.execute(q, params)
+            rows = [dict(row) for row in cursor.fetchall()]
+        pq.rows = len(rows)
+    return rows
+
+
+def _key(db, q, params):
+    """
+    Returns a key for the query `q` with `params` on the database
+    connection `db`. Whitespace in the query is normalized, as is the
+    order of values in sequence parameters (which are only ever used
+    with `IN` or `ANY`).
+    """
+    norm = []
+    for p in params:
+        if isinstance(p, (list, tuple, set, frozenset)):
+            p = tuple(sorted(p))
+        norm.append(p)
+    s = repr((db.dsn, ' '.join(q.split()), norm))
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def _season_key(season):
+    year, stype = season
+    return (int(year), str(stype))
+
+
+def _encode(v):
+    """
+    Makes `v` serializable by replacing nfldb enumeration values with
+    a tagged tuple of the enumeration name and value name.
+    """
+    if isinstance(v, enum.Enum):
+        return ('__enum__', v.__class__.__name__, v.name)
+    if isinstance(v, dict):
+        return dict((k, _encode(x)) for k, x in v.items())
+    if isinstance(v, (list, tuple)):
+        return type(v)(_encode(x) for x in v)
+    return v
+
+
+def _decode(v):
+    """The inverse of `nflcmd.cache._encode`."""
+    if isinstance(v, tuple) and len(v) == 3 and v[0] == '__enum__':
+        return getattr(nfldb.Enums, v[1])[v[2]]
+    if isinstance(v, dict):
+        return dict((k, _decode(x)) for k, x in v.items())
+    if isinstance(v, (list, tuple)):
+        return type(v)(_decode(x) for x in v)
+    return v
+
+
+def _dumps(v):
+    return pickle.dumps(_encode(v), pickle.HIGHEST_PROTOCOL)
+
+
+def _loads(blob):
+    return _decode(pickle.loads(bytes(blob)))
@@ -0,0 +1,69 @@
+"""
+Module nflcmd.cmds.aggregate implements the `nflcmd aggregate` command,
+which creates and refreshes the aggregate tables described in
+`nflcmd.aggtables`. It's meant to be run after `nfldb-update`:
+
+    nfldb-update && nflcmd aggregate
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import time
+
+import nfldb
+
+import nflcmd
+import nflcmd.aggtables
+
+__all__ = ['run']
+
+
+def show_status(db):
+    rows = [['Year', 'Phase', 'Games', 'Refreshed', 'Fresh']]
+    for r in nflcmd.aggtables.status(db):
+        refreshed = '-'
+        if r['refreshed'] is not None:
+            refreshed = r['refreshed'].strftime('%Y-%m-%d %H:%M')
+        rows.append([r['season_year'], r['season_type'], r['games'],
+                     refreshed, 'yes' if r['fresh'] else 'no'])
+    nflcmd.write_table(rows)
+
+
+def run(argv=None, db=None):
+    """
+    Runs the `nflcmd aggregate` command with the arguments in `argv`,
+    which defaults to `sys.argv[1:]`. If `db` is `None`, then a new
+    connection is opened with `nfldb.connect`.
+    """
+    parser = argparse.ArgumentParser(
+        prog='nflcmd aggregate',
+        description='Create and refresh the aggregate tables used to '
+                    'speed up nflstats and nflrank.')
+    aa = parser.add_argument
+    aa('--full', action='store_true',
+       help='Rebuild every season instead of only the games updated\n'
+            'since the last refresh.')
+    aa('--status', action='store_true',
+       help='Show whether each season is fresh instead of refreshing.')
+    aa('--drop', action='store_true',
+       help='Drop the aggregate tables.')
+    args = parser.parse_args(argv)
+
+    if db is None:
+        db = nfldb.connect()
+    if args.drop:
+        nflcmd.aggtables.drop(db)
+        print('Dropped the aggregate tables.')
+        return
+    if args.status:
+        if not nflcmd.aggtables.exists(db):
+            print('The aggregate tables have not been created (or were '
+                  'created by an older version of nflcmd). '
+                  'Run "nflcmd aggregate".')
+            return
+        show_status(db)
+        return
+
+    start = time.time()
+    games, seasons = nflcmd.aggtables.refresh(db, full=args.full)
+    print('Refreshed %d games in %d seasons in %0.2f seconds.'
+          % (games, seasons, time.time() - start))
@@ -1,11 +1,16 @@
 from __future__ import absolute_import, division, print_function
 import argparse
-from functools import partial
 import sys
+import time
 
 import nfldb
 
 import nflcmd
+import nflcmd.live
+import nflcmd.matrix
+import nflcmd.rolling
+import nflcmd.scoring
+import nflcmd.snapshot
 
 
 __all__ = ['run']
@@ -16,19 +21,147 @@ def eprint(*args, **kwargs):
     print(*args, **kwargs)
 
 
-def run():
-    """Runs the `nflrank` command."""
-    db = nfldb.connect()
-    _, cur_year, _ = nfldb.current(db)
+def rank_query(db, cats, years, stype, weeks, pos, teams, limit):
+    """
+    Returns aggregate statistics for the top `limit` players sorted by
+    the statistical categories in `cats`. The aggregation and sorting
+    is done by the database, using the aggregate tables maintained by
+    `nflcmd aggregate` when they're fresh (see `nflcmd.aggtables`).
+    """
+    aggs = nflcmd.aggtables.rank(db, cats, years, stype, weeks, pos, teams,
+                                 limit)
+    if aggs is not None:
+        return aggs
 
+    catq = nfldb.QueryOR(db)
+    for cat in cats:
+        k = cat + '__ne'
+        catq.play_player(**{k: 0})
+
+    q = nfldb.Query(db)
+    q.game(season_year=years, season_type=stype, week=weeks)
+    q.andalso(catq)
+    if len(pos) > 0:
+        posq = nfldb.QueryOR(db)
+        for p in pos:
+            posq.player(position=nfldb.Enums.player_pos[p])
+        q.andalso(posq)
+    if len(teams) > 0:
+        q.player(team=teams)
+    q.sort([(cat, 'desc') for cat in cats])
+    q.limit(limit)
+    with nflcmd.profile.query() as pq:
+        aggs = q.as_aggregate()
+        pq.rows = len(aggs)
+    return aggs
+
+
+def rank_matrix(db, cats, years, stype, weeks, pos, teams, limit, mins):
+    """
+    Returns aggregate statistics for the top `limit` players sorted by
+    the columns in `cats`, which may include derived statistics in
+    `nflcmd.statfuns`. Only players with at least the values in the
+    dictionary `mins` are ranked.
+
+    The statistics of every player are loaded into a
+    `nflcmd.matrix.StatMatrix` with one query and ranked in memory.
+    """
+    load = set()
+    for name in list(cats) + list(mins):
+        load.update(nflcmd.matrix.columns(name))
+    m = nflcmd.matrix.StatMatrix.load(db, load, years, stype, weeks,
+                                      pos=pos, teams=teams)
+
+    # Like the database ranking, ignore players without any of the
+    # statistics being ranked.
+    mask = m.qualified(mins)
+    nonzero = nflcmd.matrix.np.zeros(len(m), dtype=bool)
+    for cat in cats:
+        nonzero |= m.column(cat) != 0
+    return [m.pstat(db, i) for i in m.top(cats, limit, mask & nonzero)]
+
+
+def rank_score(db, formula, cats, years, stype, weeks, pos, teams, limit):
+    """
+    Returns the `nflcmd.scoring.PlayerScore` objects of the top `limit`
+    players sorted by their points according to the
+    `nflcmd.scoring.Formula` given. The totals of the columns in
+    `cats` (which may include derived statistics) are loaded along
+    with the points, so that no other query is needed to show them.
+    """
+    load = set()
+    for name in cats:
+        load.update(nflcmd.matrix.columns(name))
+    scores = nflcmd.scoring.scores(db, formula, years, stype, weeks,
+                                   pos=pos, teams=teams, cats=load)
+    return nflcmd.scoring.top(scores, limit)
+
+
+def watch(db, args, years, stype, weeks, syrs, spec):
+    """
+    Shows the rankings for `args` and then checks for updated games
+    every `args.watch` seconds, re-ranking players incrementally with
+    a `nflcmd.live.LiveRanking`. The rankings are only written again
+    when they change. This runs until interrupted.
+    """
+    clear = args.format == 'table' and sys.stdout.isatty()
+    live = nflcmd.live.LiveRanking(db, args.categories, years, stype, weeks,
+                                   args.pos, args.teams)
+    shown = None
+    try:
+        while True:
+            with nflcmd.profile.phase('rank'):
+                live.update()
+                top = live.top(args.limit)
+            if top != shown:
+                shown = top
+                with nflcmd.profile.phase('load'):
+                    aggs = [live.pstat(pid) for pid, _ in top]
+                    pstats = nflcmd.player_totals(db, aggs, syrs, years,
+                                                  stype, weeks)
+                with nflcmd.profile.phase('format'):
+                    if clear:
+                        sys.stdout.write('\x1b[H\x1b[2J')
+                        print('Updated at %s' % time.strftime('%H:%M:%S'))
+                    nflcmd.write_pstats(args.format, spec, pstats)
+                    sys.stdout.flush()
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        pass
+
+
+def parse_mins(mins):
+    """
+    Parses a list of qualifiers of the form `CATEGORY=N` into a
+    dictionary mapping categories to numbers. If a qualifier is
+    malformed, `None` is returned.
+    """
+    parsed = {}
+    for qual in mins:
+        cat, _, n = qual.partition('=')
+        try:
+            parsed[cat.strip()] = float(n)
+        except ValueError:
+            return None
+    return parsed
+
+
+def run(argv=None, db=None):
+    """
+    Runs the `nflrank` command with the arguments in `argv`, which
+    defaults to `sys.argv[1:]`. If `db` is `None`, then a new
+    connection is opened with `nfldb.connect` (unless `--snapshot` is
+    used).
+    """
     parser = argparse.ArgumentParser(
+        prog='nflrank',
         description='Show NFL player rankings for statistical categories.')
     aa = parser.add_argument
-    aa(dest='categories', metavar='CATEGORY', nargs='+')
-    aa('--years', type=str, default=str(cur_year),
+    aa(dest='categories', metavar='CATEGORY', nargs='*')
+    aa('--years', type=str, default=None,
        help='Show rankings only for the inclusive range of years given,\n'
             'e.g., "2010-2011". Other valid examples: "2010", "-2010",\n'
-            '"2010-".')
+            '"2010-". Defaults to the current season.')
     aa('--weeks', type=str, default='',
        help='Show rankings only for the inclusive range of weeks given,\n'
             'e.g., "4-8". Other valid examples: "4", "-8",\n'
@@ -43,12 +176,116 @@ def run():
        help='When set, only show players currently on the given teams.')
     aa('--limit', type=int, default=10,
        help='Restrict the number of results shown.')
-    args = parser.parse_args()
+    aa('--min', type=str, default=[], nargs='+', metavar='CATEGORY=N',
+       help='Only rank players with at least N in CATEGORY, e.g.,\n'
+            '"passing_att=200". Requires NumPy.')
+    aa('--format', type=str, default='table', choices=nflcmd.formats,
+       help='The output format. Every format except "table" is written\n'
+            'one row at a time and suitable for use by other programs.')
+    aa('--matrix', action='store_true',
+       help='When set, statistics are ranked in memory instead of by the\n'
+            'database. This is implied when ranking a derived statistic\n'
+            '(like passing_yds_att) or when --min is used. Requires NumPy.')
+    aa('--score', type=nflcmd.path_arg, default=None, metavar='FILE',
+       help='Rank players by the fantasy points computed from the\n'
+            'scoring formula in FILE. Each line of FILE is either\n'
+            '"CATEGORY POINTS" or a per-game bonus like\n'
+            '"passing_yds >= 300 POINTS". Any categories given are\n'
+            'shown after the points.')
+    aa('--weekly', action='store_true',
+       help='When set with --score, show the points of each week too.\n'
+            'Only one season may be given.')
+    aa('--rolling', type=int, default=None, metavar='N',
+       help='Rank players by their best stretch of N consecutive weeks\n'
+            'instead of by their totals. The weeks of each stretch are\n'
+            'shown with its totals.')
+    aa('--watch', type=float, default=None, metavar='SECONDS',
+       help='Keep running and check for updated games every SECONDS\n'
+            'seconds, re-ranking only the players in those games. The\n'
+            'rankings are shown again whenever they change.')
+    aa('--snapshot', type=nflcmd.path_arg, default=None, metavar='FILE',
+       help='Read statistics from a snapshot written by\n'
+            '"nflcmd snapshot" instead of from the database. Requires\n'
+            'NumPy.')
+    aa('--jobs', type=int, default=4,
+       help='The number of independent queries to run at once, each\n'
+            'with its own database connection.')
+    aa('--profile', action='store_true',
+       help='When set, a breakdown of the time spent in each phase and\n'
+            'of the queries issued is written to stderr.')
+    aa('--profile-json', type=nflcmd.path_arg, default=None, metavar='FILE',
+       help='Write the profile, including every query issued, to FILE\n'
+            'as JSON.')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
 
-    for cat in args.categories:
-        if cat not in nfldb.stat_categories:
-            eprint("%s is not a valid statistical category.", cat)
+    if len(args.categories) == 0 and args.score is None:
+        parser.error('at least one CATEGORY is required without --score')
+    if args.weekly and args.score is None:
+        parser.error('--weekly requires --score')
+
+    mins = parse_mins(args.min)
+    if mins is None:
+        eprint("Qualifiers must have the form CATEGORY=N.")
+        sys.exit(1)
+    derived = [c for c in args.categories + list(mins)
+               if c not in nfldb.stat_categories]
+    for cat in derived:
+        if not nflcmd.matrix.is_column(cat):
+            eprint("%s is not a valid statistical category." % cat)
+            sys.exit(1)
+    if args.rolling is not None and args.rolling < 1:
+        parser.error('--rolling must be at least 1')
+    if args.rolling is not None:
+        if args.matrix or len(mins) > 0 or args.watch is not None \
+                or args.score is not None:
+            eprint("--rolling cannot be used with --min, --matrix, --watch\n"
+                   "or --score.")
+            sys.exit(1)
+    formula = None
+    if args.score is not None:
+        if args.matrix or len(mins) > 0 or args.watch is not None:
+            eprint("--score cannot be used with --min, --matrix or --watch.")
             sys.exit(1)
+        try:
+            formula = nflcmd.scoring.load(args.score)
+        except (IOError, ValueError) as e:
+            eprint(e)
+            sys.exit(1)
+    use_matrix = (formula is None and args.rolling is None
+                  and (args.matrix or len(mins) > 0 or len(derived) > 0))
+    if use_matrix and not nflcmd.matrix.available:
+        eprint("NumPy is required to rank derived statistics or to use\n"
+               "--min and --matrix.")
+        sys.exit(1)
+    if args.watch is not None and use_matrix:
+        eprint("--watch cannot be used with derived statistics, --min or\n"
+               "--matrix.")
+        sys.exit(1)
+    if args.watch is not None and args.watch <= 0:
+        parser.error('--watch must be a positive number of seconds')
+
+    snap = None
+    if args.snapshot is not None:
+        if args.watch is not None or args.rolling is not None \
+                or formula is not None:
+            eprint("--snapshot cannot be used with --watch, --rolling or\n"
+                   "--score.")
+            sys.exit(1)
+        if not nflcmd.snapshot.available:
+            eprint("NumPy is required to use --snapshot.")
+            sys.exit(1)
+        try:
+            snap = nflcmd.snapshot.Snapshot(args.snapshot)
+        except (IOError, OSError, nflcmd.snapshot.SnapshotError) as e:
+            eprint(e)
+            sys.exit(1)
+        _, cur_year, _ = snap.current()
+    else:
+        if db is None:
+            db = nfldb.connect()
+        _, cur_year, _ = nflcmd.current(db)
 
     stype = 'Regular'
     if args.pre:
@@ -56,34 +293,65 @@ def run():
     if args.post:
         stype = 'Postseason'
 
+    if args.years is None:
+        args.years = str(cur_year)
     years = nflcmd.arg_range(args.years, 2009, cur_year)
     weeks = nflcmd.arg_range(args.weeks, 1, 17)
-
-    def to_games(agg):
-        syrs = years[0] if len(years) == 1 else '%d-%d' % (years[0], years[-1])
-        qgames = nflcmd.query_games(db, agg.player, years, stype, weeks)
-        return nflcmd.Games(db, syrs, qgames.as_games(), agg)
-
-    catq = nfldb.QueryOR(db)
-    for cat in args.categories:
-        k = cat + '__ne'
-        catq.play_player(**{k: 0})
-
-    q = nfldb.Query(db)
-    q.game(season_year=years, season_type=stype, week=weeks)
-    q.andalso(catq)
-    if len(args.pos) > 0:
-        posq = nfldb.QueryOR(db)
-        for pos in args.pos:
-            posq.player(position=nfldb.Enums.player_pos[pos])
-        q.andalso(posq)
-    if len(args.teams) > 0:
-        q.player(team=args.teams)
-    q.sort([(cat, 'desc') for cat in args.categories])
-    q.limit(args.limit)
-    pstats = map(to_games, q.as_aggregate())
-
+    syrs = years[0] if len(years) == 1 else '%d-%d' % (years[0], years[-1])
+    if args.weekly and len(years) != 1:
+        parser.error('--weekly can only be used with a single season')
     spec = ['name', 'team', 'game_count'] + args.categories
-    rows = [nflcmd.header_row(spec)]
-    rows += map(partial(nflcmd.pstat_to_row, spec), pstats)
-    print(nflcmd.table(rows))
+    if formula is not None:
+        spec = ['name', 'team', 'game_count', 'score']
+        if args.weekly:
+            spec += ['w%d' % w for w in weeks]
+        spec += args.categories
+    if args.rolling is not None:
+        spec = ['name', 'team', 'window', 'game_count'] + args.categories
+
+    with nflcmd.profile.command(args.profile, args.profile_json), \
+            nflcmd.executor.command(args.jobs):
+        if args.watch is not None:
+            watch(db, args, years, stype, weeks, syrs, spec)
+            return
+        if snap is not None:
+            with nflcmd.profile.phase('rank'):
+                pstats = nflcmd.snapshot.rank(snap, args.categories, years,
+                                              stype, weeks, args.pos,
+                                              args.teams, args.limit, mins,
+                                              syrs)
+            with nflcmd.profile.phase('format'):
+                nflcmd.write_pstats(args.format, spec, pstats)
+            return
+        if args.rolling is not None:
+            with nflcmd.profile.phase('rank'):
+                rows = nflcmd.rolling.best(db, args.categories, args.rolling,
+                                           years, stype, weeks, args.pos,
+                                           args.teams, args.limit)
+            with nflcmd.profile.phase('format'):
+                nflcmd.write_pstats(args.format, spec, rows)
+            return
+        if formula is not None:
+            with nflcmd.profile.phase('rank'):
+                top = rank_score(db, formula, args.categories, years, stype,
+                                 weeks, args.pos, args.teams, args.limit)
+            with nflcmd.profile.phase('load'):
+                pstats = nflcmd.player_totals(db, [ps.pstat(db) for ps in top],
+                                              syrs, years, stype, weeks)
+                pstats = [nflcmd.scoring.Scored(row, ps)
+                          for row, ps in zip(pstats, top)]
+            with nflcmd.profile.phase('format'):
+                nflcmd.write_pstats(args.format, spec, pstats)
+            return
+        with nflcmd.profile.phase('rank'):
+            if use_matrix:
+                aggs = rank_matrix(db, args.categories, years, stype, weeks,
+                                   args.pos, args.teams, args.limit, mins)
+            else:
+                aggs = rank_query(db, args.categories, years, stype, weeks,
+                                  args.pos, args.teams, args.limit)
+        with nflcmd.profile.phase('load'):
+            pstats = nflcmd.player_totals(db, aggs, syrs, years, stype,
+                                          weeks)
+        with nflcmd.profile.phase('format'):
+            nflcmd.write_pstats(args.format, spec, pstats)
@@ -0,0 +1,254 @@
+"""
+Module nflcmd.cmds.serve implements the `nflcmd serve` daemon. The
+daemon listens on a Unix socket and runs `nflstats`, `nflrank` and
+`nflteam` for each client that connects, using a pool of warm database
+connections and the in-memory caches of a long running process. This
+removes the cost of starting Python, importing nfldb and connecting
+to the database from every invocation.
+
+The protocol is simple. A client sends a single line of JSON:
+
+    {"command": "stats", "argv": ["tom", "brady", "--season"],
+     "cwd": "/home/andrew"}
+
+Relative file paths in `argv` are resolved against `cwd`, the working
+directory of the client. Commands can't read standard input, so
+clients should run commands that use `-` for standard input
+themselves.
+
+The daemon responds with a sequence of frames, where each frame is a
+one byte channel followed by a four byte big-endian length and then
+that many bytes of data. The `o` and `e` channels are standard output
+and standard error of the command. The last frame is on the `x`
+channel, and its data is the exit status of the command in ASCII.
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import json
+import os
+import os.path as path
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+import nflcmd.cmds.rank
+import nflcmd.cmds.stats
+import nflcmd.cmds.team
+import nflcmd.executor
+from nflcmd.pool import ConnectionPool
+
+__all__ = ['run']
+
+commands = {
+    'stats': nflcmd.cmds.stats.run,
+    'rank': nflcmd.cmds.rank.run,
+    'team': nflcmd.cmds.team.run,
+}
+"""
+The commands that the daemon can run, keyed by the name a client uses.
+"""
+
+
+def socket_path():
+    """
+    Returns the default path of the daemon's Unix socket. It is the
+    value of `NFLCMD_SOCKET` if it's set, or `nflcmd.sock` in
+    `$XDG_RUNTIME_DIR`, or a file in `/tmp` specific to the current
+    user otherwise.
+
+    N.B. The `nflcmd` script has its own copy of this logic so that it
+    doesn't need to import nfldb.
+    """
+    if os.getenv('NFLCMD_SOCKET'):
+        return os.getenv('NFLCMD_SOCKET')
+    if os.getenv('XDG_RUNTIME_DIR'):
+        return path.join(os.getenv('XDG_RUNTIME_DIR'), 'nflcmd.sock')
+    return '/tmp/nflcmd-%d.sock' % os.getuid()
+
+
+class _ThreadStream (object):
+    """
+    A stand in for `sys.stdout` or `sys.stderr` that sends writes to a
+    stream specific to the current thread, if one is set. Otherwise,
+    writes go to the original stream.
+    """
+    def __init__(self, orig):
+        self._orig = orig
+        self._local = threading.local()
+
+    def redirect(self, stream):
+        self._local.stream = stream
+
+    def _stream(self):
+        return getattr(self._local, 'stream', None) or self._orig
+
+    def write(self, s):
+        self._stream().write(s)
+
+    def flush(self):
+        self._stream().flush()
+
+    def __getattr__(self, k):
+        return getattr(self._stream(), k)
+
+
+class _Output (object):
+    """
+    A file-like object that writes each string it's given as a frame
+    on `channel` to the socket file `wfile`.
+    """
+    def __init__(self, wfile, channel):
+        self._wfile = wfile
+        self._channel = channel
+
+    def write(self, s):
+        if not isinstance(s, bytes):
+            s = s.encode('utf-8')
+        if len(s) > 0:
+            send_frame(self._wfile, self._channel, s)
+
+    def flush(self):
+        self._wfile.flush()
+
+    def isatty(self):
+        return False
+
+
+def send_frame(wfile, channel, data):
+    """
+    Writes `data` to `wfile` as a single frame on `channel`.
+    """
+    wfile.write(struct.pack('!cI', channel, len(data)))
+    wfile.write(data)
+
+
+class Handler (socketserver.StreamRequestHandler):
+    def handle(self):
+        out, err = _Output(self.wfile, b'o'), _Output(self.wfile, b'e')
+        sys.stdout.redirect(out)
+        sys.stderr.redirect(err)
+        try:
+            status = self.run_command(err)
+            send_frame(self.wfile, b'x', str(status).encode('ascii'))
+            self.wfile.flush()
+        except socket.error:
+            pass  # The client went away.
+        finally:
+            sys.stdout.redirect(None)
+            sys.stderr.redirect(None)
+
+    def run_command(self, err):
+        """
+        Reads a request from the client and runs it. The exit status
+        of the command is returned.
+        """
+        try:
+            req = json.loads(self.rfile.readline().decode('utf-8'))
+            cmd, argv = commands[req['command']], list(req['argv'])
+            cwd = req['cwd']
+            if not path.isabs(cwd):
+                raise ValueError(cwd)
+        except (ValueError, KeyError, TypeError):
+            err.write('Invalid request.\n')
+            return 2
+
+        try:
+            with self.server.pool.connection() as db, \
+                    nflcmd.executor.use(self.server.executor), \
+                    nflcmd.working_directory(cwd):
+                cmd(argv, db)
+        except SystemExit as e:
+            if e.code is None:
+                return 0
+            if not isinstance(e.code, int):
+                err.write('%s\n' % e.code)
+                return 1
+            return e.code
+        except socket.error:
+            raise
+        except Exception:
+            err.write(traceback.format_exc())
+            return 1
+        return 0
+
+
+class Server (socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, spath, pool, executor):
+        self.pool = pool
+        self.executor = executor
+        socketserver.UnixStreamServer.__init__(self, spath, Handler)
+
+
+def listening(spath):
+    """
+    Returns `True` if and only if a daemon is accepting connections
+    on the socket at `spath`.
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(spath)
+        return True
+    except socket.error:
+        return False
+    finally:
+        s.close()
+
+
+def run(argv=None):
+    """Runs the `nflcmd serve` command."""
+    parser = argparse.ArgumentParser(
+        prog='nflcmd serve',
+        description='Run nflstats, nflrank and nflteam for clients on a '
+                    'Unix socket.')
+    aa = parser.add_argument
+    aa('--socket', type=str, default=socket_path(),
+       help='The path of the Unix socket to listen on.')
+    aa('--connections', type=int, default=4,
+       help='The maximum number of database connections to open, which\n'
+            'is also the number of commands that can run concurrently.')
+    aa('--jobs', type=int, default=1,
+       help='The number of independent queries of a command to run at\n'
+            'once. Every command shares the same jobs - 1 connections\n'
+            'in addition to those given by --connections.')
+    args = parser.parse_args(argv)
+
+    if args.connections < 1:
+        parser.error('--connections must be at least 1')
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if path.exists(args.socket):
+        if listening(args.socket):
+            print('A daemon is already listening on %s' % args.socket,
+                  file=sys.stderr)
+            sys.exit(1)
+        os.remove(args.socket)
+
+    pool = ConnectionPool(args.connections)
+    executor = nflcmd.executor.Executor(args.jobs)
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(args.socket, pool, executor)
+    finally:
+        os.umask(old_umask)
+
+    sys.stdout = _ThreadStream(sys.stdout)
+    sys.stderr = _ThreadStream(sys.stderr)
+    print('Listening on %s' % args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        executor.close()
+        pool.close()
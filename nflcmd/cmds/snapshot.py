@@ -0,0 +1,55 @@
+"""
+Module nflcmd.cmds.snapshot implements the `nflcmd snapshot` command,
+which writes a snapshot of nfldb (see `nflcmd.snapshot`) that
+`nflstats` and `nflrank` can use instead of a database:
+
+    nflcmd snapshot nfl.snap --years 2012-
+    nflrank passing_tds --snapshot nfl.snap
+"""
+from __future__ import absolute_import, division, print_function
+import argparse
+import os
+import sys
+import time
+
+import nfldb
+
+import nflcmd
+import nflcmd.snapshot
+
+__all__ = ['run']
+
+
+def run(argv=None, db=None):
+    """
+    Runs the `nflcmd snapshot` command with the arguments in `argv`,
+    which defaults to `sys.argv[1:]`. If `db` is `None`, then a new
+    connection is opened with `nfldb.connect`.
+    """
+    parser = argparse.ArgumentParser(
+        prog='nflcmd snapshot',
+        description='Write a snapshot of nfldb that nflstats and nflrank '
+                    'can use without a database.')
+    aa = parser.add_argument
+    aa(dest='path', metavar='FILE')
+    aa('--years', type=str, default='',
+       help='Only include the inclusive range of years given, e.g.,\n'
+            '"2010-2011". By default, every season is included.')
+    args = parser.parse_args(argv)
+
+    if not nflcmd.snapshot.available:
+        print('NumPy is required to write snapshots.', file=sys.stderr)
+        sys.exit(1)
+    if db is None:
+        db = nfldb.connect()
+    _, cur_year, _ = nflcmd.current(db)
+    years = nflcmd.arg_range(args.years, 2009, cur_year)
+
+    start = time.time()
+    counts = nflcmd.snapshot.export(db, args.path, years)
+    rows = sum(n for k, n in counts.items() if k != 'players')
+    print('Wrote %d players and %d player games in %d seasons to %s '
+          '(%0.1f MB) in %0.2f seconds.'
+          % (counts['players'], rows, len(counts) - 1, args.path,
+             os.path.getsize(args.path) / (1024 * 1024),
+             time.time() - start))
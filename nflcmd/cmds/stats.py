@@ -1,11 +1,19 @@
 from __future__ import absolute_import, division, print_function
 import argparse
-from functools import partial
+from multiprocessing.pool import ThreadPool
+import os
+import os.path as path
+import re
+import shlex
 import sys
 
 import nfldb
 
 import nflcmd
+import nflcmd.league
+import nflcmd.rolling
+import nflcmd.snapshot
+from nflcmd.pool import ConnectionPool
 
 
 __all__ = ['run']
@@ -14,71 +22,432 @@ prefix_game = ['week', 'outcome', 'game_date', 'opp']
 
 prefix_season = ['year', 'teams', 'game_count']
 
+prefix_split = ['split', 'teams', 'game_count']
+
+splits = ['home', 'away', 'outcome', 'opp', 'month']
+"""
+The splits that may be given to `--splits`.
+"""
+
 
 def eprint(*args, **kwargs):
     kwargs['file'] = sys.stderr
     print(*args, **kwargs)
 
 
-def show_game_table(db, player, year, stype, week_range=None, pos=None):
+def show_game_table(db, player, year, stype, week_range=None, pos=None,
+                    fmt='table', rolling=None, average=False, snap=None,
+                    percentiles=None):
     if pos is None:
         pos = player.position
 
-    games = nflcmd.query_games(db, player, year, stype, week_range).as_games()
-    pstats = map(partial(nflcmd.Game.make, db, player), games)
+    league = None
+    with nflcmd.profile.phase('load'):
+        if snap is not None:
+            pstats = nflcmd.snapshot.game_log(snap, player, year, stype,
+                                              week_range)
+        else:
+            pstats = nflcmd.game_log(db, player, year, stype, week_range)
+        if rolling is not None:
+            pstats = nflcmd.rolling.game_windows(db, pstats, rolling, average)
+        if percentiles is not None:
+            kind = nflcmd.pcolumns[pos]
+            cols = percentile_columns(nflcmd.columns['game'][kind],
+                                      percentiles, 'game')
+            league = nflcmd.league.load(db, 'game', kind, cols, [year],
+                                        stype, week_range)
+    with nflcmd.profile.phase('format'):
+        write_game_table(db, pstats, pos, fmt, summary=rolling is None,
+                         league=league)
+
 
+def write_game_table(db, pstats, pos, fmt, out=None, extra=None,
+                     summary=True, league=None):
     spec = prefix_game + nflcmd.columns['game'][nflcmd.pcolumns[pos]]
-    rows = [nflcmd.header_row(spec)]
-    rows += map(partial(nflcmd.pstat_to_row, spec), pstats)
-    if len(pstats) > 1:
-        summary = nfldb.aggregate(pstat._pstat for pstat in pstats)[0]
-        allrows = nflcmd.Game(db, None, '-', summary)
-        allrows._fgs = []
-        for pstat in pstats:
-            allrows._fgs += pstat.fgs
-        rows.append(nflcmd.pstat_to_row(spec, allrows))
-    print(nflcmd.table(rows))
-
-
-def show_season_table(db, player, stype, week_range=None, pos=None):
+    if summary:
+        pstats = nflcmd.Accumulator().fold(pstats, lambda acc: acc.game(db))
+    if league is not None:
+        spec = league.spec(spec)
+        pstats = league.rows(pstats)
+    nflcmd.write_pstats(fmt, spec, pstats, out, extra)
+
+
+def show_season_table(db, player, stype, week_range=None, pos=None,
+                      fmt='table', snap=None, percentiles=None):
     if pos is None:
         pos = player.position
-    _, cur_year, _ = nfldb.current(db)
+    if snap is not None:
+        _, cur_year, _ = snap.current()
+    else:
+        _, cur_year, _ = nflcmd.current(db)
 
-    pstats = []
-    for year in range(2009, cur_year+1):
-        qgames = nflcmd.query_games(db, player, year, stype, week_range)
-        games = qgames.as_games()
-        if len(games) == 0:
-            continue
+    years = range(2009, cur_year+1)
+    league = None
+    with nflcmd.profile.phase('load'):
+        if snap is not None:
+            pstats = nflcmd.snapshot.season_log(snap, player, years, stype,
+                                                week_range)
+        else:
+            pstats = nflcmd.season_log(db, player, years, stype, week_range)
+        if percentiles is not None and len(pstats) > 0:
+            kind = nflcmd.pcolumns[pos]
+            cols = percentile_columns(nflcmd.columns['season'][kind],
+                                      percentiles, 'season')
+            league = nflcmd.league.load(db, 'season', kind, cols,
+                                        [row.year for row in pstats], stype,
+                                        week_range)
+    with nflcmd.profile.phase('format'):
+        write_season_table(db, pstats, pos, fmt, league=league)
 
-        game_stats = map(partial(nflcmd.Game.make, db, player), games)
-        agg = qgames.sort([]).as_aggregate()
-        pstats.append(nflcmd.Games(db, year, game_stats, agg[0]))
 
+def write_season_table(db, pstats, pos, fmt, out=None, extra=None,
+                       league=None):
     spec = prefix_season + nflcmd.columns['season'][nflcmd.pcolumns[pos]]
-    rows = [nflcmd.header_row(spec)]
-    rows += map(partial(nflcmd.pstat_to_row, spec), pstats)
-    if len(pstats) > 1:
-        summary = nfldb.aggregate(pstat._pstat for pstat in pstats)[0]
-        allrows = nflcmd.Games(db, '-', [], summary)
-        allrows._fgs = []
-        for pstat in pstats:
-            allrows._fgs += pstat.fgs
-            allrows.games += pstat.games
-        rows.append(nflcmd.pstat_to_row(spec, allrows))
-    print(nflcmd.table(rows))
-
-
-def run():
-    """Runs the `nflstats` command."""
-    db = nfldb.connect()
-    _, cur_year, _ = nfldb.current(db)
+    pstats = nflcmd.Accumulator().fold(pstats, lambda acc: acc.summary(db))
+    if league is not None:
+        spec = league.spec(spec)
+        pstats = league.rows(pstats)
+    nflcmd.write_pstats(fmt, spec, pstats, out, extra)
+
+
+def percentile_columns(spec, names, grain):
+    """
+    Returns the columns to show percentiles for, given the columns of
+    a table in `spec` and the columns given to `--percentiles` in
+    `names`. The name `all` stands for every column in `spec` that has
+    a distribution in `nflcmd.league`.
+    """
+    cols = []
+    for name in names:
+        if name == 'all':
+            cols += [c for c in spec if nflcmd.league.is_column(c, grain)]
+        else:
+            cols.append(name)
+    return [c for i, c in enumerate(cols) if c not in cols[:i]]
+
+
+def show_splits_table(db, player, year, stype, week_range=None, pos=None,
+                      fmt='table', kinds=None, snap=None):
+    if pos is None:
+        pos = player.position
+
+    with nflcmd.profile.phase('load'):
+        if snap is not None:
+            pstats = nflcmd.snapshot.game_log(snap, player, year, stype,
+                                              week_range)
+        else:
+            pstats = nflcmd.game_log(db, player, year, stype, week_range)
+    with nflcmd.profile.phase('format'):
+        spec = prefix_split + nflcmd.columns['season'][nflcmd.pcolumns[pos]]
+        nflcmd.write_pstats(fmt, spec, split_rows(db, pstats, kinds or []))
+
+
+class Split (nflcmd.Summary):
+    """
+    A row with the totals of a subset of a player's games, named by
+    its `split` column.
+    """
+    __slots__ = ['split']
+
+
+def split_row(db, label, acc):
+    """
+    Returns a `Split` row labeled `label` with the totals in the
+    `nflcmd.Accumulator` `acc`.
+    """
+    row = Split(db, None, acc)
+    row.split = label
+    return row
+
+
+def split_key(kind, p):
+    """
+    Returns the key of the group of the split `kind` (one of `splits`)
+    that the `nflcmd.Game` row `p` belongs to, or `None` if it doesn't
+    belong to any. Keys sort in the order that groups are shown, and
+    the last element of each key is the label of its group.
+    """
+    if kind == 'home':
+        return ('Home',) if p.team == p.home_team else None
+    elif kind == 'away':
+        return ('Away',) if p.team == p.away_team else None
+    elif kind == 'outcome':
+        return (0, 'Won') if p.outcome == 'W' else (1, 'Lost')
+    elif kind == 'opp':
+        return ('vs ' + p.opp.lstrip('@'),)
+    elif kind == 'month':
+        return (p.start_time.year, p.start_time.month,
+                '{d:%b}'.format(d=p.start_time))
+
+
+def split_rows(db, pstats, kinds):
+    """
+    Returns a list of `Split` rows for every split in `kinds` (each
+    one of `splits`) of the game log `pstats`, followed by a row with
+    the totals of every game. Every split is grouped from the same
+    game log in a single pass, so no split requires another query.
+    """
+    if len(pstats) == 0:
+        return []
+    total = nflcmd.Accumulator()
+    groups = dict((kind, {}) for kind in kinds)
+    for p in pstats:
+        total.add(p)
+        for kind in kinds:
+            key = split_key(kind, p)
+            if key is not None:
+                groups[kind].setdefault(key, nflcmd.Accumulator()).add(p)
+    rows = []
+    for kind in kinds:
+        rows += [split_row(db, key[-1], acc)
+                 for key, acc in sorted(groups[kind].items())]
+    rows.append(split_row(db, 'All', total))
+    return rows
+
+
+class Named (object):
+    """
+    A row of a game or season log labeled with the name of its player,
+    which is available in the `name` column. Every other column is
+    read from the row.
+    """
+    __slots__ = ['_row', 'name']
+
+    def __init__(self, row, name):
+        self._row = row
+        self.name = name
+
+    def __getattr__(self, k):
+        return getattr(self._row, k)
+
+
+def compare(db, args, stype, week_range, snap=None):
+    """
+    Shows the game or season logs of every player query in
+    `args.player_query` in a single table, one player after the other,
+    with the columns of the position shared by most of the players
+    (or `args.show_as`). The logs of all players are loaded with the
+    same batched queries. Returns `False` if any query could not be
+    matched.
+    """
+    idx = snap.names() if snap is not None else None
+    players, positions = [], []
+    with nflcmd.profile.phase('search'):
+        for query in args.player_query:
+            player = nflcmd.search(db, query, args.team, args.pos,
+                                   args.soundex, idx=idx)
+            if player is None:
+                eprint('Could not find a player for: %s' % query)
+                return False
+            if player.player_id in set(p.player_id for p in players):
+                continue
+            unknown = (args.show_as is None
+                       and player.position == nfldb.Enums.player_pos.UNK)
+            if snap is not None and unknown:
+                pos = nfldb.Enums.player_pos.UNK
+            else:
+                pos = nflcmd.player_position(db, player, args.show_as)
+            if pos == nfldb.Enums.player_pos.UNK:
+                eprint("Could not guess the position of %s. Specify it\n"
+                       "with the '--show-as' flag." % player)
+                return False
+            players.append(player)
+            positions.append(nflcmd.pcolumns[pos])
+
+    # The most common kind of columns, preferring earlier players.
+    kind = max(positions, key=lambda k: (positions.count(k),
+                                         -positions.index(k)))
+    with nflcmd.profile.phase('load'):
+        if args.season:
+            if snap is not None:
+                _, cur_year, _ = snap.current()
+            else:
+                _, cur_year, _ = nflcmd.current(db)
+            years = range(2009, cur_year+1)
+            if snap is not None:
+                logs = dict((p.player_id, nflcmd.snapshot.season_log(
+                    snap, p, years, stype, week_range)) for p in players)
+            else:
+                logs = nflcmd.season_logs(db, players, years, stype,
+                                          week_range)
+            spec = prefix_season + nflcmd.columns['season'][kind]
+        else:
+            if snap is not None:
+                logs = dict((p.player_id, nflcmd.snapshot.game_log(
+                    snap, p, args.year, stype, week_range)) for p in players)
+            else:
+                logs = nflcmd.game_logs(db, players, args.year, stype,
+                                        week_range)
+            spec = prefix_game + nflcmd.columns['game'][kind]
+            if args.rolling is not None:
+                for pid, rows in logs.items():
+                    logs[pid] = nflcmd.rolling.game_windows(
+                        db, rows, args.rolling, args.average)
+
+    with nflcmd.profile.phase('format'):
+        rows = []
+        for player in players:
+            pstats = logs[player.player_id]
+            if args.season:
+                pstats = nflcmd.Accumulator().fold(
+                    pstats, lambda acc: acc.summary(db))
+            elif args.rolling is None:
+                pstats = nflcmd.Accumulator().fold(
+                    pstats, lambda acc: acc.game(db))
+            rows += [Named(r, player.full_name) for r in pstats]
+        nflcmd.write_pstats(args.format, ['name'] + spec, rows)
+    return True
+
+
+def read_batch(f):
+    """
+    Reads player queries from the file `f`, one per line. Each query
+    is a player name optionally followed by the `--team`, `--pos`,
+    `--soundex` and `--show-as` flags, quoted like a shell command.
+    Blank lines and lines starting with `#` are ignored.
+
+    A list of `(query, args)` pairs is returned, where `query` is the
+    original line and `args` are its parsed arguments.
+    """
+    parser = argparse.ArgumentParser(prog='nflstats --batch', add_help=False)
+    aa = parser.add_argument
+    aa(dest='player_query', metavar='PLAYER', nargs='+')
+    aa('--team', type=str, default=None)
+    aa('--pos', type=str, default=None)
+    aa('--soundex', action='store_true')
+    aa('--show-as', type=str, default=None)
+
+    queries = []
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        try:
+            args = parser.parse_args(shlex.split(line))
+        except (SystemExit, ValueError):
+            eprint('Invalid player query on line %d: %s' % (lineno, line))
+            continue
+        args.player_query = ' '.join(args.player_query)
+        queries.append((line, args))
+    return queries
+
+
+def resolve_batch(queries, jobs):
+    """
+    Finds the player and display position for every query returned by
+    `read_batch`. The searches are run on `jobs` threads, each with its
+    own database connection. A list with a `(player, pos)` pair for
+    each query is returned, where `player` is `None` if no player
+    matched.
+    """
+    pool = ConnectionPool(jobs)
+    rec = nflcmd.profile.active()
+
+    def resolve(query):
+        _, args = query
+        with nflcmd.profile.use(rec), pool.connection() as db:
+            player = nflcmd.search(db, args.player_query, args.team,
+                                   args.pos, args.soundex)
+            if player is None:
+                return None, None
+            return player, nflcmd.player_position(db, player, args.show_as)
+
+    workers = ThreadPool(jobs)
+    try:
+        return workers.map(resolve, queries)
+    finally:
+        workers.close()
+        workers.join()
+        pool.close()
+
+
+def run_batch(db, args, stype, week_range):
+    """
+    Runs `nflstats` for every player query in the file `args.batch`.
+    The game or season logs of all matched players are built with the
+    same batched queries. Each table is written to its own file in
+    `args.out_dir`, or else every row is written to stdout as a single
+    NDJSON stream. Returns `False` if any query could not be matched.
+    """
+    if args.batch == '-':
+        queries = read_batch(sys.stdin)
+    else:
+        with open(args.batch) as f:
+            queries = read_batch(f)
+    with nflcmd.profile.phase('search'):
+        resolved = resolve_batch(queries, args.jobs)
+
+    ok = True
+    matched = []
+    for (query, _), (player, pos) in zip(queries, resolved):
+        if player is None:
+            eprint('Could not find a player for: %s' % query)
+            ok = False
+        elif pos == nfldb.Enums.player_pos.UNK:
+            eprint("Could not guess the position of %s. Specify it with\n"
+                   "'--show-as' on the line: %s" % (player, query))
+            ok = False
+        else:
+            matched.append((query, player, pos))
+
+    players = [player for _, player, _ in matched]
+    with nflcmd.profile.phase('load'):
+        if args.season:
+            _, cur_year, _ = nflcmd.current(db)
+            years = range(2009, cur_year+1)
+            logs = nflcmd.season_logs(db, players, years, stype, week_range)
+            write = write_season_table
+        else:
+            logs = nflcmd.game_logs(db, players, args.year, stype,
+                                    week_range)
+            write = write_game_table
+            if args.rolling is not None:
+                for pid, rows in logs.items():
+                    logs[pid] = nflcmd.rolling.game_windows(
+                        db, rows, args.rolling, args.average)
 
+                def write(db, pstats, pos, fmt, out=None, extra=None):
+                    write_game_table(db, pstats, pos, fmt, out, extra,
+                                     summary=False)
+
+    with nflcmd.profile.phase('format'):
+        write_batch(db, args, matched, logs, write)
+    return ok
+
+
+def write_batch(db, args, matched, logs, write):
+    """
+    Writes the table of each `(query, player, pos)` triple in `matched`
+    with `write`, using the game or season logs in `logs`.
+    """
+    if args.out_dir is not None and not path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    for query, player, pos in matched:
+        pstats = list(logs[player.player_id])
+        if args.out_dir is None:
+            extra = {'query': query, 'player_id': player.player_id}
+            write(db, pstats, pos, 'ndjson', extra=extra)
+            continue
+
+        ext = 'txt' if args.format == 'table' else args.format
+        name = re.sub('[^a-z0-9]+', '-', player.full_name.lower())
+        fname = '%s-%s.%s' % (name.strip('-'), player.player_id, ext)
+        with open(path.join(args.out_dir, fname), 'w') as out:
+            write(db, pstats, pos, args.format, out)
+
+
+def run(argv=None, db=None):
+    """
+    Runs the `nflstats` command with the arguments in `argv`, which
+    defaults to `sys.argv[1:]`. If `db` is `None`, then a new
+    connection is opened with `nfldb.connect` (unless `--snapshot` is
+    used).
+    """
     parser = argparse.ArgumentParser(
+        prog='nflstats',
         description='Show NFL game stats for a player.')
     aa = parser.add_argument
-    aa(dest='player_query', metavar='PLAYER', nargs='+')
+    aa(dest='player_query', metavar='PLAYER', nargs='*')
     aa('--team', type=str, default=None,
        help='Specify the team of the player to help the search.')
     aa('--pos', type=str, default=None,
@@ -86,9 +455,9 @@ def run():
     aa('--soundex', action='store_true',
        help='When set, player names are compared using Soundex instead '
             'of Levenshtein.')
-    aa('--year', type=str, default=cur_year,
-       help='Show game logs for only this year. (Not applicable if '
-            '--season is set.)')
+    aa('--year', type=str, default=None,
+       help='Show game logs for only this year. Defaults to the current\n'
+            'season. (Not applicable if --season is set.)')
     aa('--pre', action='store_true',
        help='When set, only games from the preseason will be used.')
     aa('--post', action='store_true',
@@ -99,18 +468,132 @@ def run():
             '"4-". Has no effect when --season is used.')
     aa('--season', action='store_true',
        help='When set, statistics are shown by season instead of by game.')
+    aa('--rolling', type=int, default=None, metavar='N',
+       help='Show the totals of the N weeks ending with each game\n'
+            'instead of the statistics of the game itself. Has no\n'
+            'effect when --season is used.')
+    aa('--average', action='store_true',
+       help='With --rolling, show per-game averages over each window\n'
+            'instead of totals.')
+    aa('--refresh-names', action='store_true',
+       help='Rebuild the local index of player names before searching.\n'
+            'It is otherwise rebuilt only when the roster changes.')
     aa('--show-as', type=str, default=None,
        help='Force display of player as a particular position. This may need '
             'to be set for inactive players.')
-    args = parser.parse_args()
+    aa('--format', type=str, default='table', choices=nflcmd.formats,
+       help='The output format. Every format except "table" is written\n'
+            'one row at a time and suitable for use by other programs.')
+    aa('--splits', type=str, default=None, metavar='SPLITS',
+       help='Show the totals of groups of games instead of each game.\n'
+            'SPLITS is a comma separated list of any of: %s.\n'
+            'Has no effect when --season is used.' % ', '.join(splits))
+    aa('--percentiles', type=str, default=None, metavar='COLUMNS',
+       help='Show the percentile of each value of these columns among\n'
+            'the players at the same position in the same season (or\n'
+            'game log) next to it. A player\'s position in a season is\n'
+            'guessed from the plays they made in it, not read from the\n'
+            'current roster. COLUMNS is a comma separated list of\n'
+            'columns, e.g., "passing_yds,passing_tds", where "all"\n'
+            'stands for every column in the table.')
+    aa('--compare', action='store_true',
+       help='Treat each PLAYER argument as a separate player query\n'
+            '(quote names with spaces) and show the stats of every\n'
+            'player in one table.')
+    aa('--batch', type=nflcmd.path_arg, default=None, metavar='FILE',
+       help='Read player queries from FILE (or stdin if FILE is "-"),\n'
+            'one per line. Each query is a player name optionally\n'
+            'followed by --team, --pos, --soundex or --show-as.')
+    aa('--out-dir', type=nflcmd.path_arg, default=None, metavar='DIR',
+       help='With --batch, write the table of each player to its own\n'
+            'file in DIR using --format. Otherwise, the rows of every\n'
+            'player are written to stdout as a single NDJSON stream.')
+    aa('--snapshot', type=nflcmd.path_arg, default=None, metavar='FILE',
+       help='Read statistics from a snapshot written by\n'
+            '"nflcmd snapshot" instead of from the database. Requires\n'
+            'NumPy.')
+    aa('--jobs', type=int, default=4,
+       help='The number of independent queries (and, with --batch,\n'
+            'player searches) to run at once, each with its own\n'
+            'database connection.')
+    aa('--profile', action='store_true',
+       help='When set, a breakdown of the time spent in each phase and\n'
+            'of the queries issued is written to stderr.')
+    aa('--profile-json', type=nflcmd.path_arg, default=None, metavar='FILE',
+       help='Write the profile, including every query issued, to FILE\n'
+            'as JSON.')
+    args = parser.parse_args(argv)
+    if len(args.player_query) == 0 and args.batch is None:
+        parser.error('a player query or --batch is required')
+    if args.compare and (args.batch is not None
+                         or len(args.player_query) < 2):
+        parser.error('--compare requires at least two player queries and '
+                     'cannot be used with --batch')
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.rolling is not None and args.rolling < 1:
+        parser.error('--rolling must be at least 1')
+    if args.average and args.rolling is None:
+        parser.error('--average requires --rolling')
+    if args.splits is not None:
+        args.splits = [s.strip() for s in args.splits.split(',')
+                       if len(s.strip()) > 0]
+        for kind in args.splits:
+            if kind not in splits:
+                parser.error('unknown split "%s" (valid splits: %s)'
+                             % (kind, ', '.join(splits)))
+        if args.batch is not None or args.compare \
+                or args.rolling is not None:
+            parser.error('--splits cannot be used with --batch, --compare '
+                         'or --rolling')
+    if args.percentiles is not None:
+        args.percentiles = [s.strip() for s in args.percentiles.split(',')
+                            if len(s.strip()) > 0]
+        grain = 'season' if args.season else 'game'
+        for name in args.percentiles:
+            if name != 'all' and not nflcmd.league.is_column(name, grain):
+                parser.error('%s has no percentiles in a %s log'
+                             % (name, grain))
+        if args.batch is not None or args.compare \
+                or args.splits is not None or args.rolling is not None \
+                or args.snapshot is not None:
+            parser.error('--percentiles cannot be used with --batch, '
+                         '--compare, --splits, --rolling or --snapshot')
 
-    args.player_query = ' '.join(args.player_query)
-    player = nflcmd.search(db, args.player_query, args.team, args.pos,
-                           args.soundex)
-    if player is None:
-        eprint("Could not find a player given the criteria.")
-        sys.exit(1)
-    print('Player matched: %s' % player)
+    snap = None
+    if args.snapshot is not None:
+        if args.batch is not None or args.refresh_names:
+            parser.error('--snapshot cannot be used with --batch or '
+                         '--refresh-names')
+        if not nflcmd.snapshot.available:
+            eprint("NumPy is required to use --snapshot.")
+            sys.exit(1)
+        try:
+            snap = nflcmd.snapshot.Snapshot(args.snapshot)
+        except (IOError, OSError, nflcmd.snapshot.SnapshotError) as e:
+            eprint(e)
+            sys.exit(1)
+        _, cur_year, _ = snap.current()
+    else:
+        if db is None:
+            db = nfldb.connect()
+        _, cur_year, _ = nflcmd.current(db)
+    if args.year is None:
+        args.year = cur_year
+
+    with nflcmd.profile.command(args.profile, args.profile_json):
+        with nflcmd.executor.command(args.jobs):
+            main(db, args, snap)
+
+
+def main(db, args, snap=None):
+    """
+    Runs `nflstats` with the arguments `args` parsed by `run`. If
+    `snap` is given, then statistics are read from that
+    `nflcmd.snapshot.Snapshot` instead of `db`.
+    """
+    # Only tables are meant for humans, so keep other formats clean.
+    info = print if args.format == 'table' else eprint
 
     week_range = nflcmd.arg_range(args.weeks, 1, 17)
     stype = 'Regular'
@@ -119,22 +602,50 @@ def run():
     if args.post:
         stype = 'Postseason'
 
+    if args.refresh_names:
+        nflcmd.names.refresh(db)
 
-    pos = None
-    if args.show_as is not None:
-        pos = nfldb.Enums.player_pos[args.show_as]
-    elif player.position == nfldb.Enums.player_pos.UNK:
-        q = nfldb.Query(db)
-        q.play_player(player_id=player.player_id)
-        q.sort(('gsis_id', 'desc'))
-        pos = nfldb.guess_position(q.as_play_players())
-        if pos == nfldb.Enums.player_pos.UNK:
-            eprint("The player matched is not active and I could not guess\n"
-                   "his position. Specify it with the '--show-as' flag.")
+    if args.batch is not None:
+        if not run_batch(db, args, stype, week_range):
             sys.exit(1)
-        print("Guessed position: %s" % pos)
+        return
+
+    if args.compare:
+        if not compare(db, args, stype, week_range, snap):
+            sys.exit(1)
+        return
+
+    args.player_query = ' '.join(args.player_query)
+    with nflcmd.profile.phase('search'):
+        idx = snap.names() if snap is not None else None
+        player = nflcmd.search(db, args.player_query, args.team, args.pos,
+                               args.soundex, idx=idx)
+        unknown = (player is not None and args.show_as is None
+                   and player.position == nfldb.Enums.player_pos.UNK)
+        if snap is not None and unknown:
+            # There's no play data in a snapshot to guess from.
+            pos = nfldb.Enums.player_pos.UNK
+        elif player is not None:
+            pos = nflcmd.player_position(db, player, args.show_as)
+    if player is None:
+        eprint("Could not find a player given the criteria.")
+        sys.exit(1)
+    info('Player matched: %s' % player)
+
+    if pos == nfldb.Enums.player_pos.UNK:
+        eprint("The player matched is not active and I could not guess\n"
+               "his position. Specify it with the '--show-as' flag.")
+        sys.exit(1)
+    if args.show_as is None and player.position == nfldb.Enums.player_pos.UNK:
+        info("Guessed position: %s" % pos)
 
     if args.season:
-        show_season_table(db, player, stype, week_range, pos)
+        show_season_table(db, player, stype, week_range, pos, args.format,
+                          snap, args.percentiles)
+    elif args.splits is not None:
+        show_splits_table(db, player, args.year, stype, week_range, pos,
+                          args.format, args.splits, snap)
     else:
-        show_game_table(db, player, args.year, stype, week_range, pos)
+        show_game_table(db, player, args.year, stype, week_range, pos,
+                        args.format, args.rolling, args.average, snap,
+                        args.percentiles)
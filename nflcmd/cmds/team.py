@@ -0,0 +1,135 @@
+from __future__ import absolute_import, division, print_function
+import argparse
+import sys
+
+import nfldb
+
+import nflcmd
+
+
+__all__ = ['run']
+
+prefix_team = ['team', 'game_count', 'record', 'points_for',
+               'points_against']
+
+
+def eprint(*args, **kwargs):
+    kwargs['file'] = sys.stderr
+    print(*args, **kwargs)
+
+
+def value(row, column):
+    """
+    Returns the value of `column` in the `nflcmd.TeamTotals` row `row`,
+    which may be a derived statistic in `nflcmd.statfuns`.
+    """
+    if column in nflcmd.statfuns:
+        return nflcmd.statfuns[column](row)
+    return getattr(row, column)
+
+
+def is_column(column):
+    """
+    Returns `True` if and only if `column` can be used to rank teams.
+    """
+    if column in nflcmd.statfuns or column in prefix_team[1:]:
+        return column != 'record'
+    if column.startswith('opp_'):
+        column = column[4:]
+    return column in nflcmd._player_category_set
+
+
+def run(argv=None, db=None):
+    """
+    Runs the `nflteam` command with the arguments in `argv`, which
+    defaults to `sys.argv[1:]`. If `db` is `None`, then a new
+    connection is opened with `nfldb.connect`.
+    """
+    if db is None:
+        db = nfldb.connect()
+    _, cur_year, _ = nflcmd.current(db)
+
+    parser = argparse.ArgumentParser(
+        prog='nflteam',
+        description='Show NFL team statistics and rankings.')
+    aa = parser.add_argument
+    aa(dest='teams', metavar='TEAM', nargs='*',
+       help='Only show these teams (e.g., "NE"). All teams are shown\n'
+            'by default.')
+    aa('--years', type=str, default=str(cur_year),
+       help='Show statistics only for the inclusive range of years\n'
+            'given, e.g., "2010-2011". Other valid examples: "2010",\n'
+            '"-2010", "2010-".')
+    aa('--weeks', type=str, default='',
+       help='Show statistics only for the inclusive range of weeks\n'
+            'given, e.g., "4-8". Other valid examples: "4", "-8",\n'
+            '"4-".')
+    aa('--pre', action='store_true',
+       help='When set, only games from the preseason will be used.')
+    aa('--post', action='store_true',
+       help='When set, only games from the postseason will be used.')
+    aa('--defense', action='store_true',
+       help='When set, show defensive statistics and the statistics\n'
+            'allowed to opponents instead of offensive statistics.')
+    aa('--rank', type=str, default=[], nargs='+', metavar='COLUMN',
+       help='Rank teams by these columns in descending order, e.g.,\n'
+            '"rushing_yds". Columns may be any statistical category,\n'
+            'a category prefixed with "opp_" (e.g., "opp_passing_yds"\n'
+            'for passing yards allowed), a derived statistic or one of\n'
+            '"points_for" and "points_against".')
+    aa('--ascending', action='store_true',
+       help='With --rank, rank teams in ascending order instead (e.g.,\n'
+            'for fewest points allowed).')
+    aa('--limit', type=int, default=None,
+       help='Restrict the number of teams shown.')
+    aa('--format', type=str, default='table', choices=nflcmd.formats,
+       help='The output format. Every format except "table" is written\n'
+            'one row at a time and suitable for use by other programs.')
+    aa('--jobs', type=int, default=4,
+       help='The number of independent queries to run at once, each\n'
+            'with its own database connection.')
+    aa('--profile', action='store_true',
+       help='When set, a breakdown of the time spent in each phase and\n'
+            'of the queries issued is written to stderr.')
+    aa('--profile-json', type=nflcmd.path_arg, default=None, metavar='FILE',
+       help='Write the profile, including every query issued, to FILE\n'
+            'as JSON.')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    for column in args.rank:
+        if not is_column(column):
+            eprint("%s is not a valid column to rank teams by." % column)
+            sys.exit(1)
+    teams = set(nfldb.standard_team(t) for t in args.teams)
+    if 'UNK' in teams:
+        eprint("Every TEAM must be a valid team, e.g., \"NE\".")
+        sys.exit(1)
+
+    stype = 'Regular'
+    if args.pre:
+        stype = 'Preseason'
+    if args.post:
+        stype = 'Postseason'
+    years = nflcmd.arg_range(args.years, 2009, cur_year)
+    weeks = nflcmd.arg_range(args.weeks, 1, 17)
+
+    kind = 'defense' if args.defense else 'offense'
+    spec = prefix_team + nflcmd.columns['team'][kind]
+    spec += [c for c in args.rank if c not in spec]
+
+    with nflcmd.profile.command(args.profile, args.profile_json), \
+            nflcmd.executor.command(args.jobs):
+        with nflcmd.profile.phase('load'):
+            totals = nflcmd.team_totals(db, years, stype, weeks)
+        with nflcmd.profile.phase('rank'):
+            rows = [row for t, row in sorted(totals.items())
+                    if len(teams) == 0 or t in teams]
+            if len(args.rank) > 0:
+                sign = 1 if args.ascending else -1
+                rows.sort(key=lambda r: [sign * value(r, c)
+                                         for c in args.rank])
+            if args.limit is not None:
+                rows = rows[:args.limit]
+        with nflcmd.profile.phase('format'):
+            nflcmd.write_pstats(args.format, spec, rows)
@@ -0,0 +1,141 @@
+"""
+Module nflcmd.executor runs independent queries concurrently, each on
+its own database connection. Functions in nflcmd that issue more than
+one query (e.g., `nflcmd.game_logs` fetches games, per-game statistics
+and field goal histograms) submit them together with
+`nflcmd.executor.gather`.
+
+When no `nflcmd.executor.Executor` is active in the current thread,
+`gather` simply runs the queries one after the other on the caller's
+connection. Commands activate an executor with `--jobs`:
+
+    with nflcmd.executor.command(4):
+        logs = nflcmd.game_logs(db, players, 2013, 'Regular')
+
+Results are always returned in the order that the queries were
+submitted, regardless of the order in which they finish.
+"""
+from __future__ import absolute_import, division, print_function
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+import threading
+
+from nflcmd import profile
+from nflcmd.pool import ConnectionPool
+
+_local = threading.local()
+
+
+def active():
+    """
+    Returns the active `nflcmd.executor.Executor` of the current
+    thread, or `None` if queries are run serially.
+    """
+    return getattr(_local, 'executor', None)
+
+
+@contextmanager
+def use(ex):
+    """
+    A context manager that makes `ex` the active executor of the
+    current thread. `ex` may be `None`, in which case queries are run
+    serially inside the block.
+    """
+    old = active()
+    _local.executor = ex
+    try:
+        yield ex
+    finally:
+        _local.executor = old
+
+
+@contextmanager
+def command(jobs, connect=None):
+    """
+    A context manager that runs the queries inside of it with a new
+    executor of `jobs` connections, which is closed when the block
+    exits. If an executor is already active in this thread (e.g., one
+    started by `nflcmd serve`) or if `jobs` is `1`, then no new
+    executor is made.
+
+    `connect` is used to open connections and defaults to
+    `nfldb.connect`.
+    """
+    if active() is not None or jobs <= 1:
+        yield active()
+        return
+    ex = Executor(jobs, connect)
+    try:
+        with use(ex):
+            yield ex
+    finally:
+        ex.close()
+
+
+def gather(db, calls):
+    """
+    Runs every function in `calls` with a database connection as its
+    only argument and returns a list of their results in the same
+    order. With the active executor, the first function is run in the
+    current thread with `db` while the rest are run concurrently on
+    connections from the executor's pool. Otherwise, every function is
+    run with `db`, one after the other.
+
+    Since the connections given to the functions may differ from
+    `db`, any objects they return that hold on to a connection should
+    be built with `db`.
+    """
+    ex = active()
+    if ex is None:
+        return [call(db) for call in calls]
+    return ex.gather(db, calls)
+
+
+class Executor (object):
+    """
+    Runs functions that query the database on up to `jobs`
+    connections at once: the caller's connection plus `jobs - 1`
+    connections from a `nflcmd.pool.ConnectionPool`, which are opened
+    with `connect` as they are needed.
+
+    An executor may be shared by many threads.
+    """
+    def __init__(self, jobs, connect=None):
+        assert jobs >= 1
+        self.jobs = jobs
+        self._pool = None
+        self._workers = None
+        if jobs > 1:
+            self._pool = ConnectionPool(jobs - 1, connect)
+            self._workers = ThreadPool(jobs - 1)
+
+    def gather(self, db, calls):
+        """
+        Like `nflcmd.executor.gather`, but always uses this executor.
+        """
+        if self._workers is None or len(calls) <= 1:
+            return [call(db) for call in calls]
+
+        rec = profile.active()
+
+        def work(call):
+            with profile.use(rec), self._pool.connection() as conn:
+                return call(conn)
+        pending = [self._workers.apply_async(work, (call,))
+                   for call in calls[1:]]
+        try:
+            first = calls[0](db)
+        finally:
+            for p in pending:
+                p.wait()
+        return [first] + [p.get() for p in pending]
+
+    def close(self):
+        """
+        Waits for running queries to finish and closes every
+        connection opened by this executor.
+        """
+        if self._workers is not None:
+            self._workers.close()
+            self._workers.join()
+            self._pool.close()
@@ -0,0 +1,325 @@
+"""
+Module nflcmd.league puts a player's statistics in the context of the
+rest of the league. For example, a quarterback's passing yards in a
+season can be shown with the percentile of those yards among every
+quarterback's passing yards in that season.
+
+Percentiles are answered from sorted distributions with a binary
+search. The distributions of every column and every season shown in a
+table are built from one query, which is cached by
+`nflcmd.cache.fetchall`, and the most recently used are remembered in
+memory so that building them twice (e.g., in `nflcmd serve`) is free.
+The number of queries issued doesn't depend on the number of rows in
+a table.
+"""
+from __future__ import absolute_import, division, print_function
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import threading
+
+import nfldb
+
+import nflcmd
+from nflcmd import aggtables, cache, matrix
+
+grains = ['game', 'season']
+"""
+The units of a distribution: either one value for each player in each
+game or one value for each player in each season.
+"""
+
+_season_columns = {
+    'game_count': [],
+    'passing_300': ['passing_yds'],
+    'passing_yds_game': ['passing_yds'],
+}
+
+max_leagues = 32
+"""
+The maximum number of `nflcmd.league.League` objects remembered in
+memory. When there are more, the least recently used are forgotten
+(they can still be rebuilt quickly from the query cache).
+"""
+
+_leagues = OrderedDict()
+_leagues_lock = threading.Lock()
+
+
+def is_column(name, grain='season'):
+    """
+    Returns `True` if and only if `name` is a column of a game log
+    (if `grain` is `game`) or a season log (if `grain` is `season`)
+    that has a distribution.
+    """
+    if grain == 'season' and name in _season_columns:
+        return True
+    return name in nflcmd.statfuns or name in nflcmd._player_category_set
+
+
+def columns(name):
+    """
+    Returns the list of statistical categories that must be loaded in
+    order to compute the distribution of the column `name`.
+    """
+    if name in _season_columns:
+        return _season_columns[name]
+    return matrix.columns(name)
+
+
+class Distribution (object):
+    """
+    A sorted list of the values of one column, e.g., the passing yards
+    of every quarterback in a season.
+    """
+    __slots__ = ['values']
+
+    def __init__(self, values):
+        self.values = sorted(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def percentile(self, v):
+        """
+        Returns the percentage of values less than `v`, counting half
+        of the values equal to `v`, rounded to an integer. (So the
+        best of 100 distinct values is in the 100th percentile and the
+        median is in the 50th.)
+        """
+        if len(self.values) == 0:
+            return '-'
+        lo = bisect_left(self.values, v)
+        hi = bisect_right(self.values, v)
+        return int(round(100 * (lo + hi) / 2 / len(self.values)))
+
+    def rank(self, v):
+        """
+        Returns the rank of `v` in descending order, where the largest
+        value is `1` and equal values share a rank.
+        """
+        return len(self.values) - bisect_right(self.values, v) + 1
+
+
+class League (object):
+    """
+    The distributions of a list of columns for every season in a range
+    of seasons, among the players who played a position with a kind of
+    columns in `nflcmd.pcolumns` (e.g., every quarterback) in each
+    season. Each player contributes one value for each game or season
+    they played, depending on `grain`.
+
+    The position a player played in a season is guessed from their
+    statistics rather than read from the player table, since the
+    latter only records a player's current position (and nothing at
+    all for players no longer on a roster). Each play counts once
+    toward the first position in `nflcmd._guess_positions` it suggests
+    (e.g., a rushing attempt for running backs, or any defensive
+    statistic for defenders), and each season goes to the position
+    with the most plays, as in `nflcmd.guess_position`. So a few
+    special teams tackles don't outweigh a season of carries, and a
+    receiver who used to be a running back is counted among running
+    backs in the seasons spent running the ball. The plays are counted
+    by the aggregate tables when they're fresh (see
+    `nflcmd.aggtables.position_plays`).
+
+    Only players who recorded one of the statistics needed to compute
+    a column are counted in its distribution. For example, the
+    distribution of kick return yards among defenders only includes
+    defenders who returned a kick, and the distribution of completion
+    percentage only includes players who attempted a pass.
+    """
+    def __init__(self, grain, kind, cols, dists):
+        self.grain = grain
+        self.kind = kind
+        self.columns = list(cols)
+        self.dists = dists
+        """A dictionary mapping `(season_year, column)` pairs to
+        `nflcmd.league.Distribution` objects."""
+
+    def distribution(self, year, column):
+        """
+        Returns the `nflcmd.league.Distribution` of `column` in the
+        season `year`, which is empty if no player recorded it.
+        """
+        return self.dists.get((year, column)) or Distribution([])
+
+    def percentile(self, row, column):
+        """
+        Returns the percentile of the value of `column` in `row` (a
+        `nflcmd.Game` or `nflcmd.Totals` row, depending on the grain)
+        within its season.
+        """
+        if self.grain == 'game':
+            year = row.season_year
+        else:
+            year = row.year
+        return self.distribution(year, column).percentile(_value(row, column))
+
+    def spec(self, spec):
+        """
+        Returns a copy of `spec` with a percentile column added after
+        each of the columns in `self.columns`, which are named after
+        the column followed by `_pct` (and headed by its abbreviation
+        followed by `%ile` in `nflcmd.header_row`). Columns that
+        aren't in `spec` are added to the end of it first.
+        """
+        spec = spec + [c for c in self.columns if c not in spec]
+        out = []
+        for c in spec:
+            out.append(c)
+            if c in self.columns:
+                out.append(c + '_pct')
+        return out
+
+    def rows(self, pstats):
+        """
+        Generates a `nflcmd.league.Ranked` row for each row in
+        `pstats`.
+        """
+        for row in pstats:
+            yield Ranked(row, self)
+
+
+class Ranked (object):
+    """
+    A row of player statistics (e.g., a `nflcmd.Game`) along with the
+    percentiles of some of its columns, which are available as the
+    name of the column followed by `_pct` (e.g., `passing_yds_pct`).
+    Every other column is read from the row.
+    """
+    __slots__ = ['_row', '_league']
+
+    def __init__(self, row, league):
+        self._row = row
+        self._league = league
+
+    def __getattr__(self, k):
+        if k.endswith('_pct') and k[:-4] in self._league.columns:
+            return self._league.percentile(self._row, k[:-4])
+        return getattr(self._row, k)
+
+
+def load(db, grain, kind, cols, years, stype, week_range=None):
+    """
+    Returns a `nflcmd.league.League` with the distributions of the
+    columns in `cols` (each of which must satisfy
+    `nflcmd.league.is_column`) in each of the given seasons, season
+    phase and optional range of weeks, among the players who played
+    a position of `kind` in each season (see `nflcmd.league.League`
+    for how the position is determined). Every distribution is built
+    from a single query, and the result is remembered until one of the
+    seasons is updated in nfldb (in the same way as
+    `nflcmd.cache.fetchall`) or it's one of the least recently used
+    when more than `nflcmd.league.max_leagues` are remembered.
+    """
+    assert grain in grains
+    # Keyed by database rather than connection, so that every connection
+    # to the same database (e.g., in a pool) shares the leagues loaded.
+    key = (db.dsn, grain, kind, tuple(cols), tuple(int(y) for y in years),
+           stype, None if week_range is None else tuple(week_range))
+    stamps = cache.season_stamps(db, nflcmd._seasons(years, stype))
+    with _leagues_lock:
+        known, league = _leagues.pop(key, (None, None))
+        if league is not None and known == stamps:
+            _leagues[key] = (stamps, league)
+            return league
+    league = League(grain, kind, cols,
+                    _load(db, grain, kind, cols, years, stype, week_range))
+    with _leagues_lock:
+        _leagues[key] = (stamps, league)
+        while len(_leagues) > max_leagues:
+            _leagues.popitem(last=False)
+    return league
+
+
+def _load(db, grain, kind, cols, years, stype, week_range):
+    cats = set()
+    for c in cols:
+        cats.update(columns(c))
+    cats = sorted(cats)
+
+    where, params = nflcmd._game_where(years, stype, week_range)
+    seasons = nflcmd._seasons(years, stype)
+    table = aggtables.play_player_table(db, seasons)
+    plays = aggtables.position_plays(table)
+    per_game = '''
+        SELECT play_player.player_id, play_player.gsis_id,
+               game.season_year {plays} {sums}
+        FROM {play_player}
+        JOIN game ON game.gsis_id = play_player.gsis_id
+        WHERE {where}
+        GROUP BY play_player.player_id, play_player.gsis_id,
+                 game.season_year
+    '''.format(plays=''.join(', SUM(%s) AS plays_%s' % (e, pos.lower())
+                             for pos, e in plays),
+               sums=''.join(', SUM(play_player.%s) AS %s' % (c, c)
+                            for c in cats),
+               play_player=table, where=where)
+    played = ''.join(', SUM(pg.plays_%s){over} AS %s'
+                     % (pos.lower(), _played(pos)) for pos, _ in plays)
+    if grain == 'game':
+        q = '''
+            SELECT pg.* {played}
+            FROM ({per_game}) AS pg
+            WINDOW season AS (PARTITION BY pg.player_id, pg.season_year)
+        '''.format(played=played.format(over=' OVER season'),
+                   per_game=per_game)
+    else:
+        passing_300 = '0'
+        if 'passing_yds' in cats:
+            passing_300 = \
+                'SUM(CASE WHEN pg.passing_yds >= 300 THEN 1 ELSE 0 END)'
+        q = '''
+            SELECT pg.player_id, pg.season_year,
+                   COUNT(*) AS game_count, {passing_300} AS passing_300
+                   {played} {sums}
+            FROM ({per_game}) AS pg
+            GROUP BY pg.player_id, pg.season_year
+        '''.format(passing_300=passing_300, played=played.format(over=''),
+                   sums=''.join(', SUM(pg.%s) AS %s' % (c, c) for c in cats),
+                   per_game=per_game)
+
+    values = {}
+    for r in cache.fetchall(db, q, params, seasons):
+        if _kind(r) != kind:
+            continue
+        row = _Row(r)
+        for c in cols:
+            if any(r[cat] != 0 for cat in columns(c)) or c == 'game_count':
+                key = (r['season_year'], c)
+                values.setdefault(key, []).append(_value(row, c))
+    return dict((k, Distribution(vs)) for k, vs in values.items())
+
+
+class _Row (object):
+    """
+    Exposes a SQL row of a distribution query as the attributes used by
+    `nflcmd.statfuns` and the season log columns. Missing statistics
+    are zero.
+    """
+    __slots__ = ['_r']
+
+    def __init__(self, r):
+        self._r = r
+
+    @property
+    def passing_yds_game(self):
+        return nflcmd.ratio(self.passing_yds, self.game_count)
+
+    def __getattr__(self, k):
+        return self._r.get(k, 0)
+
+
+def _played(pos):
+    return 'played_%s' % pos.lower()
+
+
+def _kind(r):
+    hist = dict((pos, r[_played(pos)]) for pos, _ in nflcmd._guess_positions)
+    return nflcmd.pcolumns.get(nflcmd.guess_position(hist))
+
+
+def _value(row, column):
+    if column in nflcmd.statfuns:
+        return nflcmd.statfuns[column](row)
+    return getattr(row, column)
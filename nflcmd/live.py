@@ -0,0 +1,192 @@
+"""
+Module nflcmd.live keeps player rankings up to date while games are in
+progress. A `nflcmd.live.LiveRanking` remembers the totals of every
+player, along with the contribution of each game to them. Each call to
+`nflcmd.live.LiveRanking.update` checks which games have been updated
+in nfldb since the last call and re-aggregates only those games,
+applying the difference to the running totals.
+
+The top players are maintained incrementally too: unless a player in
+the current top group got worse (e.g., because of a stat correction),
+the new top group is chosen from the old one and the players whose
+totals changed.
+"""
+from __future__ import absolute_import, division, print_function
+import heapq
+
+import nfldb
+
+import nflcmd
+from nflcmd import aggtables, cache
+
+
+class LiveRanking (object):
+    """
+    The running totals of the statistical categories in `cats` for
+    every player in the given seasons, season phase and weeks, sorted
+    by `cats` in descending order. Players may be restricted to those
+    currently at one of the positions in `pos` or on one of the teams
+    in `teams`.
+
+    The totals are empty until `nflcmd.live.LiveRanking.update` is
+    called.
+    """
+    def __init__(self, db, cats, years, stype, weeks, pos=None, teams=None):
+        self.db = db
+        self.cats = list(cats)
+        self.totals = {}
+        """A dictionary mapping player ids to a list of totals."""
+        self._game_where = nflcmd._game_where(years, stype, weeks)
+        self._where = self._game_where[0]
+        self._params = list(self._game_where[1])
+        self._join_player = ''
+        if pos or teams:
+            self._join_player = '''
+                JOIN player ON player.player_id = play_player.player_id
+            '''
+        if pos:
+            self._where += ' AND player.position IN %s'
+            self._params.append(tuple(str(nfldb.Enums.player_pos[p])
+                                      for p in pos))
+        if teams:
+            self._where += ' AND player.team IN %s'
+            self._params.append(tuple(teams))
+        self._games = {}
+        self._updated = {}
+        self._limit = None
+        self._top = None
+        self._top_keys = {}
+
+    def update(self):
+        """
+        Re-aggregates every game that was added or updated since the
+        last update and applies the changes to the running totals. The
+        set of player ids whose totals changed is returned.
+        """
+        where, params = self._game_where
+        q = '''
+            SELECT game.gsis_id, game.season_year, game.season_type,
+                   game.time_updated
+            FROM game WHERE {where}
+        '''.format(where=where)
+        changed = [r for r in cache.fetchall(self.db, q, params)
+                   if self._updated.get(r['gsis_id']) != r['time_updated']]
+        if len(changed) == 0:
+            return set()
+
+        # The first update loads every game, so read the totals of games
+        # that haven't changed since they were put in the aggregate
+        # tables from there. After that, only games in progress change,
+        # which the aggregate tables won't have yet.
+        aggregated, raw = [], []
+        st = aggtables.state(self.db) if len(self._updated) == 0 else None
+        for r in changed:
+            season = cache._season_key((r['season_year'], r['season_type']))
+            s = (st or {}).get(season)
+            if s is not None and r['time_updated'] <= s['updated']:
+                aggregated.append(r['gsis_id'])
+            else:
+                raw.append(r['gsis_id'])
+        games = self._fetch(raw, 'play_player')
+        games.update(self._fetch(aggregated,
+                                 'nflcmd_player_game AS play_player'))
+
+        touched = set()
+        for r in changed:
+            gid = r['gsis_id']
+            new = games.get(gid, {})
+            old = self._games.pop(gid, {})
+            for pid in set(new) | set(old):
+                before = old.get(pid, self._zeros)
+                after = new.get(pid, self._zeros)
+                if before == after:
+                    continue
+                total = self.totals.setdefault(pid, self._zeros)
+                self.totals[pid] = [t - b + a for t, b, a
+                                    in zip(total, before, after)]
+                touched.add(pid)
+            if len(new) > 0:
+                self._games[gid] = new
+            self._updated[gid] = r['time_updated']
+        self._update_top(touched)
+        return touched
+
+    def top(self, limit):
+        """
+        Returns a list of up to `limit` pairs of player ids and totals
+        of the best players, sorted by `cats` in descending order (and
+        then by player id). Players whose totals are all zero aren't
+        ranked.
+        """
+        if self._top is None or self._limit != limit:
+            self._limit = limit
+            self._set_top(self._best(self.totals))
+        return [(pid, self.totals[pid]) for pid in self._top]
+
+    def pstat(self, player_id):
+        """
+        Returns an aggregate `nfldb.PlayPlayer` object with the totals
+        of the player with identifier `player_id`.
+        """
+        totals = self.totals.get(player_id, self._zeros)
+        stats = dict((c, v) for c, v in zip(self.cats, totals) if v != 0)
+        return nfldb.PlayPlayer(self.db, None, None, None, player_id, None,
+                                stats)
+
+    @property
+    def _zeros(self):
+        return [0] * len(self.cats)
+
+    def _key(self, pid):
+        return tuple(-v for v in self.totals[pid]) + (pid,)
+
+    def _best(self, pids):
+        ranked = (pid for pid in pids if any(self.totals[pid]))
+        return heapq.nsmallest(self._limit, ranked, key=self._key)
+
+    def _set_top(self, top):
+        self._top = top
+        self._top_keys = dict((pid, self._key(pid)) for pid in top)
+
+    def _update_top(self, touched):
+        """
+        Updates the current top group after the totals of the players
+        in `touched` changed. If none of the players in the top group
+        got worse, then every other player is still behind all of them
+        (or didn't change), so only the top group and the players in
+        `touched` need to be ranked. Otherwise, every player is ranked.
+        """
+        if self._top is None:
+            return
+        if any(self._key(pid) > self._top_keys[pid]
+               for pid in touched if pid in self._top_keys):
+            self._set_top(self._best(self.totals))
+        else:
+            self._set_top(self._best(set(self._top) | touched))
+
+    def _fetch(self, gsis_ids, table):
+        """
+        Returns a dictionary mapping each GSIS id in `gsis_ids` to a
+        dictionary mapping player ids to the player's totals in that
+        game, which are summed from `table`.
+        """
+        if len(gsis_ids) == 0:
+            return {}
+        where = self._where + ' AND play_player.gsis_id IN %s'
+        params = self._params + [tuple(gsis_ids)]
+        q = '''
+            SELECT play_player.player_id, play_player.gsis_id, {sums}
+            FROM {table}
+            JOIN game ON game.gsis_id = play_player.gsis_id
+            {join_player}
+            WHERE {where}
+            GROUP BY play_player.player_id, play_player.gsis_id
+        '''.format(sums=', '.join('SUM(play_player.%s) AS %s' % (c, c)
+                                  for c in self.cats),
+                   table=table, join_player=self._join_player, where=where)
+        games = {}
+        for r in cache.fetchall(self.db, q, params):
+            totals = [r[c] for c in self.cats]
+            if any(totals):
+                games.setdefault(r['gsis_id'], {})[r['player_id']] = totals
+        return games
@@ -0,0 +1,209 @@
+"""
+Module nflcmd.matrix provides an in-memory matrix of aggregate player
+statistics, with one row for each player and one column for each
+statistic. It is loaded with a single query and supports ranking
+players on any statistic in `nflcmd.statfuns` (which cannot be sorted
+by the database), optionally restricted to players meeting minimum
+qualifiers like "at least 200 passing attempts".
+
+This module requires [NumPy](http://www.numpy.org). If NumPy isn't
+installed, `nflcmd.matrix.available` is `False`.
+"""
+from __future__ import absolute_import, division, print_function
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import nfldb
+from psycopg2.extensions import cursor as tuple_cursor
+
+import nflcmd
+from nflcmd import profile
+
+available = np is not None
+"""
+Whether NumPy is installed.
+"""
+
+
+def percent(num, den):
+    """
+    The vectorized form of `nflcmd.percent`.
+    """
+    return 100 * ratio(num, den)
+
+
+def ratio(num, den):
+    """
+    The vectorized form of `nflcmd.ratio`. Elements with a zero
+    denominator are `0.0`.
+    """
+    out = np.zeros(len(num))
+    np.divide(num, den, out=out, where=den != 0)
+    return out
+
+
+def add(a, b):
+    """
+    Returns the sum of two columns.
+    """
+    return a + b
+
+
+statfuns = {
+    'passing_ratio': (percent, 'passing_cmp', 'passing_att'),
+    'passing_yds_att': (ratio, 'passing_yds', 'passing_att'),
+    'rushing_yds_att': (ratio, 'rushing_yds', 'rushing_att'),
+    'receiving_yds_att': (ratio, 'receiving_yds', 'receiving_rec'),
+    'fgm_ratio': (percent, 'kicking_fgm', 'kicking_fga'),
+    'xpm_ratio': (percent, 'kicking_xpmade', 'kicking_xpa'),
+    'defense_tkl_tot': (add, 'defense_tkl', 'defense_ast'),
+}
+"""
+The vectorized forms of `nflcmd.statfuns`. Each value is a tuple of a
+function followed by the names of the columns it should be applied to.
+"""
+
+
+def columns(name):
+    """
+    Returns the list of statistical categories that must be loaded in
+    order to compute the column `name`.
+    """
+    if name in statfuns:
+        return list(statfuns[name][1:])
+    return [name]
+
+
+def is_column(name):
+    """
+    Returns `True` if and only if `name` can be used as a column in a
+    `nflcmd.matrix.StatMatrix`.
+    """
+    return (name in statfuns or name == 'game_count'
+            or name in nflcmd._player_categories)
+
+
+class StatMatrix (object):
+    """
+    A matrix of aggregate statistics with one row for each player.
+    """
+    @staticmethod
+    def load(db, cats, years, stype, week_range=None, pos=None, teams=None):
+        """
+        Loads a matrix with a column for each statistical category in
+        `cats` using a single query. Each row contains the totals for a
+        player over the games in the given seasons, season phase and
+        optional range of weeks. Rows may be restricted to players
+        currently at one of the positions in `pos` or on one of the
+        teams in `teams`.
+
+        The `game_count` column is always loaded. The per-game totals
+        maintained by `nflcmd.aggtables` are used when they're fresh.
+        """
+        cats = [c for c in nflcmd._player_categories if c in set(cats)]
+        where, params = nflcmd._game_where(years, stype, week_range)
+        join_player = ''
+        if pos or teams:
+            join_player = '''
+                JOIN player ON player.player_id = play_player.player_id
+            '''
+        if pos:
+            where += ' AND player.position IN %s'
+            params.append(tuple(str(nfldb.Enums.player_pos[p])
+                                for p in pos))
+        if teams:
+            where += ' AND player.team IN %s'
+            params.append(tuple(teams))
+        q = '''
+            SELECT play_player.player_id,
+                   COUNT(DISTINCT play_player.gsis_id) AS game_count
+                   {sums}
+            FROM {play_player}
+            JOIN game ON game.gsis_id = play_player.gsis_id
+            {join_player}
+            WHERE {where}
+            GROUP BY play_player.player_id
+        '''.format(sums=''.join(', SUM(play_player.%s)' % c for c in cats),
+                   join_player=join_player, where=where,
+                   play_player=nflcmd.aggtables.play_player_table(
+                       db, nflcmd._seasons(years, stype)))
+        with profile.query() as pq:
+            with nfldb.Tx(db, factory=tuple_cursor) as cursor:
+                cursor.execute(q, params)
+                rows = cursor.fetchall()
+            pq.rows = len(rows)
+
+        player_ids = [r[0] for r in rows]
+        data = np.array([r[1:] for r in rows], dtype=float)
+        data = data.reshape((len(rows), len(cats) + 1))
+        return StatMatrix(player_ids, ['game_count'] + cats, data)
+
+    def __init__(self, player_ids, cats, data):
+        self.player_ids = player_ids
+        """The player identifiers corresponding to each row."""
+        self.cats = cats
+        """The names of each column in `data`."""
+        self.data = data
+        """A two dimensional NumPy array of statistics."""
+        self._index = dict((c, i) for i, c in enumerate(cats))
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def column(self, name):
+        """
+        Returns the column for `name`, which may be any of the loaded
+        statistical categories or a key in `nflcmd.matrix.statfuns`.
+        """
+        if name in statfuns:
+            f = statfuns[name][0]
+            return f(*[self.column(c) for c in statfuns[name][1:]])
+        return self.data[:, self._index[name]]
+
+    def qualified(self, mins):
+        """
+        Returns a boolean mask of the players with at least the value
+        given in the dictionary `mins` for each of its columns.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, lo in mins.items():
+            mask &= self.column(name) >= lo
+        return mask
+
+    def top(self, keys, k, mask=None):
+        """
+        Returns the row indices of the `k` best players when sorted
+        (in descending order) on the columns in `keys`. Later keys
+        break ties in earlier keys. If `mask` is given, then only rows
+        with a `True` value in `mask` are considered.
+
+        The candidates are first narrowed to the players that are in
+        the top `k` of the first key (including ties) in linear time,
+        so that only those candidates need to be sorted.
+        """
+        cols = [self.column(name) for name in keys]
+        idx = np.arange(len(self))
+        if mask is not None:
+            idx = np.flatnonzero(mask)
+        if len(idx) > k > 0:
+            first = cols[0][idx]
+            kth = first[np.argpartition(-first, k - 1)[:k]].min()
+            idx = idx[first >= kth]
+        order = np.lexsort([-c[idx] for c in reversed(cols)])
+        return idx[order][:k]
+
+    def pstat(self, db, i):
+        """
+        Returns an aggregate `nfldb.PlayPlayer` object for the player
+        in row `i` containing each of the loaded statistical
+        categories.
+        """
+        stats = {}
+        for c, v in zip(self.cats, self.data[i]):
+            if c != 'game_count' and v != 0:
+                stats[c] = int(v) if v == int(v) else v
+        return nfldb.PlayPlayer(db, None, None, None, self.player_ids[i],
+                                None, stats)
@@ -0,0 +1,367 @@
+"""
+Module nflcmd.names provides a local index of player names that is
+used by `nflcmd.search` instead of running a fuzzy search over the
+entire player table in PostgreSQL. The index supports exact, prefix,
+Levenshtein (narrowed by trigrams) and Soundex lookups, each of which
+can be restricted to a team or position.
+
+The index is built from the player table with a single query and then
+saved next to the query cache (see `nflcmd.cache.cache_path`), so that
+later processes only need to load it from disk. It is rebuilt
+automatically when nfldb's roster has changed (i.e., when
+`meta.last_roster_download` or the number of players changes), or on
+demand with `nflcmd.names.refresh`.
+"""
+from __future__ import absolute_import, division, print_function
+import bisect
+import hashlib
+import os
+import os.path as path
+import threading
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+import nfldb
+
+from nflcmd import cache, profile
+
+version = 1
+"""
+The version of the on disk format of the index. Indexes saved with a
+different version are rebuilt.
+"""
+
+candidates = 100
+"""
+The number of players, chosen by trigram similarity, whose Levenshtein
+distance is computed for each fuzzy lookup.
+"""
+
+_indexes = {}
+_stamps = {}
+_lock = threading.Lock()
+
+
+def index(db):
+    """
+    Returns the `nflcmd.names.NameIndex` for the database connection
+    `db`. The index is loaded from disk (or built) the first time it's
+    needed and rebuilt whenever the roster in nfldb changes. Whether
+    the roster has changed is checked at most once every
+    `nflcmd.cache.stamp_ttl` seconds.
+    """
+    stamp = roster_stamp(db)
+    with _lock:
+        idx = _indexes.get(db.dsn)
+        if idx is None or idx.stamp != stamp:
+            idx = NameIndex.load(index_path(db))
+        if idx is None or idx.stamp != stamp:
+            idx = NameIndex.build(db, stamp)
+            idx.save(index_path(db))
+        _indexes[db.dsn] = idx
+        return idx
+
+
+def refresh(db):
+    """
+    Rebuilds the index for the database connection `db` from the
+    player table, regardless of whether the roster has changed.
+    """
+    _stamps.pop(db, None)
+    stamp = roster_stamp(db)
+    with _lock:
+        idx = NameIndex.build(db, stamp)
+        idx.save(index_path(db))
+        _indexes[db.dsn] = idx
+    return idx
+
+
+def index_path(db):
+    """
+    Returns the file path of the saved index for the database
+    connection `db`.
+    """
+    dsn = hashlib.sha1(db.dsn.encode('utf-8')).hexdigest()[:16]
+    return path.join(path.dirname(cache.cache_path()), 'names-%s.pickle' % dsn)
+
+
+def roster_stamp(db):
+    """
+    Returns a value that changes whenever the player table in nfldb
+    changes: the time of the last roster download paired with the
+    number of players.
+    """
+    fetched, stamp = _stamps.get(db, (0, None))
+    if stamp is None or time.time() - fetched > cache.stamp_ttl:
+        q = '''
+            SELECT (SELECT last_roster_download FROM meta) AS downloaded,
+                   (SELECT COUNT(*) FROM player) AS players
+        '''
+        with profile.query() as pq:
+            with nfldb.Tx(db) as cursor:
+                cursor.execute(q)
+                row = cursor.fetchone()
+            pq.rows = 1
+        stamp = (str(row['downloaded']), row['players'])
+        _stamps[db] = (time.time(), stamp)
+    return stamp
+
+
+class NameIndex (object):
+    """
+    An in-memory index of every player's name. Lookups return the
+    rows of the player table, which can be turned into `nfldb.Player`
+    objects with `nflcmd.names.NameIndex.player`.
+    """
+    @staticmethod
+    def build(db, stamp):
+        """
+        Builds a new index from the player table with one query.
+        """
+        q = 'SELECT %s FROM player ORDER BY full_name, player_id' \
+            % nfldb.select_columns(nfldb.Player)
+        with profile.query() as pq:
+            with nfldb.Tx(db) as cursor:
+                cursor.execute(q)
+                rows = [dict(r) for r in cursor.fetchall()]
+            pq.rows = len(rows)
+        return NameIndex(stamp, rows)
+
+    @staticmethod
+    def load(fpath):
+        """
+        Loads a saved index from `fpath`. If it doesn't exist or can't
+        be read, then `None` is returned.
+        """
+        try:
+            with open(fpath, 'rb') as f:
+                saved = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, pickle.PickleError):
+            return None
+        if not isinstance(saved, dict) or saved.get('version') != version:
+            return None
+        idx = NameIndex.__new__(NameIndex)
+        idx.__dict__.update(saved['index'])
+        return idx
+
+    def __init__(self, stamp, rows):
+        self.stamp = stamp
+        self.rows = [cache._encode(r) for r in rows]
+        self.names = [_normalize(r['full_name']) for r in rows]
+        self.teams = [str(r['team']) for r in rows]
+        self.positions = [str(r['position']) for r in rows]
+
+        self.full = {}
+        self.parts = {}
+        self.soundexes = []
+        self.trigrams = {}
+        prefixes = []
+        for i, r in enumerate(rows):
+            name = self.names[i]
+            self.full.setdefault(name, []).append(i)
+            for part in (r['first_name'], r['last_name']):
+                self.parts.setdefault(_normalize(part), []).append(i)
+            prefixes.append((name, i))
+            prefixes.append((_normalize(r['last_name']), i))
+            self.soundexes.append(soundex(name))
+            for tri in set(trigrams(name)):
+                self.trigrams.setdefault(tri, []).append(i)
+        prefixes.sort()
+        self.prefix_keys = [k for k, _ in prefixes]
+        self.prefix_ids = [i for _, i in prefixes]
+
+    def save(self, fpath):
+        """
+        Saves the index to `fpath`. Failures are silently ignored,
+        since the index can always be rebuilt.
+        """
+        saved = {'version': version, 'index': self.__dict__}
+        tmp = '%s.%d.tmp' % (fpath, os.getpid())
+        try:
+            if not path.isdir(path.dirname(fpath)):
+                os.makedirs(path.dirname(fpath))
+            with open(tmp, 'wb') as f:
+                pickle.dump(saved, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, fpath)
+        except (IOError, OSError):
+            pass
+
+    def __len__(self):
+        return len(self.rows)
+
+    def player(self, db, i):
+        """
+        Returns the `nfldb.Player` object for the player at index `i`.
+        """
+        return nfldb.Player.from_row(db, cache._decode(self.rows[i]))
+
+    def exact(self, name, team=None, pos=None):
+        """
+        Returns the indices of players whose full name is `name`,
+        ignoring case and extra whitespace.
+        """
+        return self._filter(self.full.get(_normalize(name), []), team, pos)
+
+    def first_or_last(self, name, team=None, pos=None):
+        """
+        Returns the indices of players whose first or last name is
+        `name`, ignoring case.
+        """
+        return self._filter(self.parts.get(_normalize(name), []), team, pos)
+
+    def prefix(self, name, team=None, pos=None):
+        """
+        Returns the indices of players whose full name or last name
+        starts with `name`, ignoring case, sorted by name.
+        """
+        name = _normalize(name)
+        if len(name) == 0:
+            return self._filter(range(len(self)), team, pos)
+        # The first string after every string with `name` as a prefix.
+        end = name[:-1] + unichr(ord(name[-1]) + 1)
+        lo = bisect.bisect_left(self.prefix_keys, name)
+        hi = bisect.bisect_left(self.prefix_keys, end)
+        seen, ids = set(), []
+        for i in self.prefix_ids[lo:hi]:
+            if i not in seen:
+                seen.add(i)
+                ids.append(i)
+        return self._filter(ids, team, pos)
+
+    def fuzzy(self, name, team=None, pos=None, limit=1):
+        """
+        Returns up to `limit` pairs of player indices and Levenshtein
+        distances, sorted by distance. Only the `nflcmd.names.candidates`
+        players with the most trigrams in common with `name` are
+        compared, unless no player has any trigrams in common, in which
+        case every player is compared.
+        """
+        name = _normalize(name)
+        grams = set(trigrams(name))
+        counts = {}
+        for tri in grams:
+            for i in self.trigrams.get(tri, []):
+                counts[i] = counts.get(i, 0) + 1
+        ids = self._filter(counts, team, pos)
+        if len(ids) == 0:
+            ids = self._filter(range(len(self)), team, pos)
+        elif len(ids) > candidates:
+            ids.sort(key=lambda i: (-counts[i], i))
+            ids = ids[:candidates]
+        scored = [(levenshtein(name, self.names[i]), i) for i in ids]
+        scored.sort()
+        return [(i, d) for d, i in scored[:limit]]
+
+    def soundex(self, name, team=None, pos=None, limit=1):
+        """
+        Returns up to `limit` pairs of player indices and Soundex
+        differences (an integer in `[0, 4]`, where `4` is the most
+        similar), sorted by difference and then Levenshtein distance.
+        This is the same measure as PostgreSQL's `difference`
+        function.
+        """
+        name = _normalize(name)
+        code = soundex(name)
+        scored = []
+        for i in self._filter(range(len(self)), team, pos):
+            diff = difference(code, self.soundexes[i])
+            if diff > 0:
+                scored.append((-diff, i))
+        scored.sort()
+        best = [i for _, i in scored[:max(limit, candidates)]]
+        best.sort(key=lambda i: (-difference(code, self.soundexes[i]),
+                                 levenshtein(name, self.names[i]), i))
+        return [(i, difference(code, self.soundexes[i]))
+                for i in best[:limit]]
+
+    def _filter(self, ids, team, pos):
+        team = None if team is None else str(team)
+        pos = None if pos is None else str(pos)
+        return [i for i in ids
+                if (team is None or self.teams[i] == team)
+                and (pos is None or self.positions[i] == pos)]
+
+
+def trigrams(s):
+    """
+    Returns the trigrams of each word in `s`, where each word is padded
+    with two spaces in front and one behind (like PostgreSQL's
+    `pg_trgm` extension).
+    """
+    grams = []
+    for word in s.split():
+        word = '  %s ' % word
+        grams.extend(word[i:i+3] for i in range(len(word) - 2))
+    return grams
+
+
+def levenshtein(a, b):
+    """
+    Returns the Levenshtein distance between the strings `a` and `b`.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j-1] + 1,
+                           prev[j-1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+_soundex_codes = '01230120022455012623010202'
+
+
+def soundex(s):
+    """
+    Returns the four character Soundex code of `s`, computed the same
+    way as PostgreSQL's `soundex` function. Characters other than
+    ASCII letters are skipped.
+    """
+    def letter(c):
+        return 'A' <= c.upper() <= 'Z'
+
+    def code(c):
+        if letter(c):
+            return _soundex_codes[ord(c.upper()) - ord('A')]
+        return c
+
+    while len(s) > 0 and not letter(s[0]):
+        s = s[1:]
+    if len(s) == 0:
+        return ''
+    out = [s[0].upper()]
+    for prev, c in zip(s, s[1:]):
+        if len(out) == 4:
+            break
+        if letter(c) and code(c) != code(prev) and code(c) != '0':
+            out.append(code(c))
+    return ''.join(out).ljust(4, '0')
+
+
+def difference(a, b):
+    """
+    Returns the number of positions at which the Soundex codes `a` and
+    `b` agree.
+    """
+    return sum(1 for x, y in zip(a, b) if x == y)
+
+
+def _normalize(s):
+    """
+    Returns `s` as lowercase text with runs of whitespace collapsed.
+    """
+    if isinstance(s, bytes):
+        s = s.decode('utf-8', 'replace')
+    return u' '.join((s or u'').lower().split())
@@ -0,0 +1,87 @@
+"""
+Module nflcmd.pool provides a bounded pool of nfldb database
+connections that can be shared by many threads.
+"""
+from __future__ import absolute_import, division, print_function
+from contextlib import contextmanager
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import nfldb
+
+
+class ConnectionPool (object):
+    """
+    A thread safe pool of at most `size` connections. Connections are
+    opened lazily with `connect` (which defaults to `nfldb.connect`)
+    and reused until they are closed.
+    """
+    def __init__(self, size, connect=None):
+        assert size >= 1
+        self.size = size
+        self._connect = nfldb.connect if connect is None else connect
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    @contextmanager
+    def connection(self):
+        """
+        A context manager that yields a connection from the pool,
+        blocking until one is available. The connection is returned
+        to the pool when the block exits.
+        """
+        db = self._acquire()
+        try:
+            yield db
+        finally:
+            self._release(db)
+
+    def close(self):
+        """
+        Closes every idle connection in the pool.
+        """
+        while True:
+            try:
+                db = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            db.close()
+            with self._lock:
+                self._opened -= 1
+
+    def _acquire(self):
+        with self._lock:
+            opened = self._opened < self.size and self._idle.empty()
+            if opened:
+                self._opened += 1
+        if opened:
+            db = None
+            try:
+                db = self._connect()
+            finally:
+                # Give up the slot if connecting failed or was
+                # interrupted.
+                if db is None:
+                    with self._lock:
+                        self._opened -= 1
+            return db
+        db = self._idle.get()
+        if db.closed:
+            fresh = None
+            try:
+                fresh = self._connect()
+            finally:
+                # Keep the closed connection's slot in the pool, so the
+                # next caller tries to reconnect.
+                if fresh is None:
+                    self._idle.put(db)
+            db = fresh
+        return db
+
+    def _release(self, db):
+        self._idle.put(db)
@@ -0,0 +1,302 @@
+"""
+Module nflcmd.profile records where the time of a command goes. When a
+`nflcmd.profile.Recorder` is active, every query issued by nflcmd is
+recorded along with its wall time, the number of rows it returned and
+the nflcmd function that issued it. Commands also mark their phases
+(e.g., searching for a player, loading statistics and formatting
+output), so that time spent outside of queries can be accounted for.
+
+Recording is per thread and costs almost nothing when no recorder is
+active. A typical use looks like:
+
+    rec = nflcmd.profile.start()
+    try:
+        with nflcmd.profile.phase('load'):
+            ...
+    finally:
+        nflcmd.profile.stop()
+    rec.write_report(sys.stderr)
+"""
+from __future__ import absolute_import, division, print_function
+from contextlib import contextmanager
+import json
+import sys
+import threading
+import time
+
+_local = threading.local()
+
+
+def start():
+    """
+    Starts recording the queries and phases of the current thread
+    with a new `nflcmd.profile.Recorder`, which is returned.
+    """
+    rec = Recorder()
+    _local.recorder = rec
+    return rec
+
+
+def stop():
+    """
+    Stops recording in the current thread and returns the recorder
+    that was active (or `None`).
+    """
+    rec = active()
+    _local.recorder = None
+    return rec
+
+
+def active():
+    """
+    Returns the active `nflcmd.profile.Recorder` of the current thread,
+    or `None` if the thread isn't being profiled.
+    """
+    return getattr(_local, 'recorder', None)
+
+
+@contextmanager
+def use(rec):
+    """
+    A context manager that makes `rec` the active recorder of the
+    current thread. This is used to record the queries of worker
+    threads with the recorder of the thread that started them.
+    """
+    old = active()
+    _local.recorder = rec
+    try:
+        yield rec
+    finally:
+        _local.recorder = old
+
+
+@contextmanager
+def command(report, json_path=None):
+    """
+    A context manager that profiles the block it contains when
+    `report` is true or `json_path` is set. When the block exits, a
+    human readable breakdown is written to stderr if `report` is true
+    and the full report is written as JSON to the file `json_path` if
+    it's given.
+    """
+    if not report and json_path is None:
+        yield None
+        return
+    rec = start()
+    try:
+        yield rec
+    finally:
+        stop()
+        if report:
+            rec.write_report(sys.stderr)
+        if json_path is not None:
+            with open(json_path, 'w') as f:
+                rec.write_json(f)
+
+
+def phase(name):
+    """
+    Returns a context manager that attributes the time and queries
+    inside of it to the phase `name`.
+    """
+    rec = active()
+    if rec is None:
+        return _null
+    return _Phase(rec, name)
+
+
+def query():
+    """
+    Returns a context manager that records a query issued inside of
+    it. Set the `rows` attribute of the value it yields to the number
+    of rows returned by the query.
+    """
+    rec = active()
+    if rec is None:
+        return _null
+    return _Query(rec, _caller())
+
+
+def hit(rows):
+    """
+    Records a query whose `rows` results were found in
+    `nflcmd.cache`.
+    """
+    rec = active()
+    if rec is not None:
+        rec.add(_caller(), 0.0, rows, True)
+
+
+class Recorder (object):
+    """
+    A record of the queries and phases of a command.
+    """
+    def __init__(self):
+        self.started = time.time()
+        """The time that recording started."""
+        self.queries = []
+        """
+        A list of dictionaries, one for each query, with the keys
+        `phase`, `caller`, `seconds`, `rows` and `cached`.
+        """
+        self.phases = []
+        """A list of phase names in the order they first started."""
+        self.phase_seconds = {}
+        """A dictionary mapping phase names to their wall time."""
+        self._lock = threading.Lock()
+        self._phase = None
+
+    def add(self, caller, seconds, rows, cached=False):
+        """Records a query."""
+        with self._lock:
+            self.queries.append({
+                'phase': self._phase, 'caller': caller, 'seconds': seconds,
+                'rows': rows, 'cached': cached,
+            })
+
+    def report(self):
+        """
+        Returns a dictionary summarizing the queries by phase and by
+        calling function, along with every query recorded.
+        """
+        def empty():
+            return {'queries': 0, 'cache_hits': 0, 'seconds': 0.0, 'rows': 0}
+
+        def summary(key):
+            sums = {}
+            for q in self.queries:
+                s = sums.setdefault(q[key], empty())
+                s['cache_hits' if q['cached'] else 'queries'] += 1
+                s['seconds'] += q['seconds']
+                s['rows'] += q['rows']
+            return sums
+
+        by_phase = summary('phase')
+        phases = []
+        for name in self.phases + [None]:
+            if name is None and None not in by_phase:
+                continue
+            s = by_phase.get(name, empty())
+            phases.append({
+                'phase': name or '(none)',
+                'seconds': self.phase_seconds.get(name),
+                'queries': s['queries'], 'cache_hits': s['cache_hits'],
+                'query_seconds': s['seconds'], 'rows': s['rows'],
+            })
+        callers = []
+        for name, c in sorted(summary('caller').items()):
+            callers.append(dict(c, caller=name))
+        return {
+            'seconds': time.time() - self.started,
+            'queries': sum(1 for q in self.queries if not q['cached']),
+            'cache_hits': sum(1 for q in self.queries if q['cached']),
+            'query_seconds': sum(q['seconds'] for q in self.queries),
+            'phases': phases,
+            'callers': callers,
+            'log': self.queries,
+        }
+
+    def write_report(self, out=None):
+        """
+        Writes a human readable breakdown of `report` to `out`, which
+        defaults to `sys.stderr`.
+        """
+        import nflcmd
+
+        out = sys.stderr if out is None else out
+        r = self.report()
+
+        def ms(s):
+            return '-' if s is None else '%0.1f' % (1000 * s)
+
+        rows = [['Phase', 'Time (ms)', 'Queries', 'Cached', 'SQL (ms)',
+                 'Rows']]
+        for p in r['phases']:
+            rows.append([p['phase'], ms(p['seconds']), p['queries'],
+                         p['cache_hits'], ms(p['query_seconds']), p['rows']])
+        rows.append(['total', ms(r['seconds']), r['queries'],
+                     r['cache_hits'], ms(r['query_seconds']),
+                     sum(p['rows'] for p in r['phases'])])
+        nflcmd.write_table(rows, out)
+        out.write('\n')
+
+        rows = [['Caller', 'Queries', 'Cached', 'SQL (ms)', 'Rows']]
+        for c in r['callers']:
+            rows.append([c['caller'], c['queries'], c['cache_hits'],
+                         ms(c['seconds']), c['rows']])
+        nflcmd.write_table(rows, out)
+
+    def write_json(self, out):
+        """Writes `report` to `out` as JSON."""
+        json.dump(self.report(), out, indent=2, sort_keys=True)
+        out.write('\n')
+
+
+class _Phase (object):
+    def __init__(self, rec, name):
+        self._rec = rec
+        self._name = name
+
+    def __enter__(self):
+        with self._rec._lock:
+            self._outer = self._rec._phase
+            self._rec._phase = self._name
+            if self._name not in self._rec.phase_seconds:
+                self._rec.phases.append(self._name)
+                self._rec.phase_seconds[self._name] = 0.0
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.time() - self._start
+        with self._rec._lock:
+            self._rec.phase_seconds[self._name] += elapsed
+            self._rec._phase = self._outer
+        return False
+
+
+class _Query (object):
+    def __init__(self, rec, caller):
+        self._rec = rec
+        self._caller = caller
+        self.rows = 0
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self._rec.add(self._caller, time.time() - self._start, self.rows)
+        return False
+
+
+class _Null (object):
+    """A context manager that does nothing."""
+    rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, k, v):
+        pass
+
+
+_null = _Null()
+
+_internal = ('nflcmd.cache', 'nflcmd.profile')
+
+
+def _caller():
+    """
+    Returns the name of the nflcmd function that is issuing a query,
+    skipping over the functions in this module and in `nflcmd.cache`.
+    """
+    f = sys._getframe(1)
+    while f is not None and f.f_globals.get('__name__') in _internal:
+        f = f.f_back
+    if f is None:
+        return '(unknown)'
+    return '%s.%s' % (f.f_globals.get('__name__'), f.f_code.co_name)
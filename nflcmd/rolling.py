@@ -0,0 +1,244 @@
+"""
+Module nflcmd.rolling computes statistics over rolling windows of
+weeks, like a player's totals over the last four weeks as of every
+week of a season.
+
+Every window is computed from a single list of per-week totals, which
+is fetched with one query. As the window slides forward one week at a
+time, the week entering it is added to the running totals and the
+week leaving it is subtracted, so the cost of computing every window
+doesn't depend on the size of the window.
+"""
+from __future__ import absolute_import, division, print_function
+from collections import deque
+import heapq
+
+import nfldb
+
+import nflcmd
+from nflcmd import aggtables, cache, matrix
+
+
+def windows(weeks, n, fg_hists=False):
+    """
+    Given a list of `(index, stats)` pairs sorted by `index`, where
+    `index` is the position of a week (e.g., the week number within a
+    season) and `stats` is a dictionary of statistics, generates a
+    `(start, end, totals, count)` tuple for each pair. `totals` is a
+    new dictionary with the sums of the statistics of every pair in the
+    window of `n` weeks ending with that pair's week. `start` and `end`
+    are the indices of the first and last pairs in the window and
+    `count` is the number of pairs in it.
+
+    If `fg_hists` is `True`, then each element of `weeks` is a triple
+    that also has a `nflcmd.FieldGoals` histogram, and each tuple
+    generated has a fifth element: a new histogram with the sum of the
+    histograms in the window. It slides along with the statistics.
+
+    Weeks without a pair (e.g., a bye week) count toward the length of
+    a window, but contribute nothing to it.
+    """
+    window = deque()
+    totals = {}
+    hist = nflcmd.FieldGoals()
+    for week in weeks:
+        index, stats = week[0], week[1]
+        while len(window) > 0 and window[0][0] <= index - n:
+            old = window.popleft()
+            for k, v in old[1].items():
+                totals[k] -= v
+            if fg_hists:
+                hist -= old[2]
+        window.append(week)
+        for k, v in stats.items():
+            totals[k] = totals.get(k, 0) + v
+        if fg_hists:
+            hist += week[2]
+            yield (window[0][0], index, dict(totals), len(window),
+                   hist.copy())
+        else:
+            yield window[0][0], index, dict(totals), len(window)
+
+
+class Window (nflcmd.Game):
+    """
+    A row of player statistics for a single game, where the statistics
+    are the player's totals over a window of weeks ending with the
+    week of the game. The field goal columns are totals too.
+    """
+    __slots__ = []
+
+
+class Average (Window):
+    """
+    Like `nflcmd.rolling.Window`, except the statistics are averaged
+    over the games in the window. (The field goal columns are still
+    totals.)
+    """
+    __slots__ = []
+
+
+def game_windows(db, rows, n, average=False):
+    """
+    Returns a list of `nflcmd.rolling.Window` objects for the game log
+    `rows` (a list of `nflcmd.Game` objects in a single season, as
+    returned by `nflcmd.game_log`), one for each game. If `average` is
+    `True`, then `nflcmd.rolling.Average` objects are returned instead.
+    Every statistical category of an average is a float, even when
+    it's zero.
+    """
+    cls = Average if average else Window
+    weeks = [(row.week, row.stats, row.fg_hist) for row in rows]
+    slides = windows(weeks, n, fg_hists=True)
+    out = []
+    for row, (_, _, totals, count, hist) in zip(rows, slides):
+        if average:
+            stats = dict((c, totals.get(c, 0) / count)
+                         for c in nflcmd._player_categories)
+        else:
+            stats = dict((k, v) for k, v in totals.items() if v != 0)
+        pstat = nfldb.PlayPlayer(db, row.gsis_id, None, None,
+                                 row.player_id, row.team, stats)
+        win = cls(db, row, row.team, pstat)
+        win._fg_hist = hist
+        out.append(win)
+    return out
+
+
+class Stretch (object):
+    """
+    A row of player statistics with a player's totals over a
+    consecutive stretch of weeks. The `window` column describes the
+    weeks and `game_count` is the number of games in them.
+    """
+    __slots__ = ['player_id', 'player', 'start', 'end', 'stats']
+
+    def __init__(self, player_id, start, end, stats, player=None):
+        self.player_id = player_id
+        self.player = player
+        self.start = start
+        """The `(season_year, week)` of the first game in the stretch."""
+        self.end = end
+        """The `(season_year, week)` of the last game in the stretch."""
+        self.stats = stats
+
+    @property
+    def name(self):
+        return self.player.full_name
+
+    @property
+    def team(self):
+        return self.player.team
+
+    @property
+    def game_count(self):
+        return self.stats.get('game_count', 0)
+
+    @property
+    def window(self):
+        (y1, w1), (y2, w2) = self.start, self.end
+        if y1 != y2:
+            return '%d %d-%d %d' % (y1, w1, y2, w2)
+        if w1 == w2:
+            return str(w1)
+        return '%d-%d' % (w1, w2)
+
+    def __getattr__(self, k):
+        return self.stats.get(k, 0)
+
+
+def weekly_totals(db, cats, years, stype, weeks=None, pos=None, teams=None):
+    """
+    Returns a dictionary mapping player ids to a list of
+    `((season_year, week), stats)` pairs sorted by week, where `stats`
+    is a dictionary with the player's totals of the categories in
+    `cats` in that week, along with the number of games played in
+    `game_count`. Every player and week is fetched with one query,
+    using the per-game totals maintained by `nflcmd.aggtables` when
+    they're fresh.
+    """
+    cats = sorted(set(cats))
+    where, params = nflcmd._game_where(years, stype, weeks)
+    join_player = ''
+    if pos or teams:
+        join_player = '''
+            JOIN player ON player.player_id = play_player.player_id
+        '''
+    if pos:
+        where += ' AND player.position IN %s'
+        params.append(tuple(str(nfldb.Enums.player_pos[p]) for p in pos))
+    if teams:
+        where += ' AND player.team IN %s'
+        params.append(tuple(teams))
+
+    seasons = nflcmd._seasons(years, stype)
+    q = '''
+        SELECT play_player.player_id, game.season_year, game.week,
+               COUNT(DISTINCT play_player.gsis_id) AS game_count {sums}
+        FROM {play_player}
+        JOIN game ON game.gsis_id = play_player.gsis_id
+        {join_player}
+        WHERE {where}
+        GROUP BY play_player.player_id, game.season_year, game.week
+        ORDER BY play_player.player_id, game.season_year, game.week
+    '''.format(sums=''.join(', SUM(play_player.%s) AS %s' % (c, c)
+                            for c in cats),
+               play_player=aggtables.play_player_table(db, seasons),
+               join_player=join_player, where=where)
+    players = {}
+    for r in cache.fetchall(db, q, params, seasons):
+        stats = dict((c, r[c]) for c in ['game_count'] + cats)
+        players.setdefault(r['player_id'], []).append(
+            ((r['season_year'], r['week']), stats))
+    return players
+
+
+def best(db, cats, n, years, stype, weeks=None, pos=None, teams=None,
+         limit=10):
+    """
+    Returns a list of `nflcmd.rolling.Stretch` objects for the `limit`
+    players with the best totals over any `n` consecutive weeks, sorted
+    by the columns in `cats` in descending order (and then by player
+    id). Each player's best stretch is chosen the same way. Columns may
+    include derived statistics in `nflcmd.statfuns`, which are computed
+    from the totals of each stretch.
+
+    Every window ending with a week in which a player recorded a
+    statistic is considered. (A window ending with any other week has
+    a subset of the games of one of those.) Players without any of the
+    statistics in `cats` aren't ranked.
+    """
+    load = set()
+    for name in cats:
+        load.update(matrix.columns(name))
+    players = weekly_totals(db, load, years, stype, weeks, pos, teams)
+
+    # Seasons are laid end to end, so windows may span two seasons.
+    order = sorted(set(week for pweeks in players.values()
+                       for week, _ in pweeks))
+    index = dict((week, i) for i, week in enumerate(order))
+
+    candidates = []
+    for pid, pweeks in players.items():
+        top, topkey = None, None
+        indexed = [(index[week], stats) for week, stats in pweeks]
+        for start, end, totals, _ in windows(indexed, n):
+            s = Stretch(pid, order[start], order[end], totals)
+            key = tuple(_value(s, c) for c in cats)
+            if topkey is None or key > topkey:
+                top, topkey = s, key
+        if top is not None and any(topkey):
+            candidates.append((tuple(-v for v in topkey) + (pid,), top))
+
+    ranked = [s for _, s in heapq.nsmallest(limit, candidates)]
+    people = nflcmd._players_by_id(db, [s.player_id for s in ranked]) \
+        if len(ranked) > 0 else {}
+    for s in ranked:
+        s.player = people.get(s.player_id)
+    return ranked
+
+
+def _value(row, column):
+    if column in nflcmd.statfuns:
+        return nflcmd.statfuns[column](row)
+    return getattr(row, column)
@@ -0,0 +1,297 @@
+"""
+Module nflcmd.scoring ranks players by fantasy points computed from a
+scoring formula. A formula is read from a file with one term on each
+line. A term is either a weight on a statistic or a bonus awarded for
+each game in which a statistic reaches a threshold:
+
+    # Points per reception.
+    passing_yds         0.04
+    passing_tds         4
+    passing_int        -2
+    rushing_yds         0.1
+    rushing_tds         6
+    receiving_rec       1
+    receiving_yds       0.1
+    receiving_tds       6
+    fumbles_lost       -2
+    passing_yds >= 300  3
+    rushing_yds >= 100  3
+
+Statistics may be any player statistical category or any of the
+derived statistics in `nflcmd.statfuns`. Every term is evaluated on
+each game separately, and a player's score is the sum of their scores
+in each game.
+
+Terms on statistical categories are compiled into a single weighted
+SQL expression, so the database computes the points of every player
+in every game with one query. Terms on derived statistics, which the
+database can't compute, are added to the rows fetched. The same rows
+give both the per-week scores and the totals of every player, and the
+best players are chosen with a heap instead of sorting every player.
+"""
+from __future__ import absolute_import, division, print_function
+import heapq
+
+import nfldb
+
+import nflcmd
+from nflcmd import aggtables, cache, matrix
+
+
+def load(path):
+    """
+    Reads a `nflcmd.scoring.Formula` from the file at `path`. If the
+    file is malformed, a `ValueError` is raised with a message that
+    names the offending line.
+    """
+    with open(path) as f:
+        return parse(f, path)
+
+
+def parse(lines, name='<formula>'):
+    """
+    Returns a `nflcmd.scoring.Formula` from an iterable of lines. Blank
+    lines and everything after a `#` are ignored. `name` is used in
+    error messages.
+    """
+    weights, bonuses = [], []
+    for i, line in enumerate(lines, 1):
+        fields = line.split('#', 1)[0].split()
+        if len(fields) == 0:
+            continue
+
+        def err(msg):
+            return ValueError('%s:%d: %s' % (name, i, msg))
+        if len(fields) == 2:
+            stat, points = fields
+            threshold = None
+        elif len(fields) == 4 and fields[1] == '>=':
+            stat, _, threshold, points = fields
+        else:
+            raise err('expected "STAT POINTS" or "STAT >= N POINTS"')
+        if stat not in nflcmd._player_category_set \
+                and stat not in nflcmd.statfuns:
+            raise err('%s is not a valid statistical category' % stat)
+        try:
+            points = float(points)
+            if threshold is not None:
+                threshold = float(threshold)
+        except ValueError:
+            raise err('points and thresholds must be numbers')
+        if threshold is None:
+            weights.append((stat, points))
+        else:
+            bonuses.append((stat, threshold, points))
+    if len(weights) == 0 and len(bonuses) == 0:
+        raise ValueError('%s: the formula has no terms' % name)
+    return Formula(weights, bonuses)
+
+
+class Formula (object):
+    """
+    A fantasy scoring formula: a list of `(stat, points)` pairs giving
+    the points for each unit of a statistic and a list of
+    `(stat, threshold, points)` triples giving the points for each
+    game in which a statistic is at least `threshold`.
+    """
+    def __init__(self, weights, bonuses=None):
+        self.weights = list(weights)
+        self.bonuses = list(bonuses or [])
+
+    def sql(self, prefix='pg.'):
+        """
+        Returns a SQL expression and its parameters computing the
+        points of the terms on statistical categories. The categories
+        are read from columns of the same name, qualified by
+        `prefix`. If there are no such terms, the expression is `0`.
+        """
+        terms, params = [], []
+        for stat, points in self.weights:
+            if stat not in nflcmd.statfuns:
+                terms.append('%%s * %s%s' % (prefix, stat))
+                params.append(points)
+        for stat, threshold, points in self.bonuses:
+            if stat not in nflcmd.statfuns:
+                terms.append('CASE WHEN %s%s >= %%s THEN %%s ELSE 0 END'
+                             % (prefix, stat))
+                params += [threshold, points]
+        if len(terms) == 0:
+            return '0', []
+        return 'CAST(%s AS double precision)' % ' + '.join(terms), params
+
+    def derived(self):
+        """
+        Returns the sorted list of statistical categories needed to
+        compute the terms on derived statistics.
+        """
+        cats = set()
+        for stat in self.stats():
+            if stat in nflcmd.statfuns:
+                cats.update(matrix.columns(stat))
+        return sorted(cats)
+
+    def stats(self):
+        """
+        Returns the set of statistics used by every term.
+        """
+        return set([w[0] for w in self.weights]
+                   + [b[0] for b in self.bonuses])
+
+    def derived_points(self, stats):
+        """
+        Returns the points of the terms on derived statistics for a
+        single game, where `stats` is a dictionary of the game's
+        statistical categories.
+        """
+        p = _Stats(stats)
+        total = 0.0
+        for stat, points in self.weights:
+            if stat in nflcmd.statfuns:
+                total += points * nflcmd.statfuns[stat](p)
+        for stat, threshold, points in self.bonuses:
+            if stat in nflcmd.statfuns:
+                if nflcmd.statfuns[stat](p) >= threshold:
+                    total += points
+        return total
+
+
+class PlayerScore (object):
+    """
+    The fantasy points of a single player, in total and for each week,
+    along with the totals of any statistical categories that were
+    loaded with them.
+    """
+    __slots__ = ['player_id', 'total', 'weeks', 'stats']
+
+    def __init__(self, player_id):
+        self.player_id = player_id
+        self.total = 0.0
+        self.weeks = {}
+        """A dictionary mapping `(season_year, week)` pairs to points."""
+        self.stats = {}
+
+    def pstat(self, db):
+        """
+        Returns an aggregate `nfldb.PlayPlayer` object with the totals
+        of the loaded statistical categories.
+        """
+        stats = dict((c, v) for c, v in self.stats.items() if v != 0)
+        return nfldb.PlayPlayer(db, None, None, None, self.player_id, None,
+                                stats)
+
+
+def scores(db, formula, years, stype, weeks=None, pos=None, teams=None,
+           cats=None):
+    """
+    Returns a dictionary mapping player ids to `nflcmd.scoring.PlayerScore`
+    objects for every player with a statistic in the given seasons,
+    season phase and optional range of weeks. Players may be restricted
+    to those currently at one of the positions in `pos` or on one of
+    the teams in `teams`. The totals of the statistical categories in
+    `cats` are loaded too.
+
+    Every player's points in every game are fetched with one query.
+    The per-game totals maintained by `nflcmd.aggtables` are used when
+    they're fresh.
+    """
+    cats = sorted(set(cats or []) | set(formula.derived()))
+    sums = sorted(set(cats) | set(s for s in formula.stats()
+                                  if s not in nflcmd.statfuns))
+    where, params = nflcmd._game_where(years, stype, weeks)
+    join_player = ''
+    if pos or teams:
+        join_player = '''
+            JOIN player ON player.player_id = play_player.player_id
+        '''
+    if pos:
+        where += ' AND player.position IN %s'
+        params.append(tuple(str(nfldb.Enums.player_pos[p]) for p in pos))
+    if teams:
+        where += ' AND player.team IN %s'
+        params.append(tuple(teams))
+
+    seasons = nflcmd._seasons(years, stype)
+    points, points_params = formula.sql()
+    q = '''
+        SELECT pg.player_id, pg.season_year, pg.week,
+               {points} AS points {columns}
+        FROM (
+            SELECT play_player.player_id, play_player.gsis_id,
+                   game.season_year, game.week, {sums}
+            FROM {play_player}
+            JOIN game ON game.gsis_id = play_player.gsis_id
+            {join_player}
+            WHERE {where}
+            GROUP BY play_player.player_id, play_player.gsis_id,
+                     game.season_year, game.week
+        ) AS pg
+    '''.format(points=points,
+               columns=''.join(', pg.%s' % c for c in cats),
+               sums=', '.join('SUM(play_player.%s) AS %s' % (c, c)
+                              for c in sums),
+               play_player=aggtables.play_player_table(db, seasons),
+               join_player=join_player, where=where)
+
+    derived = len(formula.derived()) > 0
+    players = {}
+    for r in cache.fetchall(db, q, points_params + params, seasons):
+        pid = r['player_id']
+        ps = players.get(pid)
+        if ps is None:
+            ps = players[pid] = PlayerScore(pid)
+        pts = r['points']
+        if derived:
+            pts += formula.derived_points(r)
+        week = (r['season_year'], r['week'])
+        ps.weeks[week] = ps.weeks.get(week, 0.0) + pts
+        ps.total += pts
+        for c in cats:
+            ps.stats[c] = ps.stats.get(c, 0) + r[c]
+    return players
+
+
+def top(scores, limit):
+    """
+    Returns a list of the `limit` best `nflcmd.scoring.PlayerScore`
+    objects in `scores` (a dictionary like the one returned by
+    `nflcmd.scoring.scores`), sorted by total points in descending
+    order and then by player id.
+    """
+    return heapq.nsmallest(limit, scores.values(),
+                           key=lambda ps: (-ps.total, ps.player_id))
+
+
+class Scored (object):
+    """
+    A row of player statistics (e.g., a `nflcmd.Totals`) along with a
+    player's fantasy points, which are available in the `score`
+    column. The points of a single week are available in columns
+    named `w` followed by the week number (e.g., `w5`), which assumes
+    that the points are from a single season. Every other column is
+    read from the row.
+    """
+    __slots__ = ['_row', 'score', '_weeks']
+
+    def __init__(self, row, ps):
+        self._row = row
+        self.score = ps.total
+        self._weeks = dict((week, pts) for (_, week), pts in ps.weeks.items())
+
+    def __getattr__(self, k):
+        if k.startswith('w') and k[1:].isdigit():
+            return self._weeks.get(int(k[1:]), 0.0)
+        return getattr(self._row, k)
+
+
+class _Stats (object):
+    """
+    Exposes a dictionary of statistics as attributes for
+    `nflcmd.statfuns`. Missing statistics are zero.
+    """
+    __slots__ = ['_stats']
+
+    def __init__(self, stats):
+        self._stats = stats
+
+    def __getattr__(self, k):
+        return self._stats.get(k, 0)
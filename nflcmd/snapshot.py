@@ -0,0 +1,590 @@
+"""
+Module nflcmd.snapshot writes and reads snapshots of nfldb: compact
+files with everything `nflstats` and `nflrank` need to run without a
+database. A snapshot is written with `nflcmd snapshot` and used with
+the `--snapshot` flag of either command.
+
+A snapshot contains, for each season phase of each year:
+
+* The per-game totals of every player statistical category for every
+  player, stored column by column. Each column is a packed array of
+  32 bit integers (or floats, for real valued categories), and
+  columns that are zero for every player in a season aren't stored.
+* The games, which are used for game logs.
+* The distance of every field goal attempt.
+
+Along with the player table, which is used to search for players.
+
+The file is memory mapped when it's opened, and nothing is read until
+it's needed: a column is a NumPy array that refers directly to the
+mapped file (so no copy is made), and only the seasons and columns
+used by a command are ever touched. Metadata (the list of columns,
+games and players) is pickled, and each season's metadata is only
+unpickled when the season is used.
+
+This module requires [NumPy](http://www.numpy.org). If NumPy isn't
+installed, `nflcmd.snapshot.available` is `False`.
+"""
+from __future__ import absolute_import, division, print_function
+import mmap
+import os
+import struct
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import nfldb
+
+import nflcmd
+from nflcmd import cache, matrix, names
+
+available = np is not None
+"""
+Whether NumPy is installed.
+"""
+
+magic = b'NFLCMDSS'
+"""The first bytes of every snapshot file."""
+
+version = 2
+"""
+The version of the snapshot format, which follows `magic` in every
+snapshot file. Snapshots with a different version can't be opened.
+"""
+
+_version = struct.Struct('<I')
+_header_keys = frozenset(['created', 'current', 'teams', 'players',
+                          'seasons'])
+_trailer = struct.Struct('<QI')
+
+
+class SnapshotError (Exception):
+    """
+    Raised when a file isn't a snapshot that can be read.
+    """
+    pass
+
+
+def export(db, fpath, years, stypes=None):
+    """
+    Writes a snapshot of the seasons in `years` to `fpath`. Every
+    season phase in `stypes` (which defaults to all of them) is
+    included. The file is written to a temporary file first, so an
+    existing snapshot at `fpath` is only replaced once the new one is
+    complete. A dictionary with the number of players and the number
+    of per-game rows in each season is returned.
+    """
+    if stypes is None:
+        stypes = ['Preseason', 'Regular', 'Postseason']
+    q = 'SELECT %s FROM player ORDER BY player_id' \
+        % nfldb.select_columns(nfldb.Player)
+    with nfldb.Tx(db) as cursor:
+        cursor.execute(q)
+        players = [dict(r) for r in cursor.fetchall()]
+    pindex = dict((r['player_id'], i) for i, r in enumerate(players))
+    teams = sorted(t[0] for t in nfldb.team.teams)
+    tindex = dict((t, i) for i, t in enumerate(teams))
+
+    counts = {'players': len(players)}
+    tmp = '%s.%d.tmp' % (fpath, os.getpid())
+    with open(tmp, 'wb') as f:
+        w = _Writer(f)
+        header = {
+            'version': version,
+            'created': time.time(),
+            'current': cache._encode(nfldb.current(db)),
+            'teams': teams,
+            'players': w.blob(cache._encode(players)),
+            'seasons': {},
+        }
+        for year in years:
+            for stype in stypes:
+                season = _export_season(db, w, int(year), stype, pindex,
+                                        tindex)
+                if season is not None:
+                    header['seasons'][(int(year), stype)] = w.blob(season)
+                    counts[(int(year), stype)] = season['rows']
+        w.finish(header)
+    os.rename(tmp, fpath)
+    return counts
+
+
+def _export_season(db, w, year, stype, pindex, tindex):
+    """
+    Writes the columns of a single season with `w` and returns the
+    season's metadata, or `None` if the season has no games.
+    """
+    q = 'SELECT %s FROM game WHERE season_year = %%s AND season_type = %%s ' \
+        'ORDER BY gsis_id' % nfldb.select_columns(nfldb.Game)
+    with nfldb.Tx(db) as cursor:
+        cursor.execute(q, (year, stype))
+        games = [dict(r) for r in cursor.fetchall()]
+    if len(games) == 0:
+        return None
+    gindex = dict((g['gsis_id'], i) for i, g in enumerate(games))
+
+    where = 'game.season_year = %s AND game.season_type = %s'
+    q = '''
+        SELECT play_player.player_id, play_player.gsis_id,
+               MIN(play_player.team) AS team, {sum_fields}
+        FROM {play_player}
+        JOIN game ON game.gsis_id = play_player.gsis_id
+        WHERE {where}
+        GROUP BY play_player.player_id, play_player.gsis_id
+    '''.format(sum_fields=nflcmd._sum_fields(), where=where,
+               play_player=nflcmd.aggtables.play_player_table(
+                   db, [(year, stype)]))
+    with nfldb.Tx(db) as cursor:
+        cursor.execute(q, (year, stype))
+        rows = [r for r in cursor.fetchall() if r['player_id'] in pindex]
+    rows.sort(key=lambda r: (pindex[r['player_id']], gindex[r['gsis_id']]))
+
+    columns = {
+        'player': w.column([pindex[r['player_id']] for r in rows], '<i4'),
+        'game': w.column([gindex[r['gsis_id']] for r in rows], '<i4'),
+        'team': w.column([tindex.get(str(r['team']), 0) for r in rows],
+                         '<i2'),
+    }
+    for cat in nflcmd._player_categories:
+        values = [r[cat] for r in rows]
+        if any(values):
+            dtype = '<f4' if nfldb.stat_categories[cat].is_real else '<i4'
+            columns[cat] = w.column(values, dtype)
+
+    q = '''
+        SELECT play_player.player_id, play_player.gsis_id,
+               play_player.kicking_fgm AS made,
+               CASE WHEN play_player.kicking_fgm = 1
+                   THEN play_player.kicking_fgm_yds
+                   ELSE play_player.kicking_fgmissed_yds
+               END AS yds
+        FROM play_player
+        JOIN game ON game.gsis_id = play_player.gsis_id
+        WHERE play_player.kicking_fga = 1 AND {where}
+    '''.format(where=where)
+    with nfldb.Tx(db) as cursor:
+        cursor.execute(q, (year, stype))
+        fgs = [r for r in cursor.fetchall() if r['player_id'] in pindex]
+    fg_columns = {
+        'player': w.column([pindex[r['player_id']] for r in fgs], '<i4'),
+        'game': w.column([gindex[r['gsis_id']] for r in fgs], '<i4'),
+        'made': w.column([r['made'] for r in fgs], '<i1'),
+        'yds': w.column([r['yds'] or 0 for r in fgs], '<i2'),
+    }
+    return {
+        'rows': len(rows),
+        'games': cache._encode(games),
+        'columns': columns,
+        'fg_rows': len(fgs),
+        'fg_columns': fg_columns,
+    }
+
+
+class _Writer (object):
+    """
+    Appends columns and pickled blobs to a snapshot file, remembering
+    where each was written. Columns are aligned to 8 bytes.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.f.write(magic + _version.pack(version))
+        self.offset = len(magic) + _version.size
+
+    def _write(self, data):
+        pad = -self.offset % 8
+        self.f.write(b'\0' * pad)
+        self.offset += pad
+        start = self.offset
+        self.f.write(data)
+        self.offset += len(data)
+        return start
+
+    def column(self, values, dtype):
+        a = np.asarray(values, dtype=dtype)
+        return (self._write(a.tobytes()), len(a), dtype)
+
+    def blob(self, obj):
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        return (self._write(data), len(data))
+
+    def finish(self, header):
+        offset, size = self.blob(header)
+        self.f.write(_trailer.pack(offset, size))
+
+
+class Snapshot (object):
+    """
+    An open snapshot file. Seasons are keyed by `(season_year,
+    season_type)` pairs, like the seasons of `nflcmd.cache.fetchall`.
+    """
+    def __init__(self, fpath):
+        assert available, 'NumPy is required to read snapshots'
+        self.path = fpath
+        with open(fpath, 'rb') as f:
+            try:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                raise SnapshotError('%s is not an nflcmd snapshot' % fpath)
+        start = len(magic) + _version.size
+        if len(self._mm) < start + _trailer.size \
+                or self._mm[:len(magic)] != magic:
+            raise SnapshotError('%s is not an nflcmd snapshot' % fpath)
+        if _version.unpack(self._mm[len(magic):start])[0] != version:
+            raise SnapshotError(
+                '%s was written by a different version of nflcmd. Rebuild '
+                'it with "nflcmd snapshot".' % fpath)
+        offset, size = _trailer.unpack(self._mm[-_trailer.size:])
+        header = self._blob((offset, size))
+        if not isinstance(header, dict) or not _header_keys <= set(header):
+            raise self._damaged()
+        self.created = header['created']
+        """When the snapshot was written, in seconds since the epoch."""
+        self.teams = header['teams']
+        self._current = cache._decode(header['current'])
+        self._players_at = header['players']
+        self._seasons_at = header['seasons']
+        self._players = None
+        self._player_index = None
+        self._names = None
+        self._seasons = {}
+
+    def close(self):
+        self._mm.close()
+
+    def _blob(self, at):
+        offset, size = at
+        if offset + size > len(self._mm):
+            raise self._damaged()
+        try:
+            return pickle.loads(self._mm[offset:offset+size])
+        except Exception:
+            # Unpickling garbage can raise nearly anything.
+            raise self._damaged()
+
+    def _damaged(self):
+        return SnapshotError('%s is damaged or incomplete. Rebuild it with '
+                             '"nflcmd snapshot".' % self.path)
+
+    def current(self):
+        """
+        Returns the triple of `nfldb.current` at the time the snapshot
+        was written.
+        """
+        return self._current
+
+    def seasons(self):
+        """
+        Returns a sorted list of the `(season_year, season_type)`
+        pairs in the snapshot.
+        """
+        return sorted(self._seasons_at)
+
+    def has_season(self, season):
+        return cache._season_key(season) in self._seasons_at
+
+    @property
+    def players(self):
+        """
+        The rows of the player table, sorted by player id.
+        """
+        if self._players is None:
+            self._players = cache._decode(self._blob(self._players_at))
+            self._player_index = dict((r['player_id'], i)
+                                      for i, r in enumerate(self._players))
+        return self._players
+
+    def player_index(self, player_id):
+        """
+        Returns the position of the player with `player_id` in
+        `players`, or `None` if the player isn't in the snapshot.
+        """
+        self.players
+        return self._player_index.get(player_id)
+
+    def player(self, i):
+        """
+        Returns the `nfldb.Player` at position `i` of `players`.
+        """
+        return nfldb.Player.from_row(None, self.players[i])
+
+    def names(self):
+        """
+        Returns a `nflcmd.names.NameIndex` of the players in the
+        snapshot, for use with `nflcmd.search`.
+        """
+        if self._names is None:
+            self._names = names.NameIndex(self.created, self.players)
+        return self._names
+
+    def season(self, season):
+        """
+        Returns the `nflcmd.snapshot.Season` for a `(season_year,
+        season_type)` pair, or `None` if it isn't in the snapshot.
+        """
+        key = cache._season_key(season)
+        if key not in self._seasons_at:
+            return None
+        s = self._seasons.get(key)
+        if s is None:
+            s = self._seasons[key] = Season(self, key,
+                                            self._blob(self._seasons_at[key]))
+        return s
+
+    def column(self, at):
+        """
+        Returns the column written at `at` as a read-only NumPy array
+        backed directly by the mapped file.
+        """
+        offset, count, dtype = at
+        return np.frombuffer(self._mm, dtype=dtype, count=count,
+                             offset=offset)
+
+
+class Season (object):
+    """
+    The per-game totals, games and field goals of one season phase of
+    one year in a `nflcmd.snapshot.Snapshot`. Rows are sorted by player
+    and then by game, and games are sorted by GSIS identifier.
+    """
+    def __init__(self, snap, key, meta):
+        self.snap = snap
+        self.key = key
+        self.rows = meta['rows']
+        self._meta = meta
+        self._games = None
+        self._weeks = None
+        self._columns = {}
+
+    @property
+    def games(self):
+        """A list of `nfldb.Game` objects, sorted by GSIS identifier."""
+        if self._games is None:
+            self._games = [nfldb.Game.from_row(None, g)
+                           for g in cache._decode(self._meta['games'])]
+        return self._games
+
+    @property
+    def weeks(self):
+        """An array with the week of each game in `games`."""
+        if self._weeks is None:
+            self._weeks = np.array([g.week for g in self.games])
+        return self._weeks
+
+    def column(self, name):
+        """
+        Returns the column `name` of the per-game totals, which is
+        either a player statistical category or one of `player`,
+        `game` (positions in `nflcmd.snapshot.Snapshot.players` and
+        `games`) or `team` (a position in `teams`). Categories that
+        aren't stored are all zero.
+        """
+        c = self._columns.get(name)
+        if c is None:
+            at = self._meta['columns'].get(name)
+            if at is None:
+                c = np.zeros(self.rows, dtype='<i4')
+            else:
+                c = self.snap.column(at)
+            self._columns[name] = c
+        return c
+
+    def fg_column(self, name):
+        """
+        Returns the column `name` of the field goal attempts: `player`,
+        `game`, `made` (`1` or `0`) or `yds`.
+        """
+        return self.snap.column(self._meta['fg_columns'][name])
+
+    def player_rows(self, i):
+        """
+        Returns the slice of rows belonging to the player at position
+        `i` of `nflcmd.snapshot.Snapshot.players`, which is found with
+        a binary search.
+        """
+        col = self.column('player')
+        return slice(*np.searchsorted(col, [i, i + 1]))
+
+    def mask(self, week_range=None):
+        """
+        Returns a boolean mask of the rows in games in `week_range`
+        (or every row if it's `None`).
+        """
+        if week_range is None:
+            return np.ones(self.rows, dtype=bool)
+        return np.in1d(self.weeks, [int(w) for w in week_range])[
+            self.column('game')]
+
+    def fg_histogram(self, player, games):
+        """
+        Returns a `nflcmd.FieldGoals` histogram of the attempts by the
+        player at position `player` in the games at the positions in
+        `games`.
+        """
+        hist = nflcmd.FieldGoals()
+        sel = (self.fg_column('player') == player) \
+            & np.in1d(self.fg_column('game'), list(games))
+        for made, yds in zip(self.fg_column('made')[sel],
+                             self.fg_column('yds')[sel]):
+            for name, start, end in nflcmd.fg_ranges:
+                if start <= yds <= end:
+                    counts = hist.counts.setdefault(name, [0, 0])
+                    counts[0] += int(made)
+                    counts[1] += 1
+                    break
+        return hist
+
+
+def _stats(season, rows):
+    """
+    Returns a dictionary of the totals of every stored category over
+    the rows selected by `rows` (a slice or an index array).
+    """
+    stats = {}
+    for cat in season._meta['columns']:
+        if cat in nflcmd._player_category_set:
+            v = season.column(cat)[rows].sum()
+            if v != 0:
+                stats[cat] = v.item()
+    return stats
+
+
+def game_log(snap, player, year, stype, week_range=None):
+    """
+    Like `nflcmd.game_log`, but reads the games of the `nfldb.Player`
+    from the snapshot `snap`. The rows aren't attached to a database,
+    so their field goal histograms are computed from the snapshot too.
+    """
+    season = snap.season((year, stype))
+    i = snap.player_index(player.player_id)
+    if season is None or i is None:
+        return []
+    sl = season.player_rows(i)
+    mask = season.mask(week_range)[sl]
+    rows = []
+    for r in np.arange(sl.start, sl.stop)[mask]:
+        game = season.games[season.column('game')[r]]
+        team = snap.teams[season.column('team')[r]]
+        stats = _stats(season, slice(r, r + 1))
+        pstat = nfldb.PlayPlayer(None, game.gsis_id, None, None,
+                                 player.player_id, team, stats)
+        row = nflcmd.Game(None, game, team, pstat)
+        row._fg_hist = season.fg_histogram(i, [season.column('game')[r]])
+        rows.append(row)
+    return rows
+
+
+def totals(snap, player, i, label, seasons, week_range=None):
+    """
+    Returns a `nflcmd.Totals` row with the totals of the player at
+    position `i` of `snap.players` over `seasons`, or `None` if the
+    player has no games in them. `label` is used as the year of the
+    row and `player` is attached to it.
+    """
+    stats, gsis_ids, teams, passing_300 = {}, [], [], 0
+    hist = nflcmd.FieldGoals()
+    for key in seasons:
+        season = snap.season(key)
+        if season is None:
+            continue
+        sl = season.player_rows(i)
+        idx = np.arange(sl.start, sl.stop)[season.mask(week_range)[sl]]
+        if len(idx) == 0:
+            continue
+        for k, v in _stats(season, idx).items():
+            stats[k] = stats.get(k, 0) + v
+        gids = season.column('game')[idx]
+        gsis_ids += [season.games[g].gsis_id for g in gids]
+        teams += [snap.teams[t] for t in season.column('team')[idx]]
+        passing_300 += int((season.column('passing_yds')[idx] >= 300).sum())
+        hist += season.fg_histogram(i, gids)
+    if len(gsis_ids) == 0:
+        return None
+    pstat = nfldb.PlayPlayer(None, None, None, None, player.player_id, None,
+                             stats)
+    row = nflcmd.Totals(None, label, pstat, gsis_ids, teams, passing_300,
+                        player=player)
+    row._fg_hist = hist
+    return row
+
+
+def season_log(snap, player, years, stype, week_range=None):
+    """
+    Like `nflcmd.season_log`, but reads the seasons of the
+    `nfldb.Player` from the snapshot `snap`.
+    """
+    i = snap.player_index(player.player_id)
+    if i is None:
+        return []
+    rows = []
+    for year in years:
+        row = totals(snap, player, i, year, [(year, stype)], week_range)
+        if row is not None:
+            rows.append(row)
+    return rows
+
+
+def stat_matrix(snap, cats, years, stype, week_range=None, pos=None,
+                teams=None):
+    """
+    Like `nflcmd.matrix.StatMatrix.load`, but sums the columns of the
+    snapshot `snap` instead of querying the database. Only the columns
+    in `cats` of the seasons in `years` are read.
+    """
+    cats = [c for c in nflcmd._player_categories if c in set(cats)]
+    nplayers = len(snap.players)
+    data = np.zeros((nplayers, len(cats) + 1))
+    for year in years:
+        season = snap.season((year, stype))
+        if season is None:
+            continue
+        mask = season.mask(week_range)
+        player = season.column('player')[mask]
+        data[:, 0] += np.bincount(player, minlength=nplayers)
+        for j, cat in enumerate(cats, 1):
+            data[:, j] += np.bincount(player, minlength=nplayers,
+                                      weights=season.column(cat)[mask])
+
+    keep = data[:, 0] > 0
+    if pos:
+        pos = set(str(nfldb.Enums.player_pos[p]) for p in pos)
+        keep &= np.array([str(r['position']) in pos for r in snap.players])
+    if teams:
+        teams = set(teams)
+        keep &= np.array([str(r['team']) in teams for r in snap.players])
+    idx = np.flatnonzero(keep)
+    player_ids = [snap.players[i]['player_id'] for i in idx]
+    return matrix.StatMatrix(player_ids, ['game_count'] + cats, data[idx])
+
+
+def rank(snap, cats, years, stype, week_range, pos, teams, limit, mins,
+         label):
+    """
+    Returns `nflcmd.Totals` rows for the top `limit` players sorted by
+    the columns in `cats`, like `nflcmd.cmds.rank.rank_matrix`, read
+    from the snapshot `snap`. Only players with at least the values in
+    the dictionary `mins` are ranked. `label` is used as the year of
+    each row.
+    """
+    load = set()
+    for name in list(cats) + list(mins):
+        load.update(matrix.columns(name))
+    m = stat_matrix(snap, load, years, stype, week_range, pos, teams)
+    mask = m.qualified(mins)
+    nonzero = np.zeros(len(m), dtype=bool)
+    for cat in cats:
+        nonzero |= m.column(cat) != 0
+    seasons = [(year, stype) for year in years]
+    rows = []
+    for r in m.top(cats, limit, mask & nonzero):
+        i = snap.player_index(m.player_ids[r])
+        rows.append(totals(snap, snap.player(i), i, label, seasons,
+                           week_range))
+    return rows
@@ -64,5 +64,5 @@ setup(
                 ('share/doc/nflcmd/doc', docfiles),
                ],
     install_requires=install_requires,
-    scripts=['scripts/nflstats']
+    scripts=['scripts/nflstats', 'scripts/nflteam', 'scripts/nflcmd']
 )